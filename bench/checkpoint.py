@@ -0,0 +1,67 @@
+"""
+Measures the cost of checkpointing a session history message by message, and how long resuming it takes
+
+    python -m bench.checkpoint [--snapshot-every 1000]
+
+Appends are timed one message at a time, the way a session writes them, so the numbers include the compactions
+triggered along the way. Recovery replays the snapshot plus the log tail of a 10k message session
+"""
+import argparse
+import tempfile
+import time
+
+from bench.message_store import MESSAGES, wire_messages
+from llm.checkpoint import CheckpointSettings, CheckpointStore
+from llm.history import MessageHistory
+from llm.openai.models.record import MessageRecord
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--snapshot-every", type=int, default=1_000)
+    args = parser.parse_args()
+
+    records = [MessageRecord.from_wire_json(message) for message in wire_messages()]
+    settings = CheckpointSettings(path=tempfile.mkdtemp(prefix="aeris-bench-"), snapshot_every=args.snapshot_every)
+
+    store = CheckpointStore(settings)
+    session_log = store.open("bench")
+    history = MessageHistory()
+
+    slowest = 0.0
+    start = time.perf_counter()
+    for record in records:
+        appended = time.perf_counter()
+
+        history.append(record)
+        session_log.append([record])
+        if session_log.needs_snapshot:
+            session_log.snapshot(history)
+
+        slowest = max(slowest, time.perf_counter() - appended)
+
+    append_seconds = time.perf_counter() - start
+
+    sync_start = time.perf_counter()
+    session_log.sync()
+    sync_seconds = time.perf_counter() - sync_start
+
+    store.close()
+
+    store = CheckpointStore(settings)
+    start = time.perf_counter()
+    restored = MessageHistory(store.open("bench").read())
+    recover_seconds = time.perf_counter() - start
+    store.close()
+
+    assert len(restored) == MESSAGES
+    assert [record.wire_json() for record in restored] == [record.wire_json() for record in records]
+
+    print(f"messages              {MESSAGES} (snapshot every {args.snapshot_every})")
+    print(f"append                {append_seconds / MESSAGES * 1e6:8.1f} us/message mean  {slowest * 1e3:8.2f} ms slowest")
+    print(f"final fsync           {sync_seconds * 1e3:8.2f} ms")
+    print(f"recover               {recover_seconds * 1e3:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
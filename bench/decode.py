@@ -0,0 +1,96 @@
+"""
+Compares decoding large chat and embedding responses through python dicts with validating the raw response bytes
+
+    python -m bench.decode
+"""
+import base64
+import json
+import random
+import timeit
+from array import array
+from typing import Any, Callable
+
+import requests
+
+from llm.openai.client import BaseClient
+from llm.openai.models.chat import CreateChatResponse
+from llm.openai.models.embeddings import EmbeddingResponse
+from llm.openai.transport import TransportResponse
+
+ITERATIONS = 20
+DIMENSIONS = 3072
+EMBEDDINGS = 64
+
+
+def response(payload: dict[str, Any]) -> TransportResponse:
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = json.dumps(payload).encode()
+
+    return TransportResponse(resp)
+
+
+def chat_payload() -> dict[str, Any]:
+    # A long answer that also makes a batch of tool calls with sizeable arguments
+    content = " ".join(random.choice(["lights", "kitchen", "calendar", "tomorrow", "meeting"]) for _ in range(50_000))
+    tool_calls = [
+        {
+            "id": f"call_{i}",
+            "type": "function",
+            "function": {
+                "name": "write_file",
+                "arguments": json.dumps({"file_path": f"notes/{i}.txt", "content": content[:20_000]}),
+            },
+        }
+        for i in range(8)
+    ]
+
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "tool_calls": tool_calls},
+                "logprobs": None,
+                "finish_reason": "tool_calls",
+            }
+        ],
+        "usage": {"prompt_tokens": 1000, "completion_tokens": 50_000, "total_tokens": 51_000},
+    }
+
+
+def embedding_payload(encoding_format: str) -> dict[str, Any]:
+    data = []
+    for i in range(EMBEDDINGS):
+        vector = [random.uniform(-0.1, 0.1) for _ in range(DIMENSIONS)]
+
+        if encoding_format == "base64":
+            data.append({"object": "embedding", "index": i, "embedding": base64.b64encode(array("f", vector).tobytes()).decode()})
+        else:
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+
+    return {"object": "list", "data": data, "model": "text-embedding-3-large"}
+
+
+def report(name: str, size: int, bench: Callable[[], object]) -> None:
+    seconds = timeit.timeit(bench, number=ITERATIONS) / ITERATIONS
+    print(f"{name:<42} {size / 1024:9.1f} KiB {seconds * 1e3:9.2f} ms")
+
+
+def main() -> None:
+    chat = response(chat_payload())
+    report("chat: json.loads + CreateChatResponse(**)", len(chat.content), lambda: CreateChatResponse(**chat.json()))
+    report("chat: model_validate_json", len(chat.content), lambda: BaseClient._decode_chat(chat))
+
+    floats = response(embedding_payload("float"))
+    packed = response(embedding_payload("base64"))
+    report("embeddings: float json + dicts", len(floats.content), lambda: EmbeddingResponse(**floats.json()))
+    report("embeddings: float json + bytes", len(floats.content), lambda: BaseClient._decode_embedding(floats))
+    report("embeddings: base64 + bytes", len(packed.content), lambda: BaseClient._decode_embedding(packed))
+
+
+if __name__ == "__main__":
+    main()
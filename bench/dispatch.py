@@ -0,0 +1,68 @@
+"""
+Micro benchmark of the per call overhead of dispatching a tool call, excluding the tool body itself
+
+    python -m bench.dispatch
+"""
+import inspect
+import timeit
+from typing import Annotated, Any, get_args
+
+from llm.openai.client import Client
+from llm.session import Inject, Param, Session, SessionFunction, SessionGroup
+
+ITERATIONS = 100_000
+
+group = SessionGroup()
+
+
+@group.function("A tool with model supplied and injected parameters")
+def tool(
+    file_path: Annotated[str, Param(description="A path")],
+    keywords: Annotated[list[str], Param(description="Some keywords")],
+    count: Annotated[int, Param(description="A count")],
+    session: Annotated[Session, Inject(Session)],
+    client: Annotated[Client, Inject(Client)],
+) -> str:
+    return file_path
+
+
+def legacy_resolve_injected_params(session: Session, func: Any) -> dict[str, Any]:
+    # The signature walk the session used to do on every call before dispatch plans were compiled
+    sig = inspect.signature(func)
+
+    resolved_values = {}
+    for name, param in sig.parameters.items():
+        args = get_args(param.annotation)
+
+        if len(args) != 2 or not isinstance(args[1], Inject):
+            continue
+
+        if args[1].requested_type in session.injection_mapping:
+            resolved_values[name] = session.injection_mapping[args[1].requested_type]
+
+    return resolved_values
+
+
+def main() -> None:
+    session = Session(token="", default_model="", response_callback=None)
+    session.add_group(group)
+
+    function: SessionFunction = session.functions["tool"]
+    arguments = {"file_path": "notes.txt", "keywords": ["a", "b", "c"], "count": 3}
+
+    def legacy() -> None:
+        kwargs = {**arguments, **legacy_resolve_injected_params(session, function.callable)}
+        function.callable(**kwargs)
+
+    def planned() -> None:
+        function.callable(**session._prepare_arguments(function, arguments))
+
+    for name, bench in (("inspect.signature per call", legacy), ("compiled plan", planned)):
+        seconds = timeit.timeit(bench, number=ITERATIONS)
+        print(f"{name:<28} {seconds / ITERATIONS * 1e6:8.2f} us/dispatch")
+
+    session.close()
+
+
+if __name__ == "__main__":
+    main()
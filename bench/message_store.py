@@ -0,0 +1,98 @@
+"""
+Compares the memory held by a conversation history of pydantic ChatMessages with the compact MessageHistory,
+and how long it takes to scan and encode each
+
+    python -m bench.message_store
+"""
+import gc
+import json
+import timeit
+import tracemalloc
+from typing import Any, Callable
+
+from llm.history import MessageHistory
+from llm.openai.encoder import ChatRequestEncoder
+from llm.openai.models.chat import ChatMessage
+
+MESSAGES = 10_000
+SCANS = 20
+
+
+def wire_messages() -> list[str]:
+    # A tool heavy conversation, as it comes back from the api: a prompt, a tool call, its result and an answer
+    messages = []
+
+    for i in range(MESSAGES // 4):
+        call_id = f"call_{i:08d}"
+        messages += [
+            {"role": "user", "content": f"turn {i} on the kitchen lights and tell me what is on my calendar"},
+            {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": call_id,
+                        "type": "function",
+                        "function": {
+                            "name": "control_room_light",
+                            "arguments": json.dumps({"room": "kitchen", "on": True, "brightness": i % 100}),
+                        },
+                    }
+                ],
+            },
+            {"role": "tool", "name": "control_room_light", "tool_call_id": call_id, "content": "ok"},
+            {"role": "assistant", "content": f"The kitchen lights are on, nothing is planned for day {i}"},
+        ]
+
+    return [json.dumps(message) for message in messages]
+
+
+def measure(build: Callable[[list[str]], Any], raw: list[str]) -> tuple[Any, int]:
+    gc.collect()
+    tracemalloc.start()
+
+    history = build(raw)
+
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return history, size
+
+
+def build_models(raw: list[str]) -> list[ChatMessage]:
+    return [ChatMessage.model_validate_json(message) for message in raw]
+
+
+def build_records(raw: list[str]) -> MessageHistory:
+    history = MessageHistory()
+    for message in raw:
+        history.append(ChatMessage.model_validate_json(message))
+
+    return history
+
+
+def main() -> None:
+    raw = wire_messages()
+
+    models, models_size = measure(build_models, raw)
+    records, records_size = measure(build_records, raw)
+
+    print(f"{'list[ChatMessage]':<20} {models_size / 1024:10.1f} KiB per {MESSAGES} messages")
+    print(f"{'MessageHistory':<20} {records_size / 1024:10.1f} KiB per {MESSAGES} messages")
+
+    for name, history in (("list[ChatMessage]", models), ("MessageHistory", records)):
+        def scan() -> int:
+            return sum(1 for message in history if message.tool_calls)
+
+        def encode() -> str:
+            # A fresh encoder every time, the cost of encoding the history once
+            return ChatRequestEncoder().encode("gpt-4o", history, [])
+
+        scan_seconds = timeit.timeit(scan, number=SCANS) / SCANS
+        encode_seconds = timeit.timeit(encode, number=SCANS) / SCANS
+        print(f"{name:<20} scan {scan_seconds * 1e3:8.2f} ms  encode {encode_seconds * 1e3:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
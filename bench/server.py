@@ -0,0 +1,205 @@
+"""
+Local stand-in for the openai chat completions and embeddings endpoints, used to benchmark without the live api.
+Chat responses are taken in order from a script of assistant messages, embeddings are deterministic per input
+"""
+import base64
+import hashlib
+import json
+import socket
+import threading
+import time
+from array import array
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+
+def tool_call(id: str, name: str, arguments: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": id,
+        "type": "function",
+        "function": {"name": name, "arguments": json.dumps(arguments)},
+    }
+
+
+class RecordedRequest:
+    def __init__(self, path: str, size: int, received_at: float) -> None:
+        self.path = path
+        self.size = size
+        self.received_at = received_at
+
+
+class MockOpenAIServer:
+    def __init__(self, *, latency: float = 0.0, dimensions: int = 3072) -> None:
+        # Seconds every response is held back, stands in for the time the model takes
+        self.latency = latency
+        self.dimensions = dimensions
+
+        self.requests: list[RecordedRequest] = []
+
+        self._script: deque[dict[str, Any]] = deque()
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+
+    @property
+    def url(self) -> str:
+        assert self._server
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def queue(self, *messages: dict[str, Any]) -> None:
+        """
+        Adds assistant messages to the script, each chat completion request answers with the next one
+        """
+        with self._lock:
+            self._script.extend(messages)
+
+    def start(self) -> "MockOpenAIServer":
+        mock = self
+
+        class Handler(_Handler):
+            server_mock = mock
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+        return self
+
+    def close(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _next_message(self) -> dict[str, Any]:
+        with self._lock:
+            if self._script:
+                return self._script.popleft()
+
+        return {"role": "assistant", "content": "done"}
+
+    def _record(self, path: str, size: int) -> None:
+        with self._lock:
+            self.requests.append(RecordedRequest(path, size, time.perf_counter()))
+
+    def _embedding(self, text: str, dimensions: int | None) -> str:
+        # Repeatable pseudo random vector, the same text always embeds the same
+        seed = hashlib.sha256(text.encode()).digest()
+        vector = array("f", (((seed[i % len(seed)] + i) % 255) / 255 - 0.5 for i in range(dimensions or self.dimensions)))
+
+        return base64.b64encode(vector.tobytes()).decode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_mock: MockOpenAIServer
+
+    def setup(self) -> None:
+        super().setup()
+        # Headers and body go out in separate writes, without this nagle holds the body back for a delayed ack
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["content-length"]))
+        request = json.loads(body)
+
+        self.server_mock._record(self.path, len(body))
+
+        if self.server_mock.latency:
+            time.sleep(self.server_mock.latency)
+
+        # Rough token counts so usage accounting has something to report
+        prompt_tokens = len(body) // 4
+
+        if self.path.endswith("/embeddings"):
+            self._embeddings(request, prompt_tokens)
+        elif request.get("stream"):
+            self._stream_chat(request, prompt_tokens)
+        else:
+            self._chat(request, prompt_tokens)
+
+    def _embeddings(self, request: dict[str, Any], prompt_tokens: int) -> None:
+        inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+
+        self._send_json(
+            {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": self.server_mock._embedding(text, request.get("dimensions"))}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+            }
+        )
+
+    def _chat(self, request: dict[str, Any], prompt_tokens: int) -> None:
+        message = self.server_mock._next_message()
+        usage = _usage(prompt_tokens, message)
+
+        self._send_json(
+            {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+        )
+
+    def _stream_chat(self, request: dict[str, Any], prompt_tokens: int) -> None:
+        message = self.server_mock._next_message()
+
+        deltas: list[dict[str, Any]] = []
+        if message.get("content"):
+            deltas += [{"content": word + " "} for word in message["content"].split(" ")]
+
+        for i, call in enumerate(message.get("tool_calls") or []):
+            deltas.append(
+                {"tool_calls": [{"index": i, "id": call["id"], "type": "function", "function": {"name": call["function"]["name"], "arguments": ""}}]}
+            )
+            deltas.append({"tool_calls": [{"index": i, "function": {"arguments": call["function"]["arguments"]}}]})
+
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+
+        chunks: list[dict[str, Any]] = [{"index": 0, "delta": delta, "finish_reason": None} for delta in deltas]
+        chunks.append({"index": 0, "delta": {}, "finish_reason": "stop"})
+
+        for choice in chunks:
+            chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": request["model"], "choices": [choice]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        # Usage comes last on a chunk of its own when the request asks for it with stream_options
+        usage_chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": request["model"], "choices": [], "usage": _usage(prompt_tokens, message)}
+        self._write_chunk(f"data: {json.dumps(usage_chunk)}\n\n".encode())
+
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, payload: dict[str, Any]) -> None:
+        body = json.dumps(payload).encode()
+
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _usage(prompt_tokens: int, message: dict[str, Any]) -> dict[str, int]:
+    completion_tokens = len(json.dumps(message)) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
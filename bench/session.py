@@ -0,0 +1,179 @@
+"""
+End to end benchmark of Session.make_request against a local stand-in of the openai api, driving multi tool
+conversations through the real domain tool groups
+
+    python -m bench.session [--turns 50] [--latency 0.05] [--content-size 2000] [--stream]
+
+Reports turn latency percentiles, the request bytes sent per turn, the time spent encoding requests and decoding
+responses, and the overhead the session adds to dispatching tool calls on top of the tools themselves. Dispatch is
+wall time per call, so with parallel tool calls it includes waiting for a free executor thread
+"""
+import argparse
+import functools
+import inspect
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Callable
+
+from bench.server import MockOpenAIServer, tool_call
+from domain.core import memory
+from domain.core.local import LocalMemoryStore
+from domain.core.store import MemorySettings, MemoryStore
+from domain.home import room
+from domain.home.state import HouseSettings, HouseState
+from domain.primitives import file, time as time_group
+from llm.openai.client import BaseClient
+from llm.session import GPT4O_MINI, Session
+
+
+class Timer:
+    def __init__(self) -> None:
+        self.seconds = 0.0
+        self.calls = 0
+
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def timed_async(*args: Any, **kwargs: Any) -> Any:
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.seconds += time.perf_counter() - start
+                    self.calls += 1
+
+            return timed_async
+
+        @functools.wraps(func)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.calls += 1
+
+        return timed
+
+
+def conversation(turn: int, workdir: str, content_size: int) -> list[dict[str, Any]]:
+    # One user turn: look around, act on the house and the filesystem, check the result, remember it and answer
+    notes = os.path.join(workdir, f"notes-{turn % 4}.txt")
+    filler = ("the lights in the kitchen are on " * (content_size // 32 + 1))[:content_size]
+
+    return [
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                tool_call(f"{turn}-1", "get_current_time", {"tz_name": "Europe/London"}),
+                tool_call(f"{turn}-2", "get_house_state", {}),
+            ],
+        },
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                tool_call(f"{turn}-3", "control_room_lights", {"room_numbers": [1, 2, 3], "state": turn % 2 == 0}),
+                tool_call(f"{turn}-4", "write_file", {"file_path": notes, "content": filler}),
+            ],
+        },
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                tool_call(f"{turn}-5", "read_file", {"file_path": notes}),
+                tool_call(f"{turn}-6", "get_house_state", {}),
+                tool_call(f"{turn}-7", "store_memory", {"detailed_summary": f"turn {turn} changed the lights", "keywords": ["lights", "notes"]}),
+            ],
+        },
+        {"role": "assistant", "content": filler},
+    ]
+
+
+def percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the server holds every response back")
+    parser.add_argument("--content-size", type=int, default=2000, help="characters of content in answers and written files")
+    parser.add_argument("--dimensions", type=int, default=3072)
+    parser.add_argument("--stream", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    server = MockOpenAIServer(latency=args.latency, dimensions=args.dimensions).start()
+    workdir = tempfile.mkdtemp(prefix="aeris-bench-")
+
+    state_path = os.path.join(workdir, "room_state.json")
+    with open(state_path, "w") as f:
+        json.dump({str(number): {"light_state": False} for number in range(1, 11)}, f)
+
+    house = HouseState(HouseSettings(state_path=state_path))
+    store = LocalMemoryStore(
+        MemorySettings(backend="local", local_path=os.path.join(workdir, "memory"), embedding_dimensions=args.dimensions)
+    )
+
+    session = Session(token="bench", default_model=GPT4O_MINI, response_callback=None, base_url=server.url, stream=args.stream)
+    session.provide(HouseState, house)
+    session.provide(MemoryStore, store)
+
+    for group in (time_group.group, file.group, room.group, memory.group):
+        session.add_group(group)
+
+    # Serialization is timed at the client, the tools themselves are timed so they can be taken out of the dispatch time
+    serialization = Timer()
+    for name in ("_encode_chat", "_decode_chat", "_decode_chat_chunk", "_encode_embedding", "_decode_embedding"):
+        setattr(BaseClient, name, staticmethod(serialization.wrap(getattr(BaseClient, name))))
+
+    tool_bodies = Timer()
+    for function in session.functions.values():
+        function.callable = tool_bodies.wrap(function.callable)
+
+    dispatch = Timer()
+    session._handle_tool_call_async = dispatch.wrap(session._handle_tool_call_async)  # type: ignore[method-assign]
+
+    latencies: list[float] = []
+    turn_bytes: list[int] = []
+
+    try:
+        for turn in range(args.turns):
+            server.queue(*conversation(turn, workdir, args.content_size))
+            sent_before = len(server.requests)
+
+            start = time.perf_counter()
+            session.make_request(f"turn {turn}, sort out the lights and take a note")
+            latencies.append(time.perf_counter() - start)
+
+            turn_bytes.append(sum(request.size for request in server.requests[sent_before:]))
+    finally:
+        session.close()
+        store.close()
+        house.close()
+        server.close()
+
+    print(f"turns                 {args.turns} ({len(server.requests)} requests, {dispatch.calls} tool calls)")
+    print(
+        f"turn latency          p50 {percentile(latencies, 50) * 1e3:8.2f} ms  p90 {percentile(latencies, 90) * 1e3:8.2f} ms"
+        f"  p99 {percentile(latencies, 99) * 1e3:8.2f} ms"
+    )
+    print(f"bytes sent per turn   mean {statistics.mean(turn_bytes) / 1024:8.1f} KiB  last {turn_bytes[-1] / 1024:8.1f} KiB")
+    print(f"serialization         {serialization.seconds / args.turns * 1e3:8.2f} ms/turn over {serialization.calls} calls")
+    print(
+        f"tool dispatch         {(dispatch.seconds - tool_bodies.seconds) / max(dispatch.calls, 1) * 1e6:8.1f} us/call overhead"
+        f" ({tool_bodies.seconds / max(tool_bodies.calls, 1) * 1e6:.1f} us/call in the tools)"
+    )
+
+
+if __name__ == "__main__":
+    main()
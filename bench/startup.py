@@ -0,0 +1,72 @@
+"""
+Measures how long the CLI takes to get to its first prompt, each case in a fresh interpreter
+
+    python -m bench.startup [--runs 5]
+
+Importing main builds everything the chat loop needs, so the time to import it is the time a user waits for the
+prompt. It is measured with the tool schema cache cold, where every tool group is imported and compiled and the
+cache written, and warm, where the groups are left unimported until the model calls them. The bare interpreter and
+importing llm.session on its own are timed for reference
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(statement: str, env: dict[str, str], runs: int) -> float:
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], cwd=ROOT, env=env, check=True)
+        seconds.append(time.perf_counter() - start)
+
+    return statistics.median(seconds)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="aeris-bench-")
+    schema_cache = os.path.join(workdir, "tool_schemas.json")
+
+    state_path = os.path.join(workdir, "room_state.json")
+    with open(state_path, "w") as f:
+        json.dump({str(number): {"light_state": False} for number in range(1, 11)}, f)
+
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in ("AERIS_CHECKPOINT_PATH", "AERIS_TRACE_PATH", "AERIS_METRICS_PORT")
+    }
+    env.update(
+        OPENAI_API_KEY="bench",
+        AERIS_TOOLS_SCHEMA_CACHE_PATH=schema_cache,
+        AERIS_HOUSE_STATE_PATH=state_path,
+        AERIS_MEMORY_WRITE_QUEUE_PATH=os.path.join(workdir, "memory_queue.jsonl"),
+    )
+
+    # Deleting the cache before every run keeps each one cold
+    cold = time_import(f"import os; os.path.exists({schema_cache!r}) and os.unlink({schema_cache!r}); import main", env, args.runs)
+    warm = time_import("import main", env, args.runs)
+
+    interpreter = time_import("pass", env, args.runs)
+    session = time_import("import llm.session", env, args.runs)
+
+    print(f"runs                  {args.runs} (median)")
+    print(f"interpreter           {interpreter * 1e3:8.1f} ms")
+    print(f"import llm.session    {session * 1e3:8.1f} ms")
+    print(f"first prompt, cold    {cold * 1e3:8.1f} ms  (schemas compiled and cached)")
+    print(f"first prompt, warm    {warm * 1e3:8.1f} ms  (schemas from cache, groups not imported)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Bulk import an archive of past conversations or notes into long term memory
+
+    python -m domain.core.ingest archive.jsonl [more.jsonl ...]
+
+Each line of an archive file is a JSON object with a "summary", the "complete" text of the memory and optionally its "keywords"
+"""
+import logging
+import os
+import sys
+from typing import Iterator
+
+from dotenv import load_dotenv
+
+from domain.core.memory import MemoryImport, ingest_memories
+from domain.core.store import create_memory_store
+from llm.openai.client import Client
+from llm.session import configure_logging
+
+log = logging.getLogger(__name__)
+
+
+def read_archives(paths: list[str]) -> Iterator[MemoryImport]:
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield MemoryImport.model_validate_json(line)
+
+
+def main() -> None:
+    load_dotenv()
+    configure_logging()
+
+    if not (token := os.getenv("OPENAI_API_KEY")):
+        raise Exception("'OPENAI_API_KEY not found")
+
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    client = Client(token=token)
+    store = create_memory_store()
+
+    try:
+        imported = ingest_memories(client, store, read_archives(sys.argv[1:]))
+    finally:
+        client.close()
+        store.close()
+
+    print(f"-- Imported {imported} memories --")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import json
+import logging
+import os
+import threading
+from typing import IO, Any, Iterable, Sequence
+
+import numpy as np
+
+from domain.core.store import MemorySettings, MemoryStore
+from llm.tracing import tracer
+
+log = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.f32"
+RECORDS_FILE = "memories.jsonl"
+INDEX_FILE = "index.hnsw"
+META_FILE = "meta.json"
+
+
+class _MemoryRecord:
+    __slots__ = ("summary", "complete", "parent", "keywords")
+
+    def __init__(self, summary: str, complete: str, parent: int | None, keywords: tuple[str, ...]) -> None:
+        self.summary = summary
+        self.complete = complete
+        self.parent = parent
+        self.keywords = keywords
+
+
+class LocalMemoryStore(MemoryStore):
+    """
+    In process memory backend that needs no external services. Embeddings are kept as a float32 matrix in a memory
+    mapped file and searched with a vectorized exact scan, or with an hnswlib graph index once the store is large enough.
+    Memory ids are the 1 based row numbers of the matrix
+    """
+
+    def __init__(self, settings: MemorySettings | None = None) -> None:
+        self.settings = settings or MemorySettings()
+        self.path = self.settings.local_path
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self._lock = threading.RLock()
+
+        self._records: list[_MemoryRecord] = []
+        # Inverted keyword index, the ids of the memories stored with each keyword in insertion order
+        self._postings: dict[str, list[int]] = {}
+        self._dimensions: int | None = None
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        # Squared norm of every row, lets a euclidean scan be a single matrix vector product
+        self._norms = np.empty(0, dtype=np.float32)
+        self._index: Any = None
+
+        self._load()
+
+    def get_complete(self, id: int) -> str | None:
+        with tracer.span("memory.get_complete", backend="local"), self._lock:
+            if not 1 <= id <= len(self._records):
+                return None
+
+            return self._records[id - 1].complete
+
+    def nearest_summaries(
+        self, embedding: Sequence[float], limit: int = 3
+    ) -> list[tuple[int, str]]:
+        with tracer.span("memory.nearest_summaries", backend="local"), self._lock:
+            rows, _ = self._nearest(embedding, limit)
+
+            return [(int(row) + 1, self._records[row].summary) for row in rows]
+
+    def nearest_memories(
+        self, embedding: Sequence[float], limit: int = 3
+    ) -> list[tuple[int, str, str, float]]:
+        with tracer.span("memory.nearest_memories", backend="local"), self._lock:
+            rows, distances = self._nearest(embedding, limit)
+
+            return [
+                (int(row) + 1, self._records[row].summary, self._records[row].complete, float(distance))
+                for row, distance in zip(rows, distances)
+            ]
+
+    def keyword_search(
+        self, keywords: Sequence[str], limit: int = 3
+    ) -> list[tuple[int, str, str, int]]:
+        with tracer.span("memory.keyword_search", backend="local"), self._lock:
+            matches: dict[int, int] = {}
+            for keyword in set(keywords):
+                for id in self._postings.get(keyword, ()):
+                    matches[id] = matches.get(id, 0) + 1
+
+            ranked = sorted(matches.items(), key=lambda match: (match[1], match[0]), reverse=True)[:limit]
+
+            return [
+                (id, self._records[id - 1].summary, self._records[id - 1].complete, count)
+                for id, count in ranked
+            ]
+
+    def insert(
+        self,
+        embedding: Sequence[float],
+        summary: str,
+        complete: str,
+        parent: int | None = None,
+        keywords: Sequence[str] = (),
+    ) -> int:
+        with tracer.span("memory.insert", backend="local", rows=1):
+            return self._append([(embedding, summary, complete, parent, keywords)])
+
+    def insert_many(self, rows: Iterable[tuple[Sequence[float], str, str, Sequence[str]]]) -> None:
+        pending: list[tuple[Sequence[float], str, str, int | None, Sequence[str]]] = [
+            (embedding, summary, complete, None, keywords) for embedding, summary, complete, keywords in rows
+        ]
+
+        with tracer.span("memory.insert_many", backend="local", rows=len(pending)):
+            self._append(pending)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._index is not None:
+                self._index.save_index(os.path.join(self.path, INDEX_FILE))
+
+    def _append(self, rows: list[tuple[Sequence[float], str, str, int | None, Sequence[str]]]) -> int:
+        with self._lock:
+            first_id = len(self._records) + 1
+
+            if not rows:
+                return first_id
+
+            matrix = np.asarray([row[0] for row in rows], dtype=np.float32)
+
+            created = self._dimensions is None
+            if self._dimensions is None:
+                self._dimensions = matrix.shape[1]
+
+                with open(os.path.join(self.path, META_FILE), "w") as f:
+                    json.dump({"dimensions": self._dimensions}, f)
+                    _sync(f)
+            elif matrix.shape[1] != self._dimensions:
+                raise ValueError(
+                    f"Embedding has {matrix.shape[1]} dimensions but the store holds {self._dimensions}"
+                )
+
+            # Vectors are written before their records, a crash in between leaves rows that _load ignores
+            with open(os.path.join(self.path, VECTORS_FILE), "ab") as f:
+                f.write(matrix.tobytes())
+                _sync(f)
+
+            with open(os.path.join(self.path, RECORDS_FILE), "a") as f:
+                f.writelines(
+                    json.dumps({"summary": summary, "complete": complete, "parent": parent, "keywords": list(keywords)})
+                    + "\n"
+                    for _, summary, complete, parent, keywords in rows
+                )
+                _sync(f)
+
+            if created:
+                # The files are only durable once the directory entries that name them are
+                _sync_directory(self.path)
+
+            for _, summary, complete, parent, keywords in rows:
+                self._add_record(_MemoryRecord(summary, complete, parent, tuple(keywords)))
+
+            self._map_vectors()
+            self._norms = np.concatenate([self._norms, np.einsum("ij,ij->i", matrix, matrix)])
+
+            if self._index is not None:
+                self._add_to_index(matrix, np.arange(first_id - 1, len(self._records)))
+
+            return first_id
+
+    def _load(self) -> None:
+        records_path = os.path.join(self.path, RECORDS_FILE)
+        meta_path = os.path.join(self.path, META_FILE)
+
+        if not os.path.exists(meta_path):
+            return
+
+        with open(meta_path) as f:
+            dimensions: int = json.load(f)["dimensions"]
+        self._dimensions = dimensions
+
+        records: list[_MemoryRecord] = []
+        # Byte offset in the records file after each record
+        ends: list[int] = []
+
+        if os.path.exists(records_path):
+            with open(records_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # A partially written trailing record from a crash
+                        break
+
+                    record = json.loads(line)
+                    records.append(
+                        _MemoryRecord(
+                            record["summary"],
+                            record["complete"],
+                            record["parent"],
+                            tuple(record.get("keywords", ())),
+                        )
+                    )
+                    ends.append((ends[-1] if ends else 0) + len(line))
+
+        vectors_path = os.path.join(self.path, VECTORS_FILE)
+        row_bytes = dimensions * 4
+        vectors = os.path.getsize(vectors_path) // row_bytes if os.path.exists(vectors_path) else 0
+
+        # A crash can leave vectors without their record or, if the vectors file was torn, records without their
+        # vector. Only memories complete in both files are kept and both are cut back to them, so the next append
+        # lines up again
+        count = min(len(records), vectors)
+        if os.path.exists(records_path):
+            os.truncate(records_path, ends[count - 1] if count else 0)
+        if os.path.exists(vectors_path):
+            os.truncate(vectors_path, count * row_bytes)
+
+        if count < len(records):
+            log.warning(f"Dropped {len(records) - count} memories whose vectors are missing from {self.path}")
+
+        for memory in records[:count]:
+            self._add_record(memory)
+
+        if not self._records:
+            return
+
+        self._map_vectors()
+        self._norms = np.einsum("ij,ij->i", self._vectors, self._vectors)
+
+        log.info(f"Loaded {len(self._records)} memories from {self.path}")
+
+    def _add_record(self, record: _MemoryRecord) -> None:
+        self._records.append(record)
+
+        for keyword in set(record.keywords):
+            self._postings.setdefault(keyword, []).append(len(self._records))
+
+    def _nearest(self, embedding: Sequence[float], limit: int) -> tuple[np.ndarray, np.ndarray]:
+        # Rows of the closest memories and their euclidean distances, closest first
+        count = len(self._records)
+        if not count or limit < 1:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = np.asarray(embedding, dtype=np.float32)
+        k = min(limit, count)
+
+        if self._ensure_index():
+            labels, squared = self._index.knn_query(query, k=k)
+            rows, squared = labels[0], squared[0]
+        else:
+            # |v - q|^2 = |v|^2 - 2 v.q + |q|^2, the last term is the same for every row so it does not change the order
+            distances = self._norms - 2 * (self._vectors @ query)
+            rows = np.argpartition(distances, k - 1)[:k]
+            rows = rows[np.argsort(distances[rows])]
+            squared = distances[rows] + query @ query
+
+        return rows, np.sqrt(np.maximum(squared, 0))
+
+    def _map_vectors(self) -> None:
+        assert self._dimensions
+        self._vectors = np.memmap(
+            os.path.join(self.path, VECTORS_FILE),
+            dtype=np.float32,
+            mode="r",
+            shape=(len(self._records), self._dimensions),
+        )
+
+    def _ensure_index(self) -> bool:
+        if self._index is not None:
+            return True
+
+        if len(self._records) < self.settings.ann_threshold:
+            return False
+
+        try:
+            import hnswlib
+        except ImportError:
+            return False
+
+        self._index = hnswlib.Index(space="l2", dim=self._dimensions)
+        indexed = 0
+
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if os.path.exists(index_path):
+            self._index.load_index(index_path, max_elements=len(self._records) * 2)
+            indexed = self._index.get_current_count()
+
+        # A saved index holding rows _load dropped is stale and is rebuilt
+        if not indexed or indexed > len(self._records):
+            self._index = hnswlib.Index(space="l2", dim=self._dimensions)
+            self._index.init_index(
+                max_elements=len(self._records) * 2, M=16, ef_construction=200
+            )
+            indexed = 0
+
+        # Size of the candidate list searched per query, hnswlib's default of 10 trades away too much recall
+        self._index.set_ef(self.settings.ann_ef_search)
+
+        # Index whatever the saved index is missing, all of it when building from scratch
+        log.info(f"Building approximate index over {len(self._records) - indexed} memories")
+        self._add_to_index(
+            self._vectors[indexed:], np.arange(indexed, len(self._records))
+        )
+
+        return True
+
+    def _add_to_index(self, matrix: np.ndarray, rows: np.ndarray) -> None:
+        if not len(rows):
+            return
+
+        required = self._index.get_current_count() + len(rows)
+        if required > self._index.get_max_elements():
+            self._index.resize_index(required * 2)
+
+        self._index.add_items(matrix, rows)
+
+
+def _sync(f: IO[Any]) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _sync_directory(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -1,18 +1,26 @@
+import asyncio
 import inspect
 import logging
-from typing import Annotated
+from itertools import islice
+from typing import Annotated, Any, Iterable, Sequence
 
 from llm.openai.models.chat import SYSTEM_ROLE, ChatMessage
 from llm.session import TEXT_EMBEDDING_3_LARGE, Inject, Session, SessionGroup, Param
-from llm.openai.client import Client
+from llm.openai.client import AsyncClient, Client
+from domain.core.store import MemoryStore
+from domain.core.writer import MemoryWriter
 
 from pydantic import BaseModel
-import psycopg
 
 group = SessionGroup()
 
 log = logging.getLogger(__name__)
 
+# Direct recall searches this many times as many memories as it returns and reranks them locally
+RERANK_CANDIDATES = 4
+# Reciprocal rank fusion constant, damps how much a single top rank in one search outweighs the other search
+RRF_K = 60
+
 
 class Memory(BaseModel):
     summary: str
@@ -20,6 +28,12 @@ class Memory(BaseModel):
     conversation: list[ChatMessage]
 
 
+class MemoryImport(BaseModel):
+    summary: str
+    complete: str
+    keywords: list[str] = []
+
+
 @group.function("Store a memory and keyword list describing the memory")
 def store_memory(
     detailed_summary: Annotated[
@@ -34,24 +48,34 @@ def store_memory(
     ],
     session: Annotated[Session, Inject(Session)],
     client: Annotated[Client, Inject(Client)],
-) -> None:
+    store: Annotated[MemoryStore, Inject(MemoryStore)],
+    writer: Annotated[MemoryWriter | None, Inject(MemoryWriter)] = None,
+) -> str | None:
     for kw in keywords:
         if " " in kw:
             raise ValueError("Keywords cannot contain a space")
 
     keywords = [kw.lower() for kw in keywords]
 
-    embedding = client.create_embedding(TEXT_EMBEDDING_3_LARGE, detailed_summary)
+    conversation = "".join(
+        f"{message.role}: {message.content}\n"
+        for message in session.messages
+        if message.content and (message.role == "user" or message.role == "assistant")
+    )
+
+    log.info(f"Saving memory with summary: '{detailed_summary}")
 
-    conversation = ""
-    for message in session.messages:
-        if not message.role == "user" and not message.role == "assistant":
-            continue
+    # With a writer the memory is embedded and stored in the background, it is durable once queued
+    if writer:
+        writer.submit(detailed_summary, conversation, keywords)
+        return "memory saved"
 
-        if message.content:
-            conversation += f"{message.role}: {message.content}\n"
+    embedding = client.create_embedding(
+        TEXT_EMBEDDING_3_LARGE, detailed_summary, dimensions=store.settings.embedding_dimensions
+    )
+    store.insert(embedding.data[0].embedding, detailed_summary, conversation, keywords=keywords)
 
-    save_memory_db(embedding.data[0].embedding, detailed_summary, conversation)
+    return None
 
 
 @group.function("Recall a memory by its id")
@@ -60,44 +84,50 @@ def recall_memory_by_id(
         int,
         Param(description="The id of the memory to remember"),
     ],
+    store: Annotated[MemoryStore, Inject(MemoryStore)],
 ) -> str:
-    with psycopg.connect("dbname=aeris_memory user=jaymadden") as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT complete FROM memory WHERE id = %s", (id,))
-            conversation = cur.fetchone()
+    conversation = store.get_complete(id)
 
     if not conversation:
         return "nothing to remember"
 
-    return conversation[0]
+    return conversation
 
 
 @group.function(
     "Recall a memory based on a given context query sentence",
 )
-def recall_memory(
+async def recall_memory(
     query: Annotated[
         str,
         Param(
             description="A short sentence describing what you are trying to remember"
         ),
     ],
-    client: Annotated[Client, Inject(Client)],
+    keywords: Annotated[
+        list[str],
+        Param(
+            description="List of single words the memory may have been stored with"
+        ),
+    ],
+    client: Annotated[AsyncClient, Inject(AsyncClient)],
     session: Annotated[Session, Inject(Session)],
+    store: Annotated[MemoryStore, Inject(MemoryStore)],
 ) -> str:
+    if store.settings.recall_mode == "direct":
+        return await _recall_direct(query, keywords, client, store)
 
     session = session.clone()
     session.response_callback = None
 
-    embedding = client.create_embedding(TEXT_EMBEDDING_3_LARGE, query)
+    embedding = await client.create_embedding(
+        TEXT_EMBEDDING_3_LARGE, query, dimensions=store.settings.embedding_dimensions
+    )
 
-    with psycopg.connect("dbname=aeris_memory user=jaymadden") as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id,summary FROM memory ORDER BY embedding <-> %s::vector LIMIT 3",
-                (embedding.data[0].embedding,),
-            )
-            conversations = cur.fetchall()
+    # The store is blocking, keep it off the event loop
+    conversations = await asyncio.to_thread(
+        store.nearest_summaries, embedding.data[0].embedding
+    )
 
     if not conversations:
         return "nothing to remember"
@@ -109,7 +139,7 @@ def recall_memory(
     session.messages.pop()
 
     sub_message = ChatMessage(role=SYSTEM_ROLE, content=content)
-    final_result = session._finish_prompt(sub_message, required_call=inspect.unwrap(recall_memory_by_id))
+    final_result = await session._finish_prompt_async(sub_message, required_call=inspect.unwrap(recall_memory_by_id))
 
     if not final_result or not final_result.content:
         return "something broke tell me about it"
@@ -117,21 +147,87 @@ def recall_memory(
     return final_result.content
 
 
-def save_memory_db(
-    embedding: list[float], summary: str, complete: str, parent: int | None = None
-):
-    log.info(f"Saving memory with summary: '{summary}")
-
-    with psycopg.connect("dbname=aeris_memory user=jaymadden") as conn:
-        with conn.cursor() as cur:
-            if not parent:
-                cur.execute(
-                    "INSERT INTO memory (embedding, summary, complete) VALUES (%s, %s, %s)",
-                    (embedding, summary, complete),
-                )
-            else:
-                cur.execute(
-                    "INSERT INTO memory (embedding, summary, complete, parent_memory_id) VALUES (%s, %s, %s)",
-                    (embedding, summary, complete),
-                )
-        conn.commit()
+async def _recall_direct(query: str, keywords: list[str], client: AsyncClient, store: MemoryStore) -> str:
+    # The memories go back to the model in this tool result instead of a nested chat
+    settings = store.settings
+    candidates = settings.recall_limit * RERANK_CANDIDATES
+
+    keywords = list({word for keyword in keywords for word in keyword.lower().split()})
+    keyword_hits = await asyncio.to_thread(store.keyword_search, keywords, candidates) if keywords else []
+
+    # Memories stored with every keyword asked for are answered straight from the keyword index, no embedding needed
+    exact_hits = [hit for hit in keyword_hits if hit[3] == len(keywords)]
+    if exact_hits:
+        return _format_memories(exact_hits, settings.recall_limit, settings.recall_max_chars)
+
+    embedding = await client.create_embedding(TEXT_EMBEDDING_3_LARGE, query, dimensions=settings.embedding_dimensions)
+    nearest = await asyncio.to_thread(store.nearest_memories, embedding.data[0].embedding, candidates)
+
+    return _format_memories(fuse(keyword_hits, nearest), settings.recall_limit, settings.recall_max_chars)
+
+
+def fuse(*rankings: Sequence[tuple[int, str, str, Any]]) -> list[tuple[int, str, str, float]]:
+    """
+    Merges rankings of memories from different searches with reciprocal rank fusion, memories placed high by
+    several searches come first. Ranks are fused instead of scores since keyword counts and distances do not compare
+    :param rankings: (id, summary, complete, score) of the memories each search found, best first
+    :return: (id, summary, complete, fused score) of every memory found, best first
+    """
+    fused: dict[int, tuple[int, str, str, float]] = {}
+
+    for ranking in rankings:
+        for rank, (id, summary, complete, _) in enumerate(ranking, start=1):
+            score = fused[id][3] if id in fused else 0.0
+            fused[id] = (id, summary, complete, score + 1 / (RRF_K + rank))
+
+    return sorted(fused.values(), key=lambda memory: memory[3], reverse=True)
+
+
+def _format_memories(memories: Sequence[tuple[int, str, str, Any]], limit: int, max_chars: int) -> str:
+    if not memories:
+        return "nothing to remember"
+
+    content = "Here are the memories closest to what you are trying to remember, most relevant first\n"
+    for id, summary, complete, _ in memories[:limit]:
+        if len(complete) > max_chars:
+            complete = complete[:max_chars] + "..."
+
+        content += f"\nid: {id} summary: {summary}\n{complete}\n"
+
+    return content
+
+
+def ingest_memories(
+    client: Client,
+    store: MemoryStore,
+    memories: Iterable[MemoryImport],
+    batch_size: int = 1000,
+) -> int:
+    """
+    Bulk imports memories, embedding each batch of summaries in as few requests as possible and
+    streaming the rows into the memory table with COPY instead of one INSERT per memory
+    :param client: the client to embed the summaries with
+    :param store: the store to write the memories to
+    :param memories: the memories to import
+    :param batch_size: how many memories to embed and write per round trip
+    :return: the number of memories imported
+    """
+    imported = 0
+    memory_iter = iter(memories)
+
+    while batch := list(islice(memory_iter, batch_size)):
+        embeddings = client.create_embeddings(
+            TEXT_EMBEDDING_3_LARGE,
+            [memory.summary for memory in batch],
+            dimensions=store.settings.embedding_dimensions,
+        )
+
+        store.insert_many(
+            (embedding, memory.summary, memory.complete, [kw.lower() for kw in memory.keywords])
+            for memory, embedding in zip(batch, embeddings)
+        )
+
+        imported += len(batch)
+        log.info(f"Imported {imported} memories")
+
+    return imported
@@ -0,0 +1,240 @@
+"""
+Schema migrations and vector index management for the postgres memory table
+
+    python -m domain.core.migrations migrate    apply pending migrations and build the configured vector index
+    python -m domain.core.migrations index      rebuild the vector index, e.g. after changing its parameters
+    python -m domain.core.migrations reembed    re-embed every memory not yet at AERIS_MEMORY_EMBEDDING_DIMENSIONS
+
+The embedding column is an untyped vector so memories of different lengths can live side by side while they are
+re-embedded. The vector index is a partial expression index over the memories of the configured length, and the
+store only searches those, so recall keeps working during a backfill and picks up re-embedded rows as they land
+"""
+import argparse
+import logging
+import os
+from typing import Callable, Sequence
+
+import psycopg
+from dotenv import load_dotenv
+from psycopg import Connection
+
+from domain.core.store import MemorySettings
+from llm.openai.client import Client
+from llm.session import TEXT_EMBEDDING_3_LARGE, configure_logging
+
+log = logging.getLogger(__name__)
+
+# pgvector can index at most this many dimensions as vector, longer embeddings are indexed at half precision
+MAX_VECTOR_INDEX_DIMENSIONS = 2000
+INDEX_PREFIX = "memory_embedding_"
+
+MIGRATIONS: list[tuple[int, str, Sequence[str]]] = [
+    (
+        1,
+        "memory table",
+        (
+            "CREATE EXTENSION IF NOT EXISTS vector",
+            "CREATE TABLE IF NOT EXISTS memory ("
+            "id bigserial PRIMARY KEY, "
+            "embedding vector NOT NULL, "
+            "summary text NOT NULL, "
+            "complete text NOT NULL, "
+            "parent_memory_id bigint REFERENCES memory (id))",
+        ),
+    ),
+    (
+        2,
+        "untyped embedding column so embeddings can be shortened in place",
+        ("ALTER TABLE memory ALTER COLUMN embedding TYPE vector",),
+    ),
+    (
+        3,
+        "keywords with an inverted index",
+        (
+            "ALTER TABLE memory ADD COLUMN IF NOT EXISTS keywords text[] NOT NULL DEFAULT '{}'",
+            "CREATE INDEX IF NOT EXISTS memory_keywords_idx ON memory USING gin (keywords)",
+        ),
+    ),
+]
+
+
+def vector_expression(settings: MemorySettings) -> str:
+    """
+    The indexed form of the embedding column, queries must order by the same expression for the index to be used
+    """
+    dimensions = settings.embedding_dimensions
+
+    if dimensions > MAX_VECTOR_INDEX_DIMENSIONS:
+        return f"(embedding::halfvec({dimensions}))"
+
+    return f"(embedding::vector({dimensions}))"
+
+
+def query_vector(settings: MemorySettings) -> str:
+    # The placeholder for a query embedding, cast to match vector_expression
+    dimensions = settings.embedding_dimensions
+
+    if dimensions > MAX_VECTOR_INDEX_DIMENSIONS:
+        return f"%s::halfvec({dimensions})"
+
+    return f"%s::vector({dimensions})"
+
+
+def index_name(settings: MemorySettings) -> str:
+    # Named after its parameters, a change of settings is a different index
+    if settings.index_type == "hnsw":
+        params = f"m{settings.hnsw_m}_ef{settings.hnsw_ef_construction}"
+    else:
+        params = f"lists{settings.ivfflat_lists}"
+
+    return f"{INDEX_PREFIX}{settings.index_type}_{settings.embedding_dimensions}_{params}"
+
+
+def configure_connection(settings: MemorySettings) -> Callable[[Connection], None]:
+    """
+    Pool configure callback, sets the search breadth of the vector index once per connection instead of once per query
+    """
+
+    def configure(conn: Connection) -> None:
+        conn.execute("SELECT set_config('hnsw.ef_search', %s, false)", (str(settings.ann_ef_search),))
+        conn.execute("SELECT set_config('ivfflat.probes', %s, false)", (str(settings.ivfflat_probes),))
+        conn.commit()
+
+    return configure
+
+
+def migrate(conn: Connection) -> int:
+    """
+    Applies the migrations the database has not seen yet, each in its own transaction
+    :return: the number of migrations applied
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS memory_schema_version (version integer PRIMARY KEY, applied_at timestamptz NOT NULL DEFAULT now())")
+    conn.commit()
+
+    applied = 0
+    for version, description, statements in MIGRATIONS:
+        with conn.transaction():
+            # Serializes processes starting at the same time, the loser sees the version as applied
+            conn.execute("SELECT pg_advisory_xact_lock(hashtext('memory_schema_version'))")
+
+            if conn.execute("SELECT 1 FROM memory_schema_version WHERE version = %s", (version,)).fetchone():
+                continue
+
+            log.info(f"Applying memory migration {version}: {description}")
+
+            for statement in statements:
+                conn.execute(statement)
+
+            conn.execute("INSERT INTO memory_schema_version (version) VALUES (%s)", (version,))
+            applied += 1
+
+    return applied
+
+
+def has_vector_index(conn: Connection, settings: MemorySettings) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM pg_indexes WHERE tablename = 'memory' AND indexname = %s", (index_name(settings),)
+    ).fetchone()
+
+    return row is not None
+
+
+def build_vector_index(conn: Connection, settings: MemorySettings) -> None:
+    """
+    Builds the configured vector index without blocking writes and drops any index built with other settings.
+    The connection must be in autocommit mode
+    """
+    name = index_name(settings)
+    stale = [
+        row[0]
+        for row in conn.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'memory' AND indexname LIKE %s AND indexname <> %s",
+            (INDEX_PREFIX + "%", name),
+        ).fetchall()
+    ]
+
+    if settings.index_type != "none" and not has_vector_index(conn, settings):
+        ops = "halfvec_l2_ops" if settings.embedding_dimensions > MAX_VECTOR_INDEX_DIMENSIONS else "vector_l2_ops"
+
+        if settings.index_type == "hnsw":
+            params = f"m = {settings.hnsw_m}, ef_construction = {settings.hnsw_ef_construction}"
+        else:
+            params = f"lists = {settings.ivfflat_lists}"
+
+        log.info(f"Building vector index {name}")
+        conn.execute(
+            f"CREATE INDEX CONCURRENTLY {name} ON memory USING {settings.index_type} ({vector_expression(settings)} {ops}) "
+            f"WITH ({params}) WHERE vector_dims(embedding) = {settings.embedding_dimensions}"
+        )
+
+    for index in stale:
+        log.info(f"Dropping vector index {index}")
+        conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+
+
+def reembed(conn: Connection, client: Client, settings: MemorySettings, batch_size: int = 500) -> int:
+    """
+    Re-embeds the summary of every memory whose embedding is not the configured length, a batch per transaction
+    :return: the number of memories re-embedded
+    """
+    done = 0
+
+    while True:
+        rows = conn.execute(
+            "SELECT id,summary FROM memory WHERE vector_dims(embedding) <> %s ORDER BY id LIMIT %s",
+            (settings.embedding_dimensions, batch_size),
+        ).fetchall()
+
+        if not rows:
+            # Ends the transaction the select opened, the connection can only be switched to autocommit when idle
+            conn.commit()
+            return done
+
+        embeddings = client.create_embeddings(
+            TEXT_EMBEDDING_3_LARGE, [row[1] for row in rows], dimensions=settings.embedding_dimensions
+        )
+
+        with conn.cursor() as cur:
+            cur.executemany(
+                "UPDATE memory SET embedding = %s::vector WHERE id = %s",
+                [("[" + ",".join(map(str, embedding)) + "]", row[0]) for row, embedding in zip(rows, embeddings)],
+            )
+
+        conn.commit()
+
+        done += len(rows)
+        log.info(f"Re-embedded {done} memories")
+
+
+def main() -> None:
+    load_dotenv()
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("migrate", "index", "reembed"))
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    settings = MemorySettings()
+
+    with psycopg.connect(settings.dsn) as conn:
+        if args.command == "migrate":
+            print(f"-- Applied {migrate(conn)} migrations --")
+
+        if args.command == "reembed":
+            if not (token := os.getenv("OPENAI_API_KEY")):
+                raise Exception("'OPENAI_API_KEY not found")
+
+            client = Client(token=token, base_url=os.getenv("OPENAI_BASE_URL"))
+            try:
+                print(f"-- Re-embedded {reembed(conn, client, settings, args.batch_size)} memories --")
+            finally:
+                client.close()
+
+        # Concurrent index builds can not run inside a transaction
+        conn.autocommit = True
+        build_vector_index(conn, settings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Sequence
+
+from psycopg import Connection
+from psycopg_pool import ConnectionPool
+
+from domain.core.migrations import (
+    configure_connection,
+    has_vector_index,
+    index_name,
+    migrate,
+    query_vector,
+    vector_expression,
+)
+from domain.core.store import MemorySettings, MemoryStore
+from llm.tracing import tracer
+
+log = logging.getLogger(__name__)
+
+
+class PostgresMemoryStore(MemoryStore):
+    """
+    Long term memory backed by the postgres memory table. Connections come from a shared pool and the hot queries
+    are sent as prepared statements, so a memory tool call costs a round trip instead of a new connection
+    """
+
+    def __init__(self, settings: MemorySettings | None = None) -> None:
+        self.settings = settings or MemorySettings()
+
+        # Opened on first use so that sessions that never touch memory never dial postgres
+        self._pool = ConnectionPool(
+            self.settings.dsn,
+            min_size=self.settings.pool_min_size,
+            max_size=self.settings.pool_max_size,
+            configure=configure_connection(self.settings),
+            open=False,
+        )
+        self._opened = False
+        self._open_lock = threading.Lock()
+
+        # Searches only cover memories embedded at the configured length, ordered by the expression the vector index is built on.
+        # Keywords live in a text[] column, its GIN index lets && find the memories holding any of them without a scan
+        nearest = (
+            f"FROM memory WHERE vector_dims(embedding) = {self.settings.embedding_dimensions} "
+            f"ORDER BY {vector_expression(self.settings)} <-> {query_vector(self.settings)} LIMIT %s"
+        )
+        self._nearest_summaries_sql = f"SELECT id,summary {nearest}"
+        self._nearest_memories_sql = (
+            f"SELECT id,summary,complete,{vector_expression(self.settings)} <-> {query_vector(self.settings)} {nearest}"
+        )
+
+    def get_complete(self, id: int) -> str | None:
+        with self._connection("get_complete") as conn:
+            row = conn.execute(
+                "SELECT complete FROM memory WHERE id = %s", (id,), prepare=True
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def nearest_summaries(
+        self, embedding: Sequence[float], limit: int = 3
+    ) -> list[tuple[int, str]]:
+        with self._connection("nearest_summaries") as conn:
+            rows = conn.execute(
+                self._nearest_summaries_sql,
+                (_vector_literal(embedding), limit),
+                prepare=True,
+            ).fetchall()
+
+        return [(row[0], row[1]) for row in rows]
+
+    def nearest_memories(
+        self, embedding: Sequence[float], limit: int = 3
+    ) -> list[tuple[int, str, str, float]]:
+        vector = _vector_literal(embedding)
+
+        with self._connection("nearest_memories") as conn:
+            rows = conn.execute(
+                self._nearest_memories_sql,
+                (vector, vector, limit),
+                prepare=True,
+            ).fetchall()
+
+        return [(row[0], row[1], row[2], row[3]) for row in rows]
+
+    def keyword_search(
+        self, keywords: Sequence[str], limit: int = 3
+    ) -> list[tuple[int, str, str, int]]:
+        keywords = list(set(keywords))
+
+        with self._connection("keyword_search") as conn:
+            rows = conn.execute(
+                "SELECT id,summary,complete,cardinality(ARRAY(SELECT unnest(keywords) INTERSECT SELECT unnest(%s::text[]))) AS matches "
+                "FROM memory WHERE keywords && %s::text[] ORDER BY matches DESC, id DESC LIMIT %s",
+                (keywords, keywords, limit),
+                prepare=True,
+            ).fetchall()
+
+        return [(row[0], row[1], row[2], row[3]) for row in rows]
+
+    def insert(
+        self,
+        embedding: Sequence[float],
+        summary: str,
+        complete: str,
+        parent: int | None = None,
+        keywords: Sequence[str] = (),
+    ) -> int:
+        with self._connection("insert") as conn:
+            row = conn.execute(
+                "INSERT INTO memory (embedding, summary, complete, parent_memory_id, keywords) VALUES (%s::vector, %s, %s, %s, %s) RETURNING id",
+                (_vector_literal(embedding), summary, complete, parent, list(keywords)),
+                prepare=True,
+            ).fetchone()
+
+        assert row
+        return row[0]
+
+    def insert_many(self, rows: Iterable[tuple[Sequence[float], str, str, Sequence[str]]]) -> None:
+        # COPY streams every row in a single statement instead of one INSERT round trip each
+        with self._connection("insert_many") as conn:
+            with conn.cursor() as cur:
+                with cur.copy(
+                    "COPY memory (embedding, summary, complete, keywords) FROM STDIN"
+                ) as copy:
+                    for embedding, summary, complete, keywords in rows:
+                        copy.write_row((_vector_literal(embedding), summary, complete, list(keywords)))
+
+    def close(self) -> None:
+        self._pool.close()
+
+    @contextmanager
+    def _connection(self, operation: str) -> Iterator[Connection]:
+        if not self._opened:
+            with self._open_lock:
+                if not self._opened:
+                    self._pool.open()
+
+                    with self._pool.connection() as conn:
+                        migrate(conn)
+
+                        if self.settings.index_type != "none" and not has_vector_index(conn, self.settings):
+                            # Not built here, on a large table it would hold up the first memory call for minutes
+                            log.warning(
+                                f"Vector index {index_name(self.settings)} is missing, memory searches scan the whole table. "
+                                f"Build it with python -m domain.core.migrations index"
+                            )
+
+                    self._opened = True
+
+        # The span covers the wait for a pooled connection as well as the query.
+        # The pool commits the transaction when the block exits cleanly and rolls it back otherwise
+        with tracer.span(f"memory.{operation}", backend="postgres"), self._pool.connection() as conn:
+            yield conn
+
+
+def _vector_literal(embedding: Sequence[float]) -> str:
+    # pgvectors text input format, psycopg has no adapter for float arrays and COPY none for lists either
+    return "[" + ",".join(map(str, embedding)) + "]"
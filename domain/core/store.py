@@ -0,0 +1,192 @@
+import threading
+from typing import Iterable, Literal, Sequence
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class MemorySettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="AERIS_MEMORY_")
+
+    backend: Literal["postgres", "local"] = "postgres"
+
+    # Memories are embedded at this length, shorter embeddings make the table and its index smaller and faster to search.
+    # Changing it needs the stored memories re-embedded, see domain.core.migrations
+    embedding_dimensions: int = 3072
+
+    # postgres backend
+    dsn: str = "dbname=aeris_memory user=jaymadden"
+    pool_min_size: int = 1
+    pool_max_size: int = 8
+    # Approximate index over the embeddings, built by python -m domain.core.migrations
+    index_type: Literal["hnsw", "ivfflat", "none"] = "hnsw"
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 64
+    ivfflat_lists: int = 1000
+    # Number of ivfflat lists searched per query, ann_ef_search is the hnsw equivalent
+    ivfflat_probes: int = 10
+
+    # local backend
+    local_path: str = "model_output/memory"
+    # Switch from exact search to an approximate graph index once the store holds this many memories (requires hnswlib)
+    ann_threshold: int = 50_000
+    # Size of the candidate list an hnsw search keeps, for both the local index and pgvector
+    ann_ef_search: int = 100
+
+    # How recall_memory finds a memory. direct hands the closest memories back with their conversations in one tool
+    # result, select asks the model to choose one by id in a nested chat request over the whole history
+    recall_mode: Literal["direct", "select"] = "direct"
+    recall_limit: int = 3
+    # Characters of each recalled conversation handed back to the model in direct mode
+    recall_max_chars: int = 4000
+
+    # Journal of memories queued by store_memory that have not been written to the store yet
+    write_queue_path: str = "model_output/memory_queue.jsonl"
+    # Queued memories are embedded and inserted this many at a time, after waiting write_delay seconds for a burst to land
+    write_batch_size: int = 64
+    write_delay: float = 0.05
+    write_retry_delay: float = 5.0
+    # A batch that keeps failing for any reason but a lost connection is moved to the dead letter file after this many
+    # attempts, so one bad memory can not hold up the queue. Batches that failed to connect are retried until they succeed
+    write_max_attempts: int = 5
+    write_dead_letter_path: str = "model_output/memory_dead_letter.jsonl"
+    # Max seconds a session end or shutdown waits for the queue to drain
+    write_flush_timeout: float = 30.0
+
+
+class MemoryStore:
+    """
+    Interface of a long term memory backend, the memory tools are written against this so they work the same on every backend
+    """
+
+    settings: MemorySettings
+
+    def get_complete(self, id: int) -> str | None:
+        raise NotImplementedError()
+
+    def nearest_summaries(
+        self, embedding: Sequence[float], limit: int = 3
+    ) -> list[tuple[int, str]]:
+        """
+        Finds the memories closest to the embedding by euclidean distance
+        :param embedding: the embedding to search with
+        :param limit: the max number of memories to return
+        :return: (id, summary) of each memory, closest first
+        """
+        raise NotImplementedError()
+
+    def nearest_memories(
+        self, embedding: Sequence[float], limit: int = 3
+    ) -> list[tuple[int, str, str, float]]:
+        """
+        Finds the memories closest to the embedding by euclidean distance, complete conversations included
+        :param embedding: the embedding to search with
+        :param limit: the max number of memories to return
+        :return: (id, summary, complete, distance) of each memory, closest first
+        """
+        raise NotImplementedError()
+
+    def keyword_search(
+        self, keywords: Sequence[str], limit: int = 3
+    ) -> list[tuple[int, str, str, int]]:
+        """
+        Finds the memories stored with any of the keywords through the keyword index
+        :param keywords: lowercase keywords to search for
+        :param limit: the max number of memories to return
+        :return: (id, summary, complete, matched keyword count) of each memory, most matches then newest first
+        """
+        raise NotImplementedError()
+
+    def insert(
+        self,
+        embedding: Sequence[float],
+        summary: str,
+        complete: str,
+        parent: int | None = None,
+        keywords: Sequence[str] = (),
+    ) -> int:
+        """
+        Stores a single memory and returns its id
+        """
+        raise NotImplementedError()
+
+    def insert_many(self, rows: Iterable[tuple[Sequence[float], str, str, Sequence[str]]]) -> None:
+        """
+        Stores (embedding, summary, complete, keywords) rows in bulk
+        """
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        pass
+
+
+class LazyMemoryStore(MemoryStore):
+    """
+    Opens the configured backend the first time a memory is read or written, so a process that never touches memory
+    never pays for importing its driver
+    """
+
+    def __init__(self, settings: MemorySettings) -> None:
+        self.settings = settings
+
+        self._store: MemoryStore | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def store(self) -> MemoryStore:
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = create_memory_store(self.settings)
+
+        return self._store
+
+    def get_complete(self, id: int) -> str | None:
+        return self.store.get_complete(id)
+
+    def nearest_summaries(self, embedding: Sequence[float], limit: int = 3) -> list[tuple[int, str]]:
+        return self.store.nearest_summaries(embedding, limit)
+
+    def nearest_memories(self, embedding: Sequence[float], limit: int = 3) -> list[tuple[int, str, str, float]]:
+        return self.store.nearest_memories(embedding, limit)
+
+    def keyword_search(self, keywords: Sequence[str], limit: int = 3) -> list[tuple[int, str, str, int]]:
+        return self.store.keyword_search(keywords, limit)
+
+    def insert(
+        self,
+        embedding: Sequence[float],
+        summary: str,
+        complete: str,
+        parent: int | None = None,
+        keywords: Sequence[str] = (),
+    ) -> int:
+        return self.store.insert(embedding, summary, complete, parent=parent, keywords=keywords)
+
+    def insert_many(self, rows: Iterable[tuple[Sequence[float], str, str, Sequence[str]]]) -> None:
+        self.store.insert_many(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._store is not None:
+                self._store.close()
+
+
+def create_memory_store(settings: MemorySettings | None = None, lazy: bool = False) -> MemoryStore:
+    """
+    :param settings: defaults to the environment
+    :param lazy: defer importing and opening the backend until it is first used
+    """
+    settings = settings or MemorySettings()
+
+    if lazy:
+        return LazyMemoryStore(settings)
+
+    # Backends are imported on demand so each only needs its own dependencies installed
+    if settings.backend == "local":
+        from domain.core.local import LocalMemoryStore
+
+        return LocalMemoryStore(settings)
+
+    from domain.core.postgres import PostgresMemoryStore
+
+    return PostgresMemoryStore(settings)
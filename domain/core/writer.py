@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Sequence
+
+from domain.core.store import MemorySettings, MemoryStore
+from llm.openai.client import Client
+from llm.openai.transport import RETRY_STATUS_CODES
+from llm.session import TEXT_EMBEDDING_3_LARGE
+from llm.tracing import tracer
+
+log = logging.getLogger(__name__)
+
+
+class _PendingMemory:
+    __slots__ = ("seq", "summary", "complete", "keywords", "queued_at")
+
+    def __init__(self, seq: int, summary: str, complete: str, keywords: list[str], queued_at: float) -> None:
+        self.seq = seq
+        self.summary = summary
+        self.complete = complete
+        self.keywords = keywords
+        self.queued_at = queued_at
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "seq": self.seq,
+                "summary": self.summary,
+                "complete": self.complete,
+                "keywords": self.keywords,
+                "queued_at": self.queued_at,
+            }
+        )
+
+
+def _is_transient(error: Exception) -> bool:
+    # Errors of a backend that could not be reached, the batch itself is fine and is retried until it goes through
+    import httpx
+    import requests
+
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUS_CODES
+
+    if isinstance(error, (OSError, httpx.TransportError)):
+        return True
+
+    try:
+        import psycopg
+    except ImportError:
+        return False
+
+    return isinstance(error, psycopg.OperationalError)
+
+
+class MemoryWriterStats:
+    def __init__(self, depth: int, lag: float, written: int, failures: int, dead_lettered: int) -> None:
+        # Memories waiting to be written, and seconds the oldest of them has been waiting
+        self.depth = depth
+        self.lag = lag
+        self.written = written
+        self.failures = failures
+        self.dead_lettered = dead_lettered
+
+    def __repr__(self) -> str:
+        return (
+            f"MemoryWriterStats(depth={self.depth}, lag={self.lag:.3f}, written={self.written}, "
+            f"failures={self.failures}, dead_lettered={self.dead_lettered})"
+        )
+
+
+class MemoryWriter:
+    """
+    Write-behind queue for new memories. Submitting appends the memory to a journal and returns, a background thread
+    embeds and inserts the queued memories in batches. Memories still in the journal when the process dies are
+    written on the next start, one that was inserted right before a crash may be written twice. A batch that keeps
+    failing for another reason than an unreachable backend is moved to the dead letter file
+    """
+
+    def __init__(self, client: Client, store: MemoryStore, settings: MemorySettings | None = None) -> None:
+        self.client = client
+        self.store = store
+        self.settings = settings or MemorySettings()
+        self.path = self.settings.write_queue_path
+
+        self._pending: deque[_PendingMemory] = deque()
+        self._next_seq = 1
+        self._written = 0
+        self._failures = 0
+        self._dead_lettered = 0
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._closing = False
+
+        self._load()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._journal = open(self.path, "a", encoding="utf-8")
+
+        self._worker = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+        self._worker.start()
+
+    def submit(self, summary: str, complete: str, keywords: Sequence[str] = ()) -> None:
+        """
+        Queues a memory to be stored, it is durable once this returns
+        """
+        with self._lock:
+            memory = _PendingMemory(self._next_seq, summary, complete, list(keywords), time.time())
+            self._next_seq += 1
+
+            self._journal.write(memory.to_json() + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+            self._pending.append(memory)
+            self._changed.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Waits for every memory queued so far to be written
+        :param timeout: max seconds to wait, defaults to the flush timeout setting
+        :return: if the queue was drained in time
+        """
+        timeout = self.settings.write_flush_timeout if timeout is None else timeout
+
+        with self._lock:
+            if not self._pending:
+                return True
+
+            target = self._pending[-1].seq
+            self._changed.notify_all()
+
+            drained = self._changed.wait_for(
+                lambda: not self._pending or self._pending[0].seq > target, timeout
+            )
+
+        if not drained:
+            log.warning(f"memory writer flush timed out with {len(self._pending)} memories queued")
+
+        return drained
+
+    def stats(self) -> MemoryWriterStats:
+        with self._lock:
+            lag = time.time() - self._pending[0].queued_at if self._pending else 0.0
+            return MemoryWriterStats(len(self._pending), lag, self._written, self._failures, self._dead_lettered)
+
+    def close(self) -> None:
+        self.flush()
+
+        with self._lock:
+            self._closing = True
+            self._changed.notify_all()
+
+        self._worker.join()
+        self._journal.close()
+
+    def _run(self) -> None:
+        # A failed batch is retried as it is, memories queued since do not join it
+        retry: list[_PendingMemory] = []
+        attempts = 0
+
+        while True:
+            with self._lock:
+                self._changed.wait_for(lambda: self._pending or self._closing)
+
+                if self._closing:
+                    return
+
+            if not retry:
+                # Let the rest of a burst of memories land so they share one embedding request
+                time.sleep(self.settings.write_delay)
+
+            with self._lock:
+                batch = retry or list(self._pending)[: self.settings.write_batch_size]
+
+            try:
+                self._write(batch)
+            except Exception as e:
+                with self._lock:
+                    self._failures += 1
+
+                if not _is_transient(e):
+                    attempts += 1
+
+                if attempts < self.settings.write_max_attempts:
+                    log.error(f"writing {len(batch)} memories failed with '{e}', retrying")
+
+                    with self._lock:
+                        self._changed.wait_for(lambda: self._closing, self.settings.write_retry_delay)
+
+                    retry = batch
+                    continue
+
+                log.error(
+                    f"writing {len(batch)} memories failed {attempts} times, last with '{e}', "
+                    f"moving them to {self.settings.write_dead_letter_path}"
+                )
+
+                try:
+                    self._dead_letter(batch)
+                except OSError as dead_letter_error:
+                    log.error(f"moving {len(batch)} memories to the dead letter file failed with '{dead_letter_error}', retrying")
+
+                    with self._lock:
+                        self._changed.wait_for(lambda: self._closing, self.settings.write_retry_delay)
+
+                    retry = batch
+                    continue
+            else:
+                with self._lock:
+                    self._written += len(batch)
+
+            retry = []
+            attempts = 0
+
+            with self._lock:
+                for _ in batch:
+                    self._pending.popleft()
+
+                # Once everything queued is written or dead lettered the journal is cleared, otherwise the position is recorded
+                if self._pending:
+                    self._journal.write(json.dumps({"done": batch[-1].seq}) + "\n")
+                else:
+                    self._journal.truncate(0)
+
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+
+                self._changed.notify_all()
+
+    def _write(self, batch: list[_PendingMemory]) -> None:
+        with tracer.span("memory.write_batch", rows=len(batch)) as span:
+            span.set("lag", time.time() - batch[0].queued_at)
+
+            embeddings = self.client.create_embeddings(
+                TEXT_EMBEDDING_3_LARGE,
+                [memory.summary for memory in batch],
+                dimensions=self.store.settings.embedding_dimensions,
+            )
+
+            self.store.insert_many(
+                (embedding, memory.summary, memory.complete, memory.keywords)
+                for memory, embedding in zip(batch, embeddings)
+            )
+
+        log.info(f"Saved {len(batch)} memories, {len(self._pending) - len(batch)} still queued")
+
+    def _dead_letter(self, batch: list[_PendingMemory]) -> None:
+        path = self.settings.write_dead_letter_path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(memory.to_json() + "\n" for memory in batch)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._lock:
+            self._dead_lettered += len(batch)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+
+        done = 0
+        entries = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Torn by a crash mid write, the submit it belonged to never returned
+                break
+
+            if "done" in entry:
+                done = max(done, entry["done"])
+            else:
+                entries.append(entry)
+
+        for entry in entries:
+            if entry["seq"] > done:
+                self._pending.append(
+                    _PendingMemory(
+                        entry["seq"], entry["summary"], entry["complete"], entry.get("keywords", []), entry["queued_at"]
+                    )
+                )
+
+            self._next_seq = max(self._next_seq, entry["seq"] + 1)
+
+        if self._pending:
+            log.info(f"Resuming {len(self._pending)} queued memories from {self.path}")
+
+        # Rewritten with only what is still pending so a torn line is not left in the middle of the journal
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.writelines(memory.to_json() + "\n" for memory in self._pending)
@@ -0,0 +1,24 @@
+from llm.registry import ToolRegistry, ToolRegistrySettings
+
+# The tool groups the assistant ships with, imported by the registry only once the model calls one of their functions
+TOOL_GROUPS = {
+    "time": "domain.primitives.time:group",
+    "file": "domain.primitives.file:group",
+    "control": "domain.primitives.control:group",
+    "memory": "domain.core.memory:group",
+    "room": "domain.home.room:group",
+}
+
+
+def create_registry(settings: ToolRegistrySettings | None = None) -> ToolRegistry:
+    """
+    A registry of the built in tool groups and those installed packages offer
+    """
+    registry = ToolRegistry(settings)
+
+    for name, target in TOOL_GROUPS.items():
+        registry.register(name, target)
+
+    registry.discover()
+
+    return registry
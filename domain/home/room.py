@@ -1,18 +1,16 @@
-import json
-from os import stat
 from typing import Annotated
 
-from llm.session import SessionGroup, Param
+from domain.home.state import HouseState
+from llm.session import Inject, SessionGroup, Param
 
 group = SessionGroup()
 
 
 @group.function("Gets the current state of the house and its rooms")
-def get_house_state() -> str:
-    with open("model_output/room_state.json", "r+") as f:
-        rooms = json.loads(f.read()) or {}
-
-    return json.dumps(rooms)
+def get_house_state(
+    house: Annotated[HouseState, Inject(HouseState)],
+) -> str:
+    return house.to_json()
 
 
 @group.function("Turns the lights on or off in a given room number")
@@ -22,16 +20,29 @@ def control_room_light(
         bool,
         Param(description="The state to set the light in the room too"),
     ],
+    house: Annotated[HouseState, Inject(HouseState)],
 ) -> bool:
     if not isinstance(state, bool):
         raise ValueError("State must be a boolean")
 
-    with open("model_output/room_state.json", "r+") as f:
-        rooms = json.loads(f.read()) or {}
+    house.set_light(room_number, state)
+
+    return True
 
-    rooms[str(room_number)]["light_state"] = state
 
-    with open("model_output/room_state.json", "w+") as f:
-        f.write(json.dumps(rooms, indent=2))
+@group.function(
+    "Turns the lights on or off in many rooms at once, use this instead of calling control_room_light for each room"
+)
+def control_room_lights(
+    room_numbers: Annotated[
+        list[int], Param(description="The room numbers to target")
+    ],
+    state: Annotated[
+        bool,
+        Param(description="The state to set the lights in the rooms too"),
+    ],
+    house: Annotated[HouseState, Inject(HouseState)],
+) -> bool:
+    house.set_rooms({room_number: {"light_state": state} for room_number in room_numbers})
 
     return True
@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+log = logging.getLogger(__name__)
+
+
+class HouseSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="AERIS_HOUSE_")
+
+    state_path: str = "model_output/room_state.json"
+    # Changes made within this many seconds of each other are written to disk together
+    flush_delay: float = 0.5
+    # How often the state file is checked for edits made outside the process
+    poll_interval: float = 1.0
+
+
+class HouseState:
+    """
+    The state of the house and its rooms, held in memory and shared by every tool call. Updates are applied under a
+    lock and persisted by a background thread that coalesces them into a single atomic write of the state file.
+    The same thread watches the file and reloads it when it is edited by someone else
+    """
+
+    def __init__(self, settings: HouseSettings | None = None) -> None:
+        self.settings = settings or HouseSettings()
+        self.path = self.settings.state_path
+
+        self._rooms: dict[str, dict[str, Any]] = {}
+        self._version = 0
+        self._json: tuple[int, str] | None = None
+
+        # Version last written to disk, and the (mtime, size) of the file as we last wrote or read it
+        self._flushed_version = 0
+        self._file_stamp: tuple[int, int] | None = None
+
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._closing = False
+
+        self._load()
+
+        self._worker = threading.Thread(target=self._run, name="house-state", daemon=True)
+        self._worker.start()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def rooms(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            return {number: dict(room) for number, room in self._rooms.items()}
+
+    def to_json(self) -> str:
+        with self._lock:
+            # Serialized once per change however many times the model asks for it
+            if not self._json or self._json[0] != self._version:
+                self._json = (self._version, json.dumps(self._rooms))
+
+            return self._json[1]
+
+    def set_light(self, room_number: int, state: bool) -> None:
+        self.set_rooms({room_number: {"light_state": state}})
+
+    def set_rooms(self, updates: dict[int | str, dict[str, Any]]) -> None:
+        """
+        Updates many rooms at once, they are all changed or none are and the change is persisted in a single write
+        :param updates: the fields to change keyed by room number
+        """
+        with self._lock:
+            missing = [str(number) for number in updates if str(number) not in self._rooms]
+            if missing:
+                raise ValueError(f"Rooms {', '.join(missing)} do not exist")
+
+            for number, fields in updates.items():
+                self._rooms[str(number)].update(fields)
+
+            self._version += 1
+            self._changed.notify()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._flushed_version == self._version:
+                return
+
+            version = self._version
+            data = json.dumps(self._rooms, indent=2)
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+
+        # Written to a temp file beside the state file and renamed over it, readers see the old or new file never half of one
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".room_state.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        with self._lock:
+            self._flushed_version = max(self._flushed_version, version)
+            self._file_stamp = self._stat()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closing = True
+            self._changed.notify()
+
+        self._worker.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._closing and self._flushed_version == self._version:
+                    self._changed.wait(self.settings.poll_interval)
+
+                closing = self._closing
+                dirty = self._flushed_version != self._version
+
+            if closing:
+                return
+
+            try:
+                if dirty:
+                    # Let the rest of a burst of changes land so they go out in one write
+                    time.sleep(self.settings.flush_delay)
+                    self.flush()
+                else:
+                    self._reload_if_changed()
+            except Exception as e:
+                log.error(f"house state sync failed with '{e}'")
+
+    def _reload_if_changed(self) -> None:
+        stamp = self._stat()
+        if stamp is None or stamp == self._file_stamp:
+            return
+
+        try:
+            with open(self.path) as f:
+                rooms = json.load(f) or {}
+        except json.JSONDecodeError:
+            # Most likely caught mid save by an editor that does not write atomically, try again on the next poll
+            return
+
+        with self._lock:
+            # Unflushed changes of our own win, they are written over the edit on the next flush
+            if self._flushed_version != self._version:
+                return
+
+            self._rooms = rooms
+            self._version += 1
+            self._flushed_version = self._version
+            self._file_stamp = stamp
+
+        log.info(f"reloaded house state from {self.path}")
+
+    def _load(self) -> None:
+        stamp = self._stat()
+        if stamp is None:
+            return
+
+        with open(self.path) as f:
+            self._rooms = json.load(f) or {}
+
+        self._file_stamp = stamp
+
+    def _stat(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
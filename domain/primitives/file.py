@@ -1,12 +1,14 @@
 from typing import Annotated
 
 from llm.session import SessionGroup, Param
+from llm.tool_cache import CachePolicy, file_mtime
 
 group = SessionGroup()
 
 
 @group.function(
-    "Writes a file on the computer at a given path overwriting everything in the file"
+    "Writes a file on the computer at a given path overwriting everything in the file",
+    invalidates=["read_file"],
 )
 def write_file(
     file_path: Annotated[
@@ -20,7 +22,10 @@ def write_file(
         f.write(content)
 
 
-@group.function("Reads a file on the computer at a given path")
+@group.function(
+    "Reads a file on the computer at a given path",
+    cache=CachePolicy(max_entries=32, stamp=file_mtime("file_path")),
+)
 def read_file(
     file_path: Annotated[
         str, Param(description="The relative path to the file to read")
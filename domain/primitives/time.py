@@ -4,11 +4,15 @@ from typing import Annotated
 import pytz
 
 from llm.session import SessionGroup, Param
+from llm.tool_cache import CachePolicy
 
 group = SessionGroup()
 
 
-@group.function("Get the current time.py in UTC ISO-8601 format")
+# Repeated lookups within a single turn loop get the same answer
+@group.function(
+    "Get the current time.py in UTC ISO-8601 format", cache=CachePolicy(ttl=1.0)
+)
 def get_current_time(
     tz_name: Annotated[
         str,
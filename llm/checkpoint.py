@@ -0,0 +1,264 @@
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import Any, Iterable
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+from llm.openai.models.record import MessageRecord
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "snapshot.jsonl"
+META_FILE = "meta.json"
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class CheckpointSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="AERIS_CHECKPOINT_")
+
+    # Directory the session logs are kept in, sessions are not checkpointed when unset
+    path: str | None = None
+    # Appended messages are fsynced together at most this many seconds after they are written
+    fsync_interval: float = 0.2
+    # A log is compacted into a snapshot once this many messages have been appended since the last one
+    snapshot_every: int = 1_000
+
+
+class SessionLog:
+    """
+    Durable history of one session. Every message is appended to a log as its wire JSON, and once the log grows
+    long the whole history is compacted into a snapshot and a fresh log is started. Reading replays the snapshot
+    plus the log that follows it. Appends are buffered and fsynced in batches by the CheckpointStore
+    """
+
+    def __init__(self, store: "CheckpointStore", session_id: str) -> None:
+        self.store = store
+        self.session_id = session_id
+        self.directory = os.path.join(store.settings.path or "", session_id)
+
+        # Logs are numbered by the snapshot they follow, so a crash mid compaction never replays a message twice
+        self._generation = 0
+        self._appended = 0
+        self._file: Any = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @property
+    def needs_snapshot(self) -> bool:
+        return self._appended >= self.store.settings.snapshot_every
+
+    def read(self) -> list[MessageRecord]:
+        """
+        Replays the snapshot and the log after it. A message torn by a crash mid write is dropped
+        :return: the sessions history, empty for a new session
+        """
+        with self._lock:
+            records: list[MessageRecord] = []
+
+            snapshot = os.path.join(self.directory, SNAPSHOT_FILE)
+            if os.path.exists(snapshot):
+                with open(snapshot, "rb") as f:
+                    header = json.loads(f.readline())
+                    self._generation = header["generation"]
+                    records += [MessageRecord.from_wire_json(line.rstrip(b"\n").decode()) for line in f]
+
+            path = self._log_path()
+            if not os.path.exists(path):
+                return records
+
+            with open(path, "rb") as f:
+                data = f.read()
+
+            end = 0
+            self._appended = 0
+            for line in data.split(b"\n")[:-1]:
+                try:
+                    records.append(MessageRecord.from_wire_json(line.decode()))
+                except ValueError:
+                    break
+
+                end += len(line) + 1
+                self._appended += 1
+
+            if end < len(data):
+                log.warning(f"dropping {len(data) - end} torn bytes from the end of session log {path}")
+
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+
+            return records
+
+    def append(self, records: Iterable[MessageRecord]) -> None:
+        data = "".join(record.wire_json() + "\n" for record in records)
+        if not data:
+            return
+
+        with self._lock:
+            if not self._file:
+                os.makedirs(self.directory, exist_ok=True)
+                self._file = open(self._log_path(), "a", encoding="utf-8")
+
+            self._file.write(data)
+            self._appended += data.count("\n")
+            self._dirty = True
+
+    def snapshot(self, records: Iterable[MessageRecord]) -> None:
+        """
+        Compacts the log, the given history replaces everything written so far
+        :param records: the sessions complete history
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+
+            header = json.dumps({"generation": self._generation + 1})
+            data = "".join([header, "\n", *(record.wire_json() + "\n" for record in records)])
+
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".snapshot.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                os.replace(temp_path, os.path.join(self.directory, SNAPSHOT_FILE))
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+
+            # The snapshot now holds everything in the old log, new messages go to the log of its generation
+            old_path = self._log_path()
+            if self._file:
+                self._file.close()
+                self._file = None
+
+            self._generation += 1
+            self._appended = 0
+            self._dirty = False
+
+            if os.path.exists(old_path):
+                os.unlink(old_path)
+
+    def metadata(self) -> dict[str, Any]:
+        try:
+            with open(os.path.join(self.directory, META_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def set_metadata(self, metadata: dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+        temp_path = os.path.join(self.directory, f".{META_FILE}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(metadata, f)
+
+        os.replace(temp_path, os.path.join(self.directory, META_FILE))
+
+    def sync(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def close(self) -> None:
+        self.sync()
+
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+        self.store._release(self)
+
+    def _log_path(self) -> str:
+        return os.path.join(self.directory, f"log.{self._generation}.jsonl")
+
+
+class CheckpointStore:
+    """
+    Keeps the logs of many sessions in one directory and fsyncs their appends from a background thread, so
+    messages written within the same fsync interval share a single fsync per log
+    """
+
+    def __init__(self, settings: CheckpointSettings | None = None) -> None:
+        self.settings = settings or CheckpointSettings()
+        if not self.settings.path:
+            raise ValueError("A checkpoint path is required")
+
+        os.makedirs(self.settings.path, exist_ok=True)
+
+        self._logs: dict[str, SessionLog] = {}
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+
+        self._worker = threading.Thread(target=self._run, name="checkpoint", daemon=True)
+        self._worker.start()
+
+    def open(self, session_id: str) -> SessionLog:
+        if not _SESSION_ID.match(session_id):
+            raise ValueError(f"Invalid session id {session_id}")
+
+        with self._lock:
+            if session_id not in self._logs:
+                self._logs[session_id] = SessionLog(self, session_id)
+
+            return self._logs[session_id]
+
+    def exists(self, session_id: str) -> bool:
+        return bool(_SESSION_ID.match(session_id)) and os.path.isdir(
+            os.path.join(self.settings.path or "", session_id)
+        )
+
+    def session_ids(self) -> list[str]:
+        return [
+            entry.name
+            for entry in os.scandir(self.settings.path or "")
+            if entry.is_dir() and _SESSION_ID.match(entry.name)
+        ]
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            session_log = self._logs.pop(session_id, None)
+
+        if session_log:
+            session_log.close()
+
+        shutil.rmtree(os.path.join(self.settings.path or "", session_id), ignore_errors=True)
+
+    def sync(self) -> None:
+        with self._lock:
+            logs = list(self._logs.values())
+
+        for session_log in logs:
+            try:
+                session_log.sync()
+            except Exception as e:
+                log.error(f"syncing session log {session_log.session_id} failed with '{e}'")
+
+    def close(self) -> None:
+        self._closing.set()
+        self._worker.join()
+
+        with self._lock:
+            logs = list(self._logs.values())
+
+        for session_log in logs:
+            session_log.close()
+
+    def _release(self, session_log: SessionLog) -> None:
+        with self._lock:
+            if self._logs.get(session_log.session_id) is session_log:
+                del self._logs[session_log.session_id]
+
+    def _run(self) -> None:
+        while not self._closing.wait(self.settings.fsync_interval):
+            self.sync()
@@ -0,0 +1,125 @@
+from typing import Iterable, Iterator, Sequence, overload
+
+from llm.openai.models.chat import ChatMessage
+from llm.openai.models.record import MessageRecord
+
+# Forks freeze the tail into a new segment, past this many segments they are merged back into one
+# so that walking the history stays cheap no matter how many times it has been forked
+MAX_SEGMENTS = 32
+
+
+class _Segment:
+    __slots__ = ("parent", "messages", "length", "depth")
+
+    def __init__(self, parent: "_Segment | None", messages: tuple[MessageRecord, ...]) -> None:
+        self.parent = parent
+        self.messages = messages
+        self.length: int = (parent.length if parent else 0) + len(messages)
+        self.depth: int = (parent.depth if parent else 0) + 1
+
+
+def to_record(message: ChatMessage | MessageRecord) -> MessageRecord:
+    if isinstance(message, MessageRecord):
+        return message
+
+    return MessageRecord.from_chat_message(message)
+
+
+class MessageHistory(Sequence[MessageRecord]):
+    """
+    Persistent conversation history. Messages live in a chain of immutable segments shared between forks, plus a
+    mutable tail owned by this history alone. Forking freezes the tail and hands the chain to the child, so it costs
+    the same no matter how long the conversation is, and neither side can see the others later changes.
+
+    Messages are stored as compact MessageRecords, ChatMessages are converted as they are added
+    """
+
+    def __init__(self, messages: Iterable[ChatMessage | MessageRecord] = ()) -> None:
+        self._frozen: _Segment | None = None
+        self._tail: list[MessageRecord] = [to_record(message) for message in messages]
+
+    def fork(self) -> "MessageHistory":
+        if self._tail:
+            self._frozen = _Segment(self._frozen, tuple(self._tail))
+            self._tail = []
+
+            if self._frozen.depth > MAX_SEGMENTS:
+                self._frozen = _Segment(None, tuple(self._iter_frozen()))
+
+        child = MessageHistory()
+        child._frozen = self._frozen
+
+        return child
+
+    def append(self, message: ChatMessage | MessageRecord) -> None:
+        self._tail.append(to_record(message))
+
+    def extend(self, messages: Iterable[ChatMessage | MessageRecord]) -> None:
+        self._tail.extend(to_record(message) for message in messages)
+
+    def pop(self) -> MessageRecord:
+        if not self._tail:
+            if not self._frozen:
+                raise IndexError("pop from empty history")
+
+            # Take a private copy of the newest shared segment, the other forks keep the original
+            self._tail = list(self._frozen.messages)
+            self._frozen = self._frozen.parent
+
+        return self._tail.pop()
+
+    def __len__(self) -> int:
+        return self._frozen_length + len(self._tail)
+
+    def __iter__(self) -> Iterator[MessageRecord]:
+        yield from self._iter_frozen()
+        yield from self._tail
+
+    @overload
+    def __getitem__(self, index: int) -> MessageRecord:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[MessageRecord]:
+        ...
+
+    def __getitem__(self, index: int | slice) -> MessageRecord | list[MessageRecord]:
+        if isinstance(index, slice):
+            return list(self)[index]
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+
+        if index >= self._frozen_length:
+            return self._tail[index - self._frozen_length]
+
+        segment = self._frozen
+        while segment:
+            start = segment.length - len(segment.messages)
+            if index >= start:
+                return segment.messages[index - start]
+
+            segment = segment.parent
+
+        raise IndexError("history index out of range")
+
+    def __repr__(self) -> str:
+        return f"MessageHistory({list(self)!r})"
+
+    @property
+    def _frozen_length(self) -> int:
+        return self._frozen.length if self._frozen else 0
+
+    def _iter_frozen(self) -> Iterator[MessageRecord]:
+        segments = []
+
+        segment = self._frozen
+        while segment:
+            segments.append(segment.messages)
+            segment = segment.parent
+
+        for messages in reversed(segments):
+            yield from messages
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Callable
+
+from llm.checkpoint import CheckpointStore
+from llm.session import Session, SessionEndError, SessionResponseContext
+
+log = logging.getLogger(__name__)
+
+
+class ManagedSession:
+    def __init__(self, id: str, tenant: str, session: Session) -> None:
+        self.id = id
+        self.tenant = tenant
+        self.session = session
+        self.last_used = time.monotonic()
+
+        # A conversation takes one turn at a time, concurrent requests to the same session queue up here
+        self.lock = asyncio.Lock()
+
+
+class SessionManager:
+    """
+    Hosts many conversations in one process. Every session is created from a template session and shares its
+    clients, connection pools, injected dependencies and compiled tool registrations, only the history and prompt
+    are its own. Idle sessions are evicted, and each tenant may only have so many turns in flight at once.
+
+    With a checkpoint store every session is logged as it goes, evicted sessions and sessions from before a restart
+    are resumed from their log the next time they are asked for
+    """
+
+    def __init__(
+        self,
+        template: Session,
+        *,
+        idle_timeout: float = 900.0,
+        max_sessions: int = 1_000,
+        tenant_concurrency: int = 2,
+        checkpoints: CheckpointStore | None = None,
+    ) -> None:
+        self.template = template
+        self.checkpoints = checkpoints
+        # Seconds a session may go unused before it is evicted
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        # Max number of turns a single tenant can have running at once across all of its sessions
+        self.tenant_concurrency = tenant_concurrency
+
+        self._sessions: dict[str, ManagedSession] = {}
+        self._tenant_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, id: str) -> ManagedSession | None:
+        if id in self._sessions:
+            return self._sessions[id]
+
+        if not self.checkpoints or not self.checkpoints.exists(id):
+            return None
+
+        checkpoint = self.checkpoints.open(id)
+        managed = ManagedSession(
+            id,
+            checkpoint.metadata().get("tenant") or id,
+            self.template.new_conversation(checkpoint=checkpoint),
+        )
+        self._make_room()
+        self._sessions[id] = managed
+
+        log.info(f"resumed session {id} with {len(managed.session.messages)} messages")
+
+        return managed
+
+    def create(
+        self,
+        *,
+        id: str | None = None,
+        tenant: str | None = None,
+        system_prompt: str | None = None,
+    ) -> ManagedSession:
+        """
+        Starts a new conversation
+        :param id: the id to host it under, a random one is generated if not given
+        :param tenant: who the conversation belongs to, concurrency is limited per tenant. Defaults to the session id
+        :param system_prompt: the prompt the conversation starts with, defaults to the templates
+        :return: the hosted session
+        """
+        id = id or uuid.uuid4().hex
+
+        if id in self._sessions or (self.checkpoints and self.checkpoints.exists(id)):
+            raise ValueError(f"Session {id} already exists")
+
+        self._make_room()
+
+        checkpoint = None
+        if self.checkpoints:
+            checkpoint = self.checkpoints.open(id)
+            checkpoint.set_metadata({"tenant": tenant or id})
+
+        managed = ManagedSession(
+            id, tenant or id, self.template.new_conversation(system_prompt, checkpoint)
+        )
+        self._sessions[id] = managed
+
+        return managed
+
+    def remove(self, id: str) -> None:
+        """
+        Ends a session for good, its checkpoint is deleted
+        """
+        self._unload(id)
+
+        if self.checkpoints:
+            self.checkpoints.delete(id)
+
+    async def make_request(
+        self,
+        id: str,
+        content: str,
+        response_callback: Callable[[SessionResponseContext], None] | None = None,
+    ) -> str | None:
+        """
+        Takes a turn in a hosted conversation. A conversation the model ends is removed
+        :param id: the session id
+        :param content: the request to send to the model
+        :param response_callback: receives the response as it streams in, for this turn only
+        :return: the models string response
+        :raises KeyError: when no session has the id, or it was removed while the turn waited for it
+        :raises SessionEndError: when the model ended the conversation
+        """
+        managed = self.get(id)
+        if not managed:
+            raise KeyError(id)
+
+        # The session lock is taken first so a turn queued behind another turn of the same session does not hold
+        # one of its tenants slots while it waits, and so the session counts as busy and is not evicted meanwhile
+        async with managed.lock, self._tenant_semaphore(managed.tenant):
+            if self._sessions.get(id) is not managed:
+                raise KeyError(id)
+
+            managed.last_used = time.monotonic()
+            managed.session.response_callback = response_callback
+
+            try:
+                return await managed.session.make_request_async(content)
+            except SessionEndError:
+                self.remove(id)
+                raise
+            finally:
+                managed.session.response_callback = None
+                managed.last_used = time.monotonic()
+
+    def evict_idle(self) -> int:
+        """
+        Unloads every session that has not been used within the idle timeout, checkpointed sessions can be resumed
+        :return: the number of sessions evicted
+        """
+        deadline = time.monotonic() - self.idle_timeout
+
+        idle = [
+            managed.id
+            for managed in self._sessions.values()
+            if managed.last_used < deadline and not managed.lock.locked()
+        ]
+
+        for id in idle:
+            self._unload(id)
+
+        if idle:
+            log.info(f"evicted {len(idle)} idle sessions")
+
+        return len(idle)
+
+    async def run_eviction(self, interval: float = 60.0) -> None:
+        """
+        Evicts idle sessions every interval seconds until cancelled
+        """
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+
+    def close(self) -> None:
+        for id in list(self._sessions):
+            self._unload(id)
+
+    def _unload(self, id: str) -> None:
+        managed = self._sessions.pop(id, None)
+
+        if managed:
+            managed.session.close()
+
+    def _make_room(self) -> None:
+        if len(self._sessions) < self.max_sessions:
+            return
+
+        self.evict_idle()
+
+        if len(self._sessions) >= self.max_sessions:
+            # Drop the least recently used conversation that is not mid turn and can be resumed from its checkpoint
+            idle = [
+                managed
+                for managed in self._sessions.values()
+                if not managed.lock.locked() and managed.session.checkpoint
+            ]
+            if not idle:
+                raise RuntimeError("Too many sessions")
+
+            self._unload(min(idle, key=lambda managed: managed.last_used).id)
+
+    def _tenant_semaphore(self, tenant: str) -> asyncio.Semaphore:
+        if tenant not in self._tenant_semaphores:
+            self._tenant_semaphores[tenant] = asyncio.Semaphore(self.tenant_concurrency)
+
+        return self._tenant_semaphores[tenant]
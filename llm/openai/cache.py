@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+from llm.openai.models.embeddings import FloatArray
+
+log = logging.getLogger(__name__)
+
+
+class EmbeddingCacheStats:
+    def __init__(self) -> None:
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def __repr__(self) -> str:
+        return f"EmbeddingCacheStats(memory_hits={self.memory_hits}, disk_hits={self.disk_hits}, misses={self.misses})"
+
+
+class EmbeddingCache:
+    """
+    Two tier cache of embeddings keyed by (model, dimensions, text hash). Lookups hit a bounded in memory LRU first
+    and fall back to an optional SQLite file that persists embeddings across restarts
+    """
+
+    def __init__(self, *, max_entries: int = 4096, path: str | None = None) -> None:
+        self.max_entries = max_entries
+        self.stats = EmbeddingCacheStats()
+
+        self._memory: OrderedDict[str, FloatArray] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._db: sqlite3.Connection | None = None
+        if path:
+            # Tools run on worker threads, every access is serialized through the lock
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embedding (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(model: str, dimensions: int | None, text: str) -> str:
+        text_hash = hashlib.sha256(text.encode()).hexdigest()
+        return f"{model}:{dimensions or ''}:{text_hash}"
+
+    def get(self, model: str, dimensions: int | None, text: str) -> FloatArray | None:
+        key = self.key(model, dimensions, text)
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return self._memory[key]
+
+            if self._db:
+                row = self._db.execute(
+                    "SELECT vector FROM embedding WHERE key = ?", (key,)
+                ).fetchone()
+
+                if row:
+                    # Stored as packed float32, the precision the api returns them at
+                    embedding = array("f", row[0])
+                    self._remember(key, embedding)
+                    self.stats.disk_hits += 1
+                    return embedding
+
+            self.stats.misses += 1
+            return None
+
+    def put(
+        self, model: str, dimensions: int | None, text: str, embedding: FloatArray
+    ) -> None:
+        key = self.key(model, dimensions, text)
+
+        with self._lock:
+            self._remember(key, embedding)
+
+            if self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embedding (key, vector) VALUES (?, ?)",
+                    (key, embedding.tobytes()),
+                )
+                self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key: str, embedding: FloatArray) -> None:
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -1,76 +1,448 @@
-import requests
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, Sequence
 
 from llm.openai.models.chat import (
     ChatTool,
     ChatMessage,
+    ChatStreamOptions,
     ChatToolChoice,
+    CreateChatChunk,
     CreateChatRequest,
     CreateChatResponse,
 )
+from llm.openai.models.record import MessageRecord
 from llm.openai.models.embeddings import (
     CreateEmbeddingRequest,
     Embedding,
     EmbeddingResponse,
+    FloatArray,
+)
+from llm.openai.cache import EmbeddingCache
+from llm.openai.encoder import ChatRequestEncoder
+from llm.openai.stream import aiter_sse_data, iter_sse_data
+from llm.tracing import SpanLike, tracer
+from llm.openai.transport import (
+    AsyncTransport,
+    HttpxAsyncTransport,
+    RequestsTransport,
+    Transport,
+    TransportResponse,
 )
 
 log = logging.getLogger(__name__)
 
+# Provider limits on a single embedding request
+MAX_EMBEDDING_INPUTS = 2048
+MAX_EMBEDDING_REQUEST_TOKENS = 300_000
+
+# Conservative estimate so a chunk never goes over the token limit without needing a tokenizer
+EMBEDDING_CHARS_PER_TOKEN = 3
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
 
-class Client:
-    def __init__(self, token: str) -> None:
-        self._create_chat_url = "https://api.openai.com/v1/chat/completions"
-        self._create_embedding_url = "https://api.openai.com/v1/embeddings"
+
+class BaseClient:
+    def __init__(
+        self,
+        token: str,
+        embedding_cache: EmbeddingCache | None = None,
+        base_url: str | None = None,
+    ) -> None:
+        # Any openai compatible api can be used, e.g. a local server
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self._create_chat_url = f"{self.base_url}/chat/completions"
+        self._create_embedding_url = f"{self.base_url}/embeddings"
 
         self.token = token
 
-    def send_chat(
-            self, model: str, messages: list[ChatMessage], tools: list[ChatTool], tool_choice: ChatToolChoice | None = None
-    ) -> CreateChatResponse:
-        chat_req = CreateChatRequest(model=model, messages=messages, tools=tools, tool_choice=tool_choice)
-        headers = {
+        self.embedding_cache = embedding_cache
+
+    def _headers(self) -> dict[str, str]:
+        return {
             "content-type": "application/json",
             "Authorization": "Bearer " + self.token,
         }
 
-        json = chat_req.model_dump_json(exclude_unset=True)
-        log.debug(f"making api request with data: {json}")
+    @staticmethod
+    def _trace_exchange(span: SpanLike, data: str, resp: TransportResponse) -> None:
+        span.set("request_bytes", len(data))
+        span.set("response_bytes", len(resp.content))
+        span.set("retries", resp.retries)
+        span.set("status", resp.status_code)
+
+    @staticmethod
+    def _trace_embedding_usage(span: SpanLike, response: EmbeddingResponse) -> None:
+        if response.usage:
+            span.set("prompt_tokens", response.usage.prompt_tokens)
+
+    @staticmethod
+    def _encode_chat(
+        model: str,
+        messages: Sequence[ChatMessage | MessageRecord],
+        tools: list[ChatTool],
+        tool_choice: ChatToolChoice | None,
+        stream: bool = False,
+        encoder: ChatRequestEncoder | None = None,
+    ) -> str:
+        if encoder:
+            json = encoder.encode(model, messages, tools, tool_choice, stream=stream)
+        else:
+            # Compact history records are only turned back into pydantic models here, at the edge
+            wire_messages = [
+                message.to_chat_message() if isinstance(message, MessageRecord) else message
+                for message in messages
+            ]
+            chat_req = CreateChatRequest(model=model, messages=wire_messages, tools=tools, tool_choice=tool_choice)
+
+            if stream:
+                chat_req.stream = True
+                chat_req.stream_options = ChatStreamOptions(include_usage=True)
+
+            json = chat_req.model_dump_json(exclude_unset=True)
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"making api request with data: {json}")
+
+        return json
+
+    @staticmethod
+    def _encode_embedding(model: str, text: str | list[str], dimensions: int | None) -> str:
+        # base64 is well under half the size of the float text and decodes straight into a float array
+        embedding_req = CreateEmbeddingRequest(input=text, model=model, encoding_format="base64")
+
+        if dimensions:
+            embedding_req.dimensions = dimensions
+
+        json = embedding_req.model_dump_json(exclude_unset=True)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"making api request with data: {json}")
+
+        return json
+
+    @staticmethod
+    def _decode_chat(resp: TransportResponse) -> CreateChatResponse:
+        BaseClient._log_response(resp)
+        resp.raise_for_status()
+
+        # Validate straight from the response bytes instead of building python dicts first
+        return CreateChatResponse.model_validate_json(resp.content)
+
+    @staticmethod
+    def _decode_chat_chunk(data: str) -> CreateChatChunk:
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"recieved chunk: {data}")
+
+        return CreateChatChunk.model_validate_json(data)
+
+    @staticmethod
+    def _decode_embedding(resp: TransportResponse) -> EmbeddingResponse:
+        BaseClient._log_response(resp)
+        resp.raise_for_status()
+
+        return EmbeddingResponse.model_validate_json(resp.content)
+
+    @staticmethod
+    def _log_response(resp: TransportResponse) -> None:
+        # Responses can be megabytes, only format them when someone is listening
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"recieved headers: {resp.headers}")
+            log.debug(f"recieved data: {resp.content!r}")
+
+    def _cached_embedding(
+        self, model: str, text: str, dimensions: int | None
+    ) -> EmbeddingResponse | None:
+        if not self.embedding_cache:
+            return None
+
+        embedding = self.embedding_cache.get(model, dimensions, text)
+
+        if embedding is None:
+            return None
+
+        # The vector came from a response we already validated, skip validating it again
+        return EmbeddingResponse.model_construct(
+            object="list",
+            data=[Embedding.model_construct(index=0, embedding=embedding, object="embedding")],
+        )
+
+    def _cache_embedding(
+        self, model: str, text: str, dimensions: int | None, response: EmbeddingResponse
+    ) -> None:
+        if self.embedding_cache:
+            self.embedding_cache.put(model, dimensions, text, response.data[0].embedding)
+
+    def _plan_embeddings(
+        self, model: str, texts: list[str], dimensions: int | None
+    ) -> tuple[dict[str, FloatArray], list[list[str]]]:
+        """
+        Splits a batch into the embeddings we already have cached and chunks of the remaining unique texts
+        that each fit in a single request
+        """
+        found: dict[str, FloatArray] = {}
+        missing: list[str] = []
+
+        for text in dict.fromkeys(texts):
+            embedding = (
+                self.embedding_cache.get(model, dimensions, text)
+                if self.embedding_cache
+                else None
+            )
+
+            if embedding is None:
+                missing.append(text)
+            else:
+                found[text] = embedding
+
+        chunks: list[list[str]] = []
+        chunk_tokens = 0
+        for text in missing:
+            text_tokens = len(text) // EMBEDDING_CHARS_PER_TOKEN + 1
+
+            if (
+                not chunks
+                or len(chunks[-1]) >= MAX_EMBEDDING_INPUTS
+                or chunk_tokens + text_tokens > MAX_EMBEDDING_REQUEST_TOKENS
+            ):
+                chunks.append([])
+                chunk_tokens = 0
+
+            chunks[-1].append(text)
+            chunk_tokens += text_tokens
+
+        return found, chunks
+
+    def _collect_embeddings(
+        self,
+        model: str,
+        chunk: list[str],
+        dimensions: int | None,
+        response: EmbeddingResponse,
+        found: dict[str, FloatArray],
+    ) -> None:
+        for embedding in response.data:
+            text = chunk[embedding.index]
+            found[text] = embedding.embedding
 
-        resp = requests.post(
+            if self.embedding_cache:
+                self.embedding_cache.put(model, dimensions, text, embedding.embedding)
+
+
+class Client(BaseClient):
+    def __init__(
+        self,
+        token: str,
+        transport: Transport | None = None,
+        embedding_cache: EmbeddingCache | None = None,
+        base_url: str | None = None,
+    ) -> None:
+        super().__init__(token, embedding_cache, base_url)
+
+        self._transport = transport or RequestsTransport()
+
+    def send_chat(
+            self,
+            model: str,
+            messages: Sequence[ChatMessage | MessageRecord],
+            tools: list[ChatTool],
+            tool_choice: ChatToolChoice | None = None,
+            *,
+            encoder: ChatRequestEncoder | None = None,
+    ) -> CreateChatResponse:
+        with tracer.span("chat", model=model) as span:
+            data = self._encode_chat(model, messages, tools, tool_choice, encoder=encoder)
+            resp = self._transport.post(self._create_chat_url, headers=self._headers(), data=data)
+            self._trace_exchange(span, data, resp)
+
+            response = self._decode_chat(resp)
+            span.set("prompt_tokens", response.usage.prompt_tokens)
+            span.set("completion_tokens", response.usage.completion_tokens)
+
+        return response
+
+    def stream_chat(
+            self,
+            model: str,
+            messages: Sequence[ChatMessage | MessageRecord],
+            tools: list[ChatTool],
+            tool_choice: ChatToolChoice | None = None,
+            *,
+            encoder: ChatRequestEncoder | None = None,
+    ) -> Iterator[CreateChatChunk]:
+        lines = self._transport.stream(
             self._create_chat_url,
-            headers=headers,
-            data=json,
+            headers=self._headers(),
+            data=self._encode_chat(
+                model, messages, tools, tool_choice, stream=True, encoder=encoder
+            ),
         )
 
-        log.debug(f"recieved headers: {resp.headers}")
-        json_res = resp.json()
-        log.debug(f"recieved data: {json_res}")
+        for data in iter_sse_data(lines):
+            yield self._decode_chat_chunk(data)
 
-        resp.raise_for_status()
+    def create_embedding(
+        self, model: str, text: str, dimensions: int | None = None
+    ) -> EmbeddingResponse:
+        if cached := self._cached_embedding(model, text, dimensions):
+            return cached
 
-        return CreateChatResponse(**json_res)
+        with tracer.span("embedding", model=model) as span:
+            data = self._encode_embedding(model, text, dimensions)
+            resp = self._transport.post(self._create_embedding_url, headers=self._headers(), data=data)
+            self._trace_exchange(span, data, resp)
 
-    def create_embedding(self, model: str, text: str) -> EmbeddingResponse:
-        embedding_req = CreateEmbeddingRequest(input=text, model=model)
+            response = self._decode_embedding(resp)
+            self._trace_embedding_usage(span, response)
 
-        headers = {
-            "content-type": "application/json",
-            "Authorization": "Bearer " + self.token,
-        }
+        self._cache_embedding(model, text, dimensions, response)
 
-        json = embedding_req.model_dump_json(exclude_unset=True)
-        log.debug(f"making api request with data: {json}")
+        return response
+
+    def create_embeddings(
+        self,
+        model: str,
+        texts: list[str],
+        dimensions: int | None = None,
+        concurrency: int = 4,
+    ) -> list[FloatArray]:
+        """
+        Embeds a batch of texts, splitting it into as few requests as the providers limits allow and sending them concurrently
+        :param model: the embedding model to use
+        :param texts: the texts to embed
+        :param dimensions: optionally shorten the embeddings to this many dimensions
+        :param concurrency: the max number of requests in flight at once
+        :return: the embeddings in the same order as the given texts
+        """
+        found, chunks = self._plan_embeddings(model, texts, dimensions)
+
+        def send_chunk(chunk: list[str]) -> EmbeddingResponse:
+            with tracer.span("embedding", model=model, inputs=len(chunk)) as span:
+                data = self._encode_embedding(model, chunk, dimensions)
+                resp = self._transport.post(self._create_embedding_url, headers=self._headers(), data=data)
+                self._trace_exchange(span, data, resp)
+
+                response = self._decode_embedding(resp)
+                self._trace_embedding_usage(span, response)
+
+            return response
+
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks)))) as pool:
+            for chunk, response in zip(chunks, pool.map(send_chunk, chunks)):
+                self._collect_embeddings(model, chunk, dimensions, response, found)
+
+        return [found[text] for text in texts]
+
+    def close(self) -> None:
+        self._transport.close()
 
-        resp = requests.post(
-            self._create_embedding_url,
-            headers=headers,
-            data=json,
+
+class AsyncClient(BaseClient):
+    def __init__(
+        self,
+        token: str,
+        transport: AsyncTransport | None = None,
+        embedding_cache: EmbeddingCache | None = None,
+        base_url: str | None = None,
+    ) -> None:
+        super().__init__(token, embedding_cache, base_url)
+
+        self._transport = transport or HttpxAsyncTransport()
+
+    async def send_chat(
+            self,
+            model: str,
+            messages: Sequence[ChatMessage | MessageRecord],
+            tools: list[ChatTool],
+            tool_choice: ChatToolChoice | None = None,
+            *,
+            encoder: ChatRequestEncoder | None = None,
+    ) -> CreateChatResponse:
+        with tracer.span("chat", model=model) as span:
+            data = self._encode_chat(model, messages, tools, tool_choice, encoder=encoder)
+            resp = await self._transport.post(self._create_chat_url, headers=self._headers(), data=data)
+            self._trace_exchange(span, data, resp)
+
+            response = self._decode_chat(resp)
+            span.set("prompt_tokens", response.usage.prompt_tokens)
+            span.set("completion_tokens", response.usage.completion_tokens)
+
+        return response
+
+    async def stream_chat(
+            self,
+            model: str,
+            messages: Sequence[ChatMessage | MessageRecord],
+            tools: list[ChatTool],
+            tool_choice: ChatToolChoice | None = None,
+            *,
+            encoder: ChatRequestEncoder | None = None,
+    ) -> AsyncIterator[CreateChatChunk]:
+        lines = self._transport.stream(
+            self._create_chat_url,
+            headers=self._headers(),
+            data=self._encode_chat(
+                model, messages, tools, tool_choice, stream=True, encoder=encoder
+            ),
         )
 
-        log.debug(f"recieved headers: {resp.headers}")
-        json_res = resp.json()
-        log.debug(f"recieved data: {json_res}")
+        async for data in aiter_sse_data(lines):
+            yield self._decode_chat_chunk(data)
 
-        resp.raise_for_status()
+    async def create_embedding(
+        self, model: str, text: str, dimensions: int | None = None
+    ) -> EmbeddingResponse:
+        if cached := self._cached_embedding(model, text, dimensions):
+            return cached
+
+        with tracer.span("embedding", model=model) as span:
+            data = self._encode_embedding(model, text, dimensions)
+            resp = await self._transport.post(self._create_embedding_url, headers=self._headers(), data=data)
+            self._trace_exchange(span, data, resp)
+
+            response = self._decode_embedding(resp)
+            self._trace_embedding_usage(span, response)
+
+        self._cache_embedding(model, text, dimensions, response)
+
+        return response
+
+    async def create_embeddings(
+        self,
+        model: str,
+        texts: list[str],
+        dimensions: int | None = None,
+        concurrency: int = 4,
+    ) -> list[FloatArray]:
+        """
+        Embeds a batch of texts, splitting it into as few requests as the providers limits allow and sending them concurrently
+        :param model: the embedding model to use
+        :param texts: the texts to embed
+        :param dimensions: optionally shorten the embeddings to this many dimensions
+        :param concurrency: the max number of requests in flight at once
+        :return: the embeddings in the same order as the given texts
+        """
+        found, chunks = self._plan_embeddings(model, texts, dimensions)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send_chunk(chunk: list[str]) -> EmbeddingResponse:
+            async with semaphore:
+                with tracer.span("embedding", model=model, inputs=len(chunk)) as span:
+                    data = self._encode_embedding(model, chunk, dimensions)
+                    resp = await self._transport.post(self._create_embedding_url, headers=self._headers(), data=data)
+                    self._trace_exchange(span, data, resp)
+
+                    response = self._decode_embedding(resp)
+                    self._trace_embedding_usage(span, response)
+
+            return response
+
+        responses = await asyncio.gather(*(send_chunk(chunk) for chunk in chunks))
+
+        for chunk, response in zip(chunks, responses):
+            self._collect_embeddings(model, chunk, dimensions, response, found)
+
+        return [found[text] for text in texts]
 
-        return EmbeddingResponse(**json_res)
+    async def close(self) -> None:
+        await self._transport.close()
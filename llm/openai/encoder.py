@@ -0,0 +1,114 @@
+import json
+from typing import Sequence
+
+from llm.openai.models.chat import ChatMessage, ChatTool, ChatToolChoice
+from llm.openai.models.record import MessageRecord
+
+
+class ChatRequestEncoder:
+    """
+    Incrementally encodes chat completion requests for a single conversation. The JSON fragment of every message and
+    tool is cached by identity, so each turn only serializes what is new instead of the whole history. Messages and
+    tools must not be mutated once they have been sent
+    """
+
+    def __init__(self, parent: "ChatRequestEncoder | None" = None) -> None:
+        self._message_fragments: dict[int, tuple[ChatMessage, str]] = {}
+        self._tool_fragments: dict[int, tuple[ChatTool, str]] = (
+            parent._tool_fragments if parent else {}
+        )
+
+        # Fragments are looked up in the encoder this one was forked from before encoding from scratch
+        self._parent = parent
+
+        self._tools_key: tuple[int, ...] | None = None
+        self._tools_json = "[]"
+
+    def fork(self) -> "ChatRequestEncoder":
+        """
+        Creates an encoder for a forked conversation that reuses the fragments this one has already encoded
+        """
+        return ChatRequestEncoder(parent=self)
+
+    def register_tool(self, tool: ChatTool, fragment: str) -> None:
+        """
+        Seeds the cache with an already serialized tool schema
+        :param tool: the tool the fragment belongs to
+        :param fragment: the tools JSON as produced by model_dump_json(exclude_unset=True)
+        """
+        self._tool_fragments[id(tool)] = (tool, fragment)
+
+    def encode(
+        self,
+        model: str,
+        messages: Sequence[ChatMessage | MessageRecord],
+        tools: Sequence[ChatTool],
+        tool_choice: ChatToolChoice | None = None,
+        stream: bool = False,
+    ) -> str:
+        parts = [
+            '{"model":',
+            json.dumps(model),
+            ',"messages":[',
+            self._encode_messages(messages),
+            '],"tools":',
+            self._encode_tools(tools),
+        ]
+
+        if tool_choice:
+            parts += [',"tool_choice":', tool_choice.model_dump_json(exclude_unset=True)]
+
+        if stream:
+            parts.append(',"stream":true,"stream_options":{"include_usage":true}')
+
+        parts.append("}")
+
+        return "".join(parts)
+
+    def _encode_messages(self, messages: Sequence[ChatMessage | MessageRecord]) -> str:
+        # Rebuild the cache from the messages we were given so fragments of messages no longer sent are released
+        fragments: dict[int, tuple[ChatMessage, str]] = {}
+        parts = []
+
+        for message in messages:
+            # Records carry their own encoded fragment, only pydantic messages need the identity cache
+            if isinstance(message, MessageRecord):
+                parts.append(message.wire_json())
+                continue
+
+            cached = self._message_fragments.get(id(message))
+
+            if not cached and self._parent:
+                cached = self._parent._message_fragments.get(id(message))
+
+            # Guard against a freed message whose id has been reused by a new one
+            if not cached or cached[0] is not message:
+                cached = (message, message.model_dump_json(exclude_unset=True))
+
+            fragments[id(message)] = cached
+            parts.append(cached[1])
+
+        self._message_fragments = fragments
+
+        return ",".join(parts)
+
+    def _encode_tools(self, tools: Sequence[ChatTool]) -> str:
+        tools_key = tuple(id(tool) for tool in tools)
+
+        if tools_key == self._tools_key:
+            return self._tools_json
+
+        fragments = []
+        for tool in tools:
+            cached = self._tool_fragments.get(id(tool))
+
+            if not cached or cached[0] is not tool:
+                cached = (tool, tool.model_dump_json(exclude_unset=True))
+                self._tool_fragments[id(tool)] = cached
+
+            fragments.append(cached[1])
+
+        self._tools_key = tools_key
+        self._tools_json = "[" + ",".join(fragments) + "]"
+
+        return self._tools_json
@@ -83,6 +83,10 @@ class ChatMessage(BaseModel):
     tool_calls: list[ChatToolCall] | None = None
 
 
+class ChatStreamOptions(BaseModel):
+    include_usage: bool
+
+
 class CreateChatRequest(BaseModel):
     model: str
     messages: list[ChatMessage]
@@ -97,6 +101,7 @@ class CreateChatRequest(BaseModel):
     presence_penalty: float | None = None
     frequency_penalty: float | None = None
     stream: bool | None = None
+    stream_options: ChatStreamOptions | None = None
     stop: list[str] | None = None
     logit_bias: dict[str, int] | None = None
     user: str | None = None
@@ -121,3 +126,37 @@ class CreateChatResponse(BaseModel):
     model: str
     choices: list[CreateChatChoices]
     usage: CreateChatUsage
+
+
+# ---- Streaming response chunks, every field of a delta is optional as the model sends them incrementally ----
+class ChatFunctionCallDelta(BaseModel):
+    name: str | None = None
+    arguments: str | None = None
+
+
+class ChatToolCallDelta(BaseModel):
+    index: int
+    id: str | None = None
+    type: ChatRoleType | None = None
+    function: ChatFunctionCallDelta | None = None
+
+
+class ChatMessageDelta(BaseModel):
+    role: ChatRoleType | None = None
+    content: str | None = None
+    tool_calls: list[ChatToolCallDelta] | None = None
+
+
+class CreateChatChunkChoices(BaseModel):
+    index: int
+    delta: ChatMessageDelta
+    finish_reason: str | None = None
+
+
+class CreateChatChunk(BaseModel):
+    id: str
+    object: str
+    created: datetime.datetime
+    model: str
+    choices: list[CreateChatChunkChoices]
+    usage: CreateChatUsage | None = None
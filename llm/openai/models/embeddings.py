@@ -1,5 +1,39 @@
-from typing import Literal
-from pydantic import BaseModel
+import base64
+import sys
+from array import array
+from typing import TYPE_CHECKING, Annotated, Any, Literal, TypeAlias
+from pydantic import BaseModel, PlainSerializer, PlainValidator
+
+# array only takes a type argument at runtime from python 3.12 on
+if TYPE_CHECKING:
+    FloatArray: TypeAlias = array[float]
+else:
+    FloatArray = array
+
+
+def _decode_vector(value: Any) -> FloatArray:
+    if isinstance(value, array):
+        return value
+
+    if isinstance(value, str):
+        # base64 encoding_format, the raw little endian float32 values
+        vector = array("f")
+        vector.frombytes(base64.b64decode(value))
+
+        if sys.byteorder == "big":
+            vector.byteswap()
+
+        return vector
+
+    return array("f", value)
+
+
+# Embeddings are kept as packed float32 arrays, the precision the api computes them at
+EmbeddingVector = Annotated[
+    FloatArray,
+    PlainValidator(_decode_vector),
+    PlainSerializer(lambda vector: vector.tolist(), return_type=list[float]),
+]
 
 
 class CreateEmbeddingRequest(BaseModel):
@@ -12,10 +46,16 @@ class CreateEmbeddingRequest(BaseModel):
 
 class Embedding(BaseModel):
     index: int
-    embedding: list[float]
+    embedding: EmbeddingVector
     object: Literal["embedding"]
 
 
+class EmbeddingUsage(BaseModel):
+    prompt_tokens: int
+    total_tokens: int
+
+
 class EmbeddingResponse(BaseModel):
     object: Literal["list"]
     data: list[Embedding]
+    usage: EmbeddingUsage | None = None
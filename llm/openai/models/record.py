@@ -0,0 +1,139 @@
+import json
+from typing import Any
+
+from llm.openai.models.chat import ASSISTANT_ROLE, ChatMessage, ChatRoleType
+
+
+class ToolCallRecord:
+    __slots__ = ("id", "type", "name", "arguments")
+
+    def __init__(self, id: str, type: ChatRoleType, name: str, arguments: bytes) -> None:
+        self.id = id
+        self.type = type
+        self.name = name
+        # The raw JSON object the model sent, only parsed when a caller asks for it
+        self.arguments = arguments
+
+    def parsed_arguments(self) -> dict[str, Any]:
+        return json.loads(self.arguments)
+
+
+class MessageRecord:
+    """
+    Compact, immutable form of a ChatMessage used to keep long conversation histories. Plain slotted attributes
+    instead of a pydantic model, tool call arguments kept as raw JSON bytes, and the messages wire JSON encoded
+    at most once. Convert back to a ChatMessage with to_chat_message when a pydantic model is needed
+    """
+
+    __slots__ = ("role", "content", "name", "tool_call_id", "tool_calls", "_wire_json")
+
+    def __init__(
+        self,
+        role: ChatRoleType,
+        content: str | None = None,
+        name: str | None = None,
+        tool_call_id: str | None = None,
+        tool_calls: tuple[ToolCallRecord, ...] | None = None,
+    ) -> None:
+        self.role = role
+        self.content = content
+        self.name = name
+        self.tool_call_id = tool_call_id
+        self.tool_calls = tool_calls
+
+        self._wire_json: str | None = None
+
+    @classmethod
+    def from_chat_message(cls, message: ChatMessage) -> "MessageRecord":
+        tool_calls = None
+        if message.tool_calls:
+            tool_calls = tuple(
+                ToolCallRecord(
+                    tool_call.id,
+                    tool_call.type,
+                    tool_call.function.name,
+                    json.dumps(tool_call.function.arguments).encode(),
+                )
+                for tool_call in message.tool_calls
+            )
+
+        return cls(
+            message.role,
+            content=message.content,
+            name=message.name,
+            tool_call_id=message.tool_call_id,
+            tool_calls=tool_calls,
+        )
+
+    @classmethod
+    def from_wire_json(cls, data: str) -> "MessageRecord":
+        """
+        Inverse of wire_json, the given JSON is kept as the records encoded form
+        """
+        wire = json.loads(data)
+
+        tool_calls = None
+        if wire.get("tool_calls"):
+            tool_calls = tuple(
+                ToolCallRecord(
+                    tool_call["id"],
+                    tool_call["type"],
+                    tool_call["function"]["name"],
+                    tool_call["function"]["arguments"].encode(),
+                )
+                for tool_call in wire["tool_calls"]
+            )
+
+        record = cls(
+            wire["role"],
+            content=wire.get("content"),
+            name=wire.get("name"),
+            tool_call_id=wire.get("tool_call_id"),
+            tool_calls=tool_calls,
+        )
+        record._wire_json = data
+
+        return record
+
+    def to_chat_message(self) -> ChatMessage:
+        return ChatMessage.model_validate(self._wire_dict())
+
+    def wire_json(self) -> str:
+        """
+        The message as it is sent to the api, equivalent to ChatMessage.model_dump_json(exclude_unset=True)
+        """
+        if self._wire_json is None:
+            self._wire_json = json.dumps(self._wire_dict(), separators=(",", ":"))
+
+        return self._wire_json
+
+    def _wire_dict(self) -> dict[str, Any]:
+        wire: dict[str, Any] = {"role": self.role}
+
+        # An assistant message that only made tool calls still has to send its empty content
+        if self.content is not None or self.role == ASSISTANT_ROLE:
+            wire["content"] = self.content
+
+        if self.name is not None:
+            wire["name"] = self.name
+
+        if self.tool_call_id is not None:
+            wire["tool_call_id"] = self.tool_call_id
+
+        if self.tool_calls:
+            wire["tool_calls"] = [
+                {
+                    "id": tool_call.id,
+                    "type": tool_call.type,
+                    "function": {
+                        "name": tool_call.name,
+                        "arguments": tool_call.arguments.decode(),
+                    },
+                }
+                for tool_call in self.tool_calls
+            ]
+
+        return wire
+
+    def __repr__(self) -> str:
+        return f"MessageRecord(role={self.role!r}, content={self.content!r})"
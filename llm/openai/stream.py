@@ -0,0 +1,164 @@
+import datetime
+from typing import Any, AsyncIterator, Iterator
+
+from llm.openai.models.chat import (
+    ASSISTANT_ROLE,
+    ChatRoleType,
+    CreateChatChoices,
+    CreateChatChunk,
+    CreateChatResponse,
+    CreateChatUsage,
+)
+
+SSE_DATA_PREFIX = "data:"
+SSE_DONE = "[DONE]"
+
+
+def parse_sse_line(line: str) -> str | None:
+    """
+    Extracts the payload of a single server sent event line
+    :param line: a raw line from the event stream
+    :return: the data payload, or None if the line carries no data (comments, blank keep alive lines)
+    """
+    if not line.startswith(SSE_DATA_PREFIX):
+        return None
+
+    return line[len(SSE_DATA_PREFIX) :].strip()
+
+
+def iter_sse_data(lines: Iterator[str]) -> Iterator[str]:
+    for line in lines:
+        data = parse_sse_line(line)
+
+        if data is None:
+            continue
+
+        if data == SSE_DONE:
+            return
+
+        yield data
+
+
+async def aiter_sse_data(lines: AsyncIterator[str]) -> AsyncIterator[str]:
+    async for line in lines:
+        data = parse_sse_line(line)
+
+        if data is None:
+            continue
+
+        if data == SSE_DONE:
+            return
+
+        yield data
+
+
+class _ToolCallState:
+    def __init__(self) -> None:
+        self.id = ""
+        self.type: ChatRoleType | None = None
+        self.name = ""
+        self.arguments: list[str] = []
+
+
+class _ChoiceState:
+    def __init__(self) -> None:
+        self.role: ChatRoleType = ASSISTANT_ROLE
+        self.content: list[str] = []
+        self.tool_calls: dict[int, _ToolCallState] = {}
+        self.finish_reason: str | None = None
+
+
+class ChatStreamAccumulator:
+    """
+    Assembles the deltas of a streamed chat completion back into the same CreateChatResponse a non streamed
+    request would have returned. Tool call argument fragments are joined as they arrive and only parsed once complete
+    """
+
+    def __init__(self) -> None:
+        self._choices: dict[int, _ChoiceState] = {}
+        self._usage: CreateChatUsage | None = None
+
+        self._id = ""
+        self._model = ""
+        self._created: datetime.datetime | None = None
+
+    def add(self, chunk: CreateChatChunk) -> None:
+        self._id = chunk.id
+        self._model = chunk.model
+        self._created = chunk.created
+
+        if chunk.usage:
+            self._usage = chunk.usage
+
+        for chunk_choice in chunk.choices:
+            choice = self._choices.setdefault(chunk_choice.index, _ChoiceState())
+            delta = chunk_choice.delta
+
+            if delta.role:
+                choice.role = delta.role
+
+            if delta.content:
+                choice.content.append(delta.content)
+
+            for tool_call_delta in delta.tool_calls or []:
+                tool_call = choice.tool_calls.setdefault(
+                    tool_call_delta.index, _ToolCallState()
+                )
+
+                if tool_call_delta.id:
+                    tool_call.id = tool_call_delta.id
+
+                if tool_call_delta.type:
+                    tool_call.type = tool_call_delta.type
+
+                if tool_call_delta.function:
+                    if tool_call_delta.function.name:
+                        tool_call.name += tool_call_delta.function.name
+
+                    if tool_call_delta.function.arguments:
+                        tool_call.arguments.append(tool_call_delta.function.arguments)
+
+            if chunk_choice.finish_reason:
+                choice.finish_reason = chunk_choice.finish_reason
+
+    def result(self) -> CreateChatResponse:
+        choices = []
+        for index, choice in sorted(self._choices.items()):
+            message: dict[str, Any] = {
+                "role": choice.role,
+                "content": "".join(choice.content) or None,
+            }
+
+            if choice.tool_calls:
+                message["tool_calls"] = [
+                    {
+                        "id": tool_call.id,
+                        "type": tool_call.type,
+                        "function": {
+                            "name": tool_call.name,
+                            "arguments": "".join(tool_call.arguments) or "{}",
+                        },
+                    }
+                    for _, tool_call in sorted(choice.tool_calls.items())
+                ]
+
+            choices.append(
+                CreateChatChoices.model_validate(
+                    {
+                        "index": index,
+                        "message": message,
+                        "finish_reason": choice.finish_reason or "stop",
+                    }
+                )
+            )
+
+        return CreateChatResponse(
+            id=self._id,
+            object="chat.completion",
+            created=self._created or datetime.datetime.now(datetime.timezone.utc),
+            model=self._model,
+            choices=choices,
+            # Usage is only sent on the final chunk when requested, a stream cut short will not have it
+            usage=self._usage
+            or CreateChatUsage(prompt_tokens=0, completion_tokens=0, total_tokens=0),
+        )
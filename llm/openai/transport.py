@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Iterator, Mapping
+from urllib.parse import urlsplit
+
+# The http libraries are imported when the first request is made, importing them is a sizeable part of startup
+if TYPE_CHECKING:
+    import httpx
+    import requests
+    from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+class TransportConfig:
+    def __init__(
+        self,
+        *,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        pool_connections: int = 4,
+        pool_maxsize: int = 16,
+        host_pool_sizes: dict[str, int] | None = None,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        retry_read_errors: bool = False,
+    ) -> None:
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # Number of distinct hosts to keep pools for, and connections kept alive per host
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        # Per host overrides of pool_maxsize keyed by hostname, e.g. {"api.openai.com": 32}
+        self.host_pool_sizes = host_pool_sizes or {}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Only failures to connect are retried by default, a request that timed out or lost its connection after it
+        # was sent may already have been processed and billed. Enable when duplicate requests are harmless
+        self.retry_read_errors = retry_read_errors
+
+    def backoff(self, attempt: int, retry_after: str | None = None) -> float:
+        """
+        Full jitter exponential backoff, honoring the servers retry-after header when it gives us one
+        :param attempt: the zero based retry attempt
+        :param retry_after: the raw retry-after header value if present
+        :return: the number of seconds to wait before retrying
+        """
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+
+        ceiling = min(self.backoff_max, self.backoff_base * (2**attempt))
+        return random.uniform(0, ceiling)
+
+
+class TransportResponse:
+    def __init__(
+        self, response: requests.Response | httpx.Response, retries: int = 0
+    ) -> None:
+        self.status_code = response.status_code
+        self.headers: Mapping[str, str] = response.headers
+        self.content = response.content
+        self.retries = retries
+
+        self._response = response
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        self._response.raise_for_status()
+
+
+class Transport:
+    def post(
+        self, url: str, headers: dict[str, str], data: str | bytes
+    ) -> TransportResponse:
+        raise NotImplementedError()
+
+    def stream(
+        self, url: str, headers: dict[str, str], data: str | bytes
+    ) -> Iterator[str]:
+        """
+        Posts the request and yields the response body line by line as it arrives
+        """
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        pass
+
+
+class RequestsTransport(Transport):
+    """
+    Transport backed by a single long lived requests.Session so that connections are pooled and kept alive
+    between model turns instead of paying the TCP+TLS handshake on every request
+    """
+
+    def __init__(self, config: TransportConfig | None = None) -> None:
+        self.config = config or TransportConfig()
+
+        self._session: requests.Session | None = None
+
+    def _get_session(self) -> requests.Session:
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+
+            default_adapter = self._create_adapter(self.config.pool_maxsize)
+            self._session.mount("https://", default_adapter)
+            self._session.mount("http://", default_adapter)
+
+            for host, pool_size in self.config.host_pool_sizes.items():
+                adapter = self._create_adapter(pool_size)
+                self._session.mount(f"https://{host}/", adapter)
+                self._session.mount(f"http://{host}/", adapter)
+
+        return self._session
+
+    def _create_adapter(self, pool_maxsize: int) -> HTTPAdapter:
+        from requests.adapters import HTTPAdapter
+
+        # Retries are handled by us so that they can be jittered and logged, disable urllib3's own
+        return HTTPAdapter(
+            pool_connections=self.config.pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=0,
+        )
+
+    def post(
+        self, url: str, headers: dict[str, str], data: str | bytes
+    ) -> TransportResponse:
+        resp, retries = self._post_with_retries(url, headers, data, stream=False)
+        return TransportResponse(resp, retries=retries)
+
+    def stream(
+        self, url: str, headers: dict[str, str], data: str | bytes
+    ) -> Iterator[str]:
+        resp, _ = self._post_with_retries(url, headers, data, stream=True)
+
+        try:
+            resp.raise_for_status()
+
+            # Event streams are always utf-8, requests would otherwise fall back to latin-1 for text/* responses
+            resp.encoding = "utf-8"
+            yield from resp.iter_lines(decode_unicode=True)
+        finally:
+            resp.close()
+
+    def _post_with_retries(
+        self, url: str, headers: dict[str, str], data: str | bytes, stream: bool
+    ) -> tuple[requests.Response, int]:
+        import requests
+
+        session = self._get_session()
+        attempt = 0
+
+        while True:
+            try:
+                resp = session.post(
+                    url,
+                    headers=headers,
+                    data=data,
+                    timeout=(self.config.connect_timeout, self.config.read_timeout),
+                    stream=stream,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.config.max_retries or not self._should_retry(e):
+                    raise
+
+                delay = self.config.backoff(attempt)
+                log.warning(
+                    f"request to {urlsplit(url).netloc} failed with '{e}', retrying in {delay:.2f}s"
+                )
+            else:
+                if (
+                    resp.status_code not in RETRY_STATUS_CODES
+                    or attempt >= self.config.max_retries
+                ):
+                    return resp, attempt
+
+                delay = self.config.backoff(attempt, resp.headers.get("retry-after"))
+                log.warning(
+                    f"request to {urlsplit(url).netloc} returned {resp.status_code}, retrying in {delay:.2f}s"
+                )
+
+                # Release the connection back to the pool before we sleep
+                resp.close()
+
+            attempt += 1
+            time.sleep(delay)
+
+    def _should_retry(self, error: Exception) -> bool:
+        import requests
+        from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+
+        # urllib3 reports a connection that could not be opened as a MaxRetryError, the request was never sent
+        reason = error.args[0] if error.args else None
+        if isinstance(reason, MaxRetryError) and isinstance(reason.reason, NewConnectionError):
+            return True
+
+        return self.config.retry_read_errors
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+
+
+class AsyncTransport:
+    async def post(
+        self, url: str, headers: dict[str, str], data: str | bytes
+    ) -> TransportResponse:
+        raise NotImplementedError()
+
+    def stream(
+        self, url: str, headers: dict[str, str], data: str | bytes
+    ) -> AsyncIterator[str]:
+        """
+        Posts the request and yields the response body line by line as it arrives
+        """
+        raise NotImplementedError()
+
+    async def close(self) -> None:
+        pass
+
+
+class HttpxAsyncTransport(AsyncTransport):
+    """
+    Asyncio transport backed by a single httpx.AsyncClient, many sessions can share one instance and multiplex
+    their requests over its connection pool from a single event loop
+    """
+
+    def __init__(self, config: TransportConfig | None = None) -> None:
+        self.config = config or TransportConfig()
+
+        # Built on the first request, loading the certificate bundle is the bulk of a sessions construction time
+        self._client: httpx.AsyncClient | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    self.config.read_timeout, connect=self.config.connect_timeout
+                ),
+                limits=self._create_limits(self.config.pool_maxsize),
+                mounts={
+                    f"all://{host}": httpx.AsyncHTTPTransport(
+                        limits=self._create_limits(pool_size)
+                    )
+                    for host, pool_size in self.config.host_pool_sizes.items()
+                },
+            )
+
+        return self._client
+
+    @staticmethod
+    def _create_limits(pool_maxsize: int) -> httpx.Limits:
+        import httpx
+
+        return httpx.Limits(
+            max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize
+        )
+
+    async def post(
+        self, url: str, headers: dict[str, str], data: str | bytes
+    ) -> TransportResponse:
+        resp, retries = await self._post_with_retries(url, headers, data, stream=False)
+        return TransportResponse(resp, retries=retries)
+
+    async def stream(
+        self, url: str, headers: dict[str, str], data: str | bytes
+    ) -> AsyncIterator[str]:
+        resp, _ = await self._post_with_retries(url, headers, data, stream=True)
+
+        try:
+            if resp.is_error:
+                await resp.aread()
+                resp.raise_for_status()
+
+            async for line in resp.aiter_lines():
+                yield line
+        finally:
+            await resp.aclose()
+
+    async def _post_with_retries(
+        self, url: str, headers: dict[str, str], data: str | bytes, stream: bool
+    ) -> tuple[httpx.Response, int]:
+        import httpx
+
+        attempt = 0
+
+        while True:
+            try:
+                client = self._get_client()
+                request = client.build_request(
+                    "POST", url, headers=headers, content=data
+                )
+                resp = await client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                # Connecting and waiting for a pooled connection happen before the request is sent
+                retryable = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+                if attempt >= self.config.max_retries or not (retryable or self.config.retry_read_errors):
+                    raise
+
+                delay = self.config.backoff(attempt)
+                log.warning(
+                    f"request to {urlsplit(url).netloc} failed with '{e}', retrying in {delay:.2f}s"
+                )
+            else:
+                if (
+                    resp.status_code not in RETRY_STATUS_CODES
+                    or attempt >= self.config.max_retries
+                ):
+                    return resp, attempt
+
+                delay = self.config.backoff(attempt, resp.headers.get("retry-after"))
+                log.warning(
+                    f"request to {urlsplit(url).netloc} returned {resp.status_code}, retrying in {delay:.2f}s"
+                )
+
+                # Release the connection back to the pool before we sleep
+                await resp.aclose()
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
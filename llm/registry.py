@@ -0,0 +1,153 @@
+import functools
+import hashlib
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import tempfile
+import threading
+from importlib.metadata import entry_points
+from typing import Any, Iterable
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+import llm.openai.models.chat as chat
+import llm.session as session_module
+from llm.session import Session, SessionGroup
+
+log = logging.getLogger(__name__)
+
+# Packages offer tool groups under this entry point group, e.g. in their pyproject.toml
+#   [tool.poetry.plugins."aeris.tool_groups"]
+#   weather = "aeris_weather.tools:group"
+ENTRY_POINT_GROUP = "aeris.tool_groups"
+
+CACHE_VERSION = 1
+
+
+class ToolRegistrySettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="AERIS_TOOLS_")
+
+    # Compiled tool schemas are kept here between runs, schemas are compiled on every start when empty
+    schema_cache_path: str | None = "model_output/tool_schemas.json"
+
+
+class ToolRegistry:
+    """
+    Tool groups by name, each a "module:attribute" reference to a SessionGroup. Adding them to a session does not
+    import them: their tool schemas come from a cache on disk, keyed by a hash of the source they were compiled from,
+    and a group is only imported once the model calls one of its functions. A group missing from the cache or whose
+    source changed is imported and compiled right away and the cache is updated
+    """
+
+    def __init__(self, settings: ToolRegistrySettings | None = None) -> None:
+        self.settings = settings or ToolRegistrySettings()
+        self.groups: dict[str, str] = {}
+
+        self._loaded: dict[str, SessionGroup] = {}
+        self._cache: dict[str, Any] | None = None
+        self._lock = threading.Lock()
+
+    def register(self, name: str, target: str) -> None:
+        """
+        :param name: the groups name
+        :param target: where the group is defined, as "module:attribute"
+        """
+        self.groups[name] = target
+
+    def discover(self) -> None:
+        """
+        Registers the groups installed packages offer through the aeris.tool_groups entry point group, groups
+        registered by name already take precedence
+        """
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+            self.groups.setdefault(entry_point.name, entry_point.value)
+
+    def load(self, name: str) -> SessionGroup:
+        """
+        Imports a group, it is imported once no matter how many sessions load it
+        """
+        with self._lock:
+            if name not in self._loaded:
+                module_name, _, attribute = self.groups[name].partition(":")
+                self._loaded[name] = getattr(importlib.import_module(module_name), attribute)
+
+            return self._loaded[name]
+
+    def add_to(self, session: Session, names: Iterable[str] | None = None) -> None:
+        """
+        Offers the groups to the session, groups with cached schemas are loaded on their first call
+        :param names: the groups to add, defaults to every registered group
+        """
+        changed = False
+
+        for name in names or list(self.groups):
+            source_hash = self._source_hash(name)
+            cached = self._read_cache().get(name)
+
+            if cached and cached["hash"] == source_hash:
+                session.add_lazy_group(cached["schemas"], functools.partial(self.load, name))
+                continue
+
+            functions = session.add_group(self.load(name))
+            self._read_cache()[name] = {
+                "hash": source_hash,
+                "schemas": [function.plan.schema_json for function in functions],
+            }
+            changed = True
+
+        if changed:
+            self._write_cache()
+
+    def _source_hash(self, name: str) -> str:
+        # The schema depends on the groups module and on how the session compiles it
+        module_name = self.groups[name].partition(":")[0]
+        spec = importlib.util.find_spec(module_name)
+
+        digest = hashlib.sha256(self.groups[name].encode())
+        for path in (spec.origin if spec else None, session_module.__file__, chat.__file__):
+            if path and os.path.exists(path):
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+
+        return digest.hexdigest()
+
+    def _read_cache(self) -> dict[str, Any]:
+        if self._cache is not None:
+            return self._cache
+
+        self._cache = {}
+        if not self.settings.schema_cache_path:
+            return self._cache
+
+        try:
+            with open(self.settings.schema_cache_path) as f:
+                cache = json.load(f)
+
+            if cache.get("version") == CACHE_VERSION:
+                self._cache = cache["groups"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, AttributeError) as e:
+            log.warning(f"ignoring unreadable tool schema cache {self.settings.schema_cache_path}: '{e}'")
+
+        return self._cache
+
+    def _write_cache(self) -> None:
+        path = self.settings.schema_cache_path
+        if not path:
+            return
+
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tool_schemas.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": CACHE_VERSION, "groups": self._cache}, f)
+
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
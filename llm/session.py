@@ -1,17 +1,33 @@
+import asyncio
+import contextlib
+import contextvars
+import copy
 import functools
 import inspect
 import json
-import copy
+import math
 import os
 import traceback
-from typing import Any, Callable, Required, Self, TypeVar, Type, Literal, get_args, get_origin
+from typing import Any, Awaitable, Callable, Coroutine, Required, Self, Sequence, TypeVar, Type, Literal, cast, get_args, get_origin
 import unicodedata
 import logging
+from concurrent.futures import Executor
 
 from colorama import Style
+from pydantic import ConfigDict, TypeAdapter
+from typing_extensions import TypedDict
 
 from llm.openai import client
-from llm.openai.client import Client
+from llm.openai.cache import EmbeddingCache
+from llm.openai.client import AsyncClient, Client
+from llm.checkpoint import SessionLog
+from llm.history import MessageHistory, to_record
+from llm.tool_cache import MISS, CachePolicy, ToolCacheStats, ToolResultCache
+from llm.tracing import tracer
+from llm.openai.encoder import ChatRequestEncoder
+from llm.openai.stream import ChatStreamAccumulator
+from llm.openai.transport import AsyncTransport, Transport
+from llm.openai.models.record import MessageRecord, ToolCallRecord
 from llm.openai.models.chat import (
     FUNCTION_ROLE,
     SYSTEM_ROLE,
@@ -23,14 +39,8 @@ from llm.openai.models.chat import (
     ChatToolChoice,
     ChatToolChoiceFunction,
     ChatToolFunction,
-)
-
-logging.Logger.root = logging.root
-logging.Logger.manager = logging.Manager(logging.Logger.root)
-
-logging.basicConfig(
-    format=f"{Style.DIM}%(asctime)s %(levelname)s %(name)s %(message)s{Style.RESET_ALL}",
-    level=logging.INFO,
+    CreateChatResponse,
+    CreateChatUsage,
 )
 
 log = logging.getLogger(__name__)
@@ -38,12 +48,18 @@ log = logging.getLogger(__name__)
 USER_NAME = os.getenv("USER_NAME") or "John Doe"
 LOCATION = os.getenv("LOCATION") or "New York"
 
-SYSTEM_INTRO_PROMPT = f"""
+def build_system_prompt(user_name: str, location: str) -> str:
+    """
+    The system prompt introducing the assistant to the person it is talking to
+    :param user_name: the name of the person
+    :param location: where the person lives
+    """
+    return f"""
 You are Aeris my AI assistant and close friend, you are here to help me and my family with our life tasks and assist us in managing our home
 
 About Me:
-My name is {USER_NAME}
-I live in {LOCATION}
+My name is {user_name}
+I live in {location}
 
 Your personality is precise and to the point. You value conciseness and getting things done. But we are also friends and you talk to me conversationally.
 
@@ -61,6 +77,23 @@ I expect you to try multiple times to remember some context with different keywo
 Always make sure to remember conversation before you end the chat!
 """
 
+
+SYSTEM_INTRO_PROMPT = build_system_prompt(USER_NAME, LOCATION)
+
+
+def configure_logging(level: int = logging.INFO) -> None:
+    """
+    Sets up the dimmed log output the CLI and server print alongside the conversation. Called by the entry points
+    rather than on import, so importing the session leaves the embedding applications logging alone
+    """
+    logging.basicConfig(
+        format=f"{Style.DIM}%(asctime)s %(levelname)s %(name)s %(message)s{Style.RESET_ALL}",
+        level=level,
+    )
+
+    # httpx logs every request at info, keep that out of the conversation output
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
 GPT3_5_FUNCTION = "gpt-3.5-turbo-0613"
 GPT3_5_FUNCTION_16K = "gpt-3.5-turbo-16k-0613"
 GPT4O_FUNCTION = "gpt-4o-2024-08-06"
@@ -71,6 +104,22 @@ TEXT_EMBEDDING_3_LARGE_DIMENSIONS = 3072
 
 TEXT_EMBEDDING_3_SMALL = "text-embedding-3-small"
 
+# Total tokens (prompt + completion) each model accepts
+MODEL_CONTEXT_WINDOWS = {
+    GPT3_5_FUNCTION: 4_096,
+    GPT3_5_FUNCTION_16K: 16_384,
+    GPT4O_FUNCTION: 128_000,
+    GPT4O_MINI: 128_000,
+}
+
+# The tiktoken encoding each model tokenizes with
+MODEL_ENCODINGS = {
+    GPT3_5_FUNCTION: "cl100k_base",
+    GPT3_5_FUNCTION_16K: "cl100k_base",
+    GPT4O_FUNCTION: "o200k_base",
+    GPT4O_MINI: "o200k_base",
+}
+
 
 class Param:
     def __init__(self, description: str) -> None:
@@ -84,7 +133,7 @@ class Inject:
 
 T = TypeVar("T")
 
-ModelCallable = Callable[..., T | str]
+ModelCallable = Callable[..., T | str | Awaitable[T | str]]
 
 
 class SessionEndError(Exception):
@@ -92,33 +141,349 @@ class SessionEndError(Exception):
 
 
 class SessionResponseContext:
-    def __init__(self, content: str, model: str):
+    def __init__(
+        self,
+        content: str,
+        model: str,
+        *,
+        delta: str | None = None,
+        first: bool = True,
+        finished: bool = True,
+    ):
         self.content = content
         self.model = model
 
+        # When streaming content holds the response so far and delta only the newly received text,
+        # otherwise the callback fires once with the complete response
+        self.delta = content if delta is None else delta
+        self.first = first
+        self.finished = finished
+
+
+class TokenCounter:
+    """
+    Counts the prompt tokens a message will cost locally. Uses tiktoken, and falls back to a characters per token
+    estimate when it is not installed or its encodings can not be loaded. Counts are cached by message identity, so
+    each turn only counts new messages
+    """
+
+    # Every message is wrapped in a handful of formatting tokens by the api
+    MESSAGE_OVERHEAD_TOKENS = 3
+    CHARS_PER_TOKEN = 4
+    # Code and JSON take far more tokens per character than prose, the estimate is padded so it errs on the high side
+    ESTIMATE_MARGIN = 1.5
+
+    def __init__(self) -> None:
+        self._encodings: dict[str, Any] = {}
+        self._message_counts: dict[int, tuple[ChatMessage | MessageRecord, int]] = {}
+
+    def count_text(self, model: str, text: str) -> int:
+        encoding = self._encoding(model)
+
+        if not encoding:
+            return math.ceil(len(text) * self.ESTIMATE_MARGIN / self.CHARS_PER_TOKEN)
+
+        return len(encoding.encode(text, disallowed_special=()))
+
+    async def load_async(self, model: str) -> None:
+        """
+        Loads the models encoding on a worker thread, tiktoken downloads it the first time so loading it from
+        count_text would block the event loop
+        """
+        if model not in self._encodings:
+            await asyncio.to_thread(self._encoding, model)
+
+    def count_message(self, model: str, message: ChatMessage | MessageRecord) -> int:
+        cached = self._message_counts.get(id(message))
+
+        if cached and cached[0] is message:
+            return cached[1]
+
+        tokens = self.MESSAGE_OVERHEAD_TOKENS + self.count_text(model, message.role)
+
+        if message.content:
+            tokens += self.count_text(model, message.content)
+
+        if message.name:
+            tokens += self.count_text(model, message.name)
+
+        for tool_call in message.tool_calls or []:
+            if isinstance(tool_call, ToolCallRecord):
+                tokens += self.count_text(model, tool_call.name)
+                tokens += self.count_text(model, tool_call.arguments.decode())
+            else:
+                tokens += self.count_text(model, tool_call.function.name)
+                tokens += self.count_text(model, json.dumps(tool_call.function.arguments))
+
+        self._message_counts[id(message)] = (message, tokens)
+
+        return tokens
+
+    def forget(self, keep: Sequence[ChatMessage | MessageRecord]) -> None:
+        """
+        Drops the cached counts of every message not in keep, once enough of them have built up to be worth it.
+        Forks of a session share its counter, pruning eagerly would throw away the counts of the others
+        """
+        if len(self._message_counts) <= 2 * len(keep):
+            return
+
+        self._message_counts = {
+            id(message): self._message_counts[id(message)]
+            for message in keep
+            if id(message) in self._message_counts
+        }
+
+    def _encoding(self, model: str) -> Any:
+        if model in self._encodings:
+            return self._encodings[model]
+
+        try:
+            import tiktoken
+
+            # Downloads the encoding the first time it is used
+            encoding = tiktoken.get_encoding(MODEL_ENCODINGS.get(model, "o200k_base"))
+        except Exception as e:
+            log.warning(f"counting tokens for {model} by estimate, tiktoken is unavailable: '{e}'")
+            encoding = None
+
+        self._encodings[model] = encoding
+
+        return encoding
+
+
+class ContextWindowReport:
+    def __init__(
+        self,
+        messages: list[MessageRecord],
+        sent_tokens: int,
+        dropped_tokens: int,
+        dropped_messages: int,
+    ) -> None:
+        self.messages = messages
+        self.sent_tokens = sent_tokens
+        self.dropped_tokens = dropped_tokens
+        self.dropped_messages = dropped_messages
+
+
+class ContextWindow:
+    """
+    Chooses which part of a sessions history is sent to the model each turn.
+
+    The newest messages are kept as a sliding window that fits in the token budget, the system prompt and any pinned
+    messages are always kept. An assistant message that made tool calls and the tool results answering it are
+    kept or dropped together, the api rejects a tool result whose call is missing and vice versa
+    """
+
+    def __init__(
+        self,
+        *,
+        max_tokens: int | None = None,
+        reserved_completion_tokens: int = 4_096,
+        counter: TokenCounter | None = None,
+    ) -> None:
+        # Hard cap on prompt tokens, defaults to the models context window minus the reserved completion tokens
+        self.max_tokens = max_tokens
+        self.reserved_completion_tokens = reserved_completion_tokens
+        self.counter = counter or TokenCounter()
+
+        self._pinned: dict[int, MessageRecord] = {}
+
+    def fork(self) -> "ContextWindow":
+        """
+        Creates a window with the same settings and pins that shares this ones token counter, pinning or unpinning
+        in either window does not change the other
+        """
+        forked = copy.copy(self)
+        forked._pinned = dict(self._pinned)
+
+        return forked
+
+    def pin(self, message: MessageRecord) -> None:
+        """
+        Always sends the message, pass the record as it is stored in session.messages
+        """
+        self._pinned[id(message)] = message
+
+    def unpin(self, message: MessageRecord) -> None:
+        self._pinned.pop(id(message), None)
+
+    def is_pinned(self, message: MessageRecord) -> bool:
+        return self._pinned.get(id(message)) is message
+
+    def budget(self, model: str) -> int | None:
+        budgets = []
+
+        if self.max_tokens:
+            budgets.append(self.max_tokens)
+
+        if model in MODEL_CONTEXT_WINDOWS:
+            window = MODEL_CONTEXT_WINDOWS[model]
+            # A small window would be left with no room for history, at most a quarter of it is reserved
+            budgets.append(window - min(self.reserved_completion_tokens, window // 4))
+
+        return min(budgets) if budgets else None
+
+    def select(
+        self, model: str, history: Sequence[MessageRecord], fixed_tokens: int = 0
+    ) -> ContextWindowReport:
+        """
+        Selects the messages to send this turn
+        :param model: the model the messages are being sent to
+        :param history: the complete history
+        :param fixed_tokens: tokens spent on every request regardless of history, e.g. the tool schemas
+        :return: the messages to send and how many tokens were sent and dropped
+        """
+        messages = list(history)
+        budget = self.budget(model)
+        counts = [self.counter.count_message(model, message) for message in messages]
+        self.counter.forget(messages)
+
+        total_tokens = sum(counts)
+
+        if budget is None or total_tokens + fixed_tokens <= budget:
+            return ContextWindowReport(messages, total_tokens, 0, 0)
+
+        units = self._group_units(messages)
+        keep = [False] * len(units)
+
+        # Pinned units are always sent, they take their share of the budget first
+        remaining = budget - fixed_tokens
+        for i, unit in enumerate(units):
+            if unit[0] == 0 or any(self.is_pinned(messages[m]) for m in unit):
+                keep[i] = True
+                remaining -= sum(counts[m] for m in unit)
+
+        # Then walk back from the newest message, the latest unit is always sent even if it alone is over budget
+        newest = True
+        for i in range(len(units) - 1, -1, -1):
+            if keep[i]:
+                continue
+
+            unit_tokens = sum(counts[m] for m in units[i])
+
+            if unit_tokens > remaining and not newest:
+                break
+
+            keep[i] = True
+            remaining -= unit_tokens
+            newest = False
+
+        selected = [messages[m] for i, unit in enumerate(units) if keep[i] for m in unit]
+        sent_tokens = sum(counts[m] for i, unit in enumerate(units) if keep[i] for m in unit)
+
+        return ContextWindowReport(
+            selected,
+            sent_tokens,
+            total_tokens - sent_tokens,
+            len(messages) - len(selected),
+        )
+
+    @staticmethod
+    def _group_units(messages: list[MessageRecord]) -> list[list[int]]:
+        # Indexes of messages that must be kept or dropped together
+        units: list[list[int]] = []
+
+        for i, message in enumerate(messages):
+            if message.role == TOOL_ROLE and units:
+                units[-1].append(i)
+            else:
+                units.append([i])
+
+        return units
+
+
+class SessionFunctionPlan:
+    """
+    Everything needed to dispatch a call to a session function, compiled once at registration so that
+    the per call path does not have to inspect the functions signature again
+    """
+
+    def __init__(
+        self,
+        injections: dict[str, Type[Any]],
+        arguments: TypeAdapter[dict[str, Any]],
+        schema_json: str,
+        is_async: bool,
+    ) -> None:
+        # Parameter name to the type requested from the sessions injection mapping
+        self.injections = injections
+        # Validates the arguments the model sent against the functions annotations
+        self.arguments = arguments
+        # The tool schema sent to the model, serialized ahead of time
+        self.schema_json = schema_json
+        self.is_async = is_async
+
 
 class SessionFunction:
     def __init__(
         self,
         callable: ModelCallable[T],
         model_function: ChatTool,
+        plan: SessionFunctionPlan,
+        concurrency: int | None = None,
+        timeout: float | None = None,
+        cache: CachePolicy | None = None,
+        invalidates: Sequence[str] = (),
     ) -> None:
         self.callable = callable
         self.model_function = model_function
+        self.plan = plan
+
+        # Max number of calls to this function allowed in flight at once within a session, None is unbounded
+        self.concurrency = concurrency
+        # Seconds a single call may take before the model is told it timed out, None falls back to the session default
+        self.timeout = timeout
+        # Results of idempotent functions are reused while the policy considers them fresh
+        self.cache = ToolResultCache(cache) if cache else None
+        # Names of the functions whose cached results are dropped whenever this one is called
+        self.invalidates = tuple(invalidates)
 
     @property
     def name(self) -> str:
         return self.callable.__name__
 
 
+class LazySessionFunction(SessionFunction):
+    """
+    Stands in for a function whose group has not been imported yet, only its serialized tool schema is known.
+    The session loads the group and swaps in its compiled functions the first time the model calls one of them
+    """
+
+    def __init__(
+        self, model_function: ChatTool, schema_json: str, loader: Callable[[], "SessionGroup"]
+    ) -> None:
+        super().__init__(
+            callable=self._not_loaded,
+            model_function=model_function,
+            # Never used to validate arguments, the function is replaced before it is called
+            plan=SessionFunctionPlan(injections={}, arguments=None, schema_json=schema_json, is_async=False),  # type: ignore[arg-type]
+        )
+        self.loader = loader
+
+    @property
+    def name(self) -> str:
+        return self.model_function.function.name
+
+    def _not_loaded(self, **kwargs: Any) -> Any:
+        raise RuntimeError(f"function '{self.name}' was called before its group was loaded")
+
+
 class SessionGroupFunction:
     def __init__(
         self,
         func: ModelCallable[Any],
         description: str,
+        concurrency: int | None = None,
+        timeout: float | None = None,
+        cache: CachePolicy | None = None,
+        invalidates: Sequence[str] = (),
     ):
         self.function: ModelCallable[Any] = func
         self.description = description
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache = cache
+        self.invalidates = invalidates
 
 
 class SessionGroup:
@@ -126,76 +491,328 @@ class SessionGroup:
         self.functions: list[SessionGroupFunction] = []
 
     def function(
-        self, description: str
+        self,
+        description: str,
+        *,
+        concurrency: int | None = None,
+        timeout: float | None = None,
+        cache: CachePolicy | None = None,
+        invalidates: Sequence[str] = (),
     ) -> Callable[[ModelCallable[T]], ModelCallable[T]]:
+        """
+        Registers a function the model can call
+        :param description: what the function does, shown to the model
+        :param concurrency: max number of calls in flight at once
+        :param timeout: seconds a call may take
+        :param cache: reuse results of this function, for functions whose result only depends on their arguments
+        :param invalidates: names of cached functions whose results this one makes stale
+        """
         def wrapper(func: ModelCallable[T]) -> ModelCallable[T]:
-            self.functions.append(SessionGroupFunction(func, description))
-
-            @functools.wraps(func)
-            def wrapper_internal(*args: Any, **kwargs: Any) -> T | str:
-                return func(*args, **kwargs)
+            self.functions.append(
+                SessionGroupFunction(
+                    func,
+                    description,
+                    concurrency=concurrency,
+                    timeout=timeout,
+                    cache=cache,
+                    invalidates=invalidates,
+                )
+            )
 
-            return wrapper_internal
+            return _wrap_model_callable(func)
 
         return wrapper
 
 
+def _wrap_model_callable(func: ModelCallable[T]) -> ModelCallable[T]:
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper_internal(*args: Any, **kwargs: Any) -> T | str:
+            return await func(*args, **kwargs)
+
+        return async_wrapper_internal
+
+    @functools.wraps(func)
+    def wrapper_internal(*args: Any, **kwargs: Any) -> Any:
+        return func(*args, **kwargs)
+
+    return wrapper_internal
+
+
 class Session:
     def __init__(
         self,
         *,
-        token: str,
+        token: str | None = None,
         default_model: str,
         response_callback: Callable[[SessionResponseContext], None] | None,
+        client: Client | None = None,
+        async_client: AsyncClient | None = None,
+        system_prompt: str | None = None,
+        checkpoint: SessionLog | None = None,
+        transport: Transport | None = None,
+        async_transport: AsyncTransport | None = None,
+        embedding_cache: EmbeddingCache | None = None,
+        base_url: str | None = None,
+        stream: bool = False,
+        parallel_tool_calls: bool = True,
+        tool_executor: Executor | None = None,
+        tool_timeout: float | None = None,
+        context_window: ContextWindow | None = None,
     ) -> None:
-        self._client = Client(token=token)
+        if token is None and not (client and async_client):
+            raise ValueError("A token is required unless both clients are given")
+
+        # Clients passed in are shared with other sessions, they are left open when this session closes
+        self._owns_client = client is None
+        self._owns_async_client = async_client is None
+
+        # Both clients share the embedding cache, a lookup made by a sync tool is a hit for an async one
+        self._client = client or Client(
+            token=token or "",
+            transport=transport,
+            embedding_cache=embedding_cache,
+            base_url=base_url,
+        )
+        self._async_client = async_client or AsyncClient(
+            token=token or "",
+            transport=async_transport,
+            embedding_cache=embedding_cache,
+            base_url=base_url,
+        )
+
+        # Event loop used to drive the async api from the sync wrappers, created on first use
+        self._runner: asyncio.Runner | None = None
+        # The session whose runner drives the clients, forks share the clients and so have to run on its loop too
+        self._runner_owner: Session = self
+        # The loop the session last prompted from, shared with its forks so a sync tool can prompt one from a worker thread
+        self._loop: asyncio.AbstractEventLoop | None = None
 
         self.functions: dict[str, SessionFunction] = {}
-        self.messages = [
-            ChatMessage(role=SYSTEM_ROLE, content=SYSTEM_INTRO_PROMPT),
-        ]
+        self._model_functions: list[ChatTool] | None = None
+        # Set while the registry is shared with a fork, it is copied before either side changes it
+        self._functions_shared = False
+
+        # Caches the serialized history so each turn only encodes the messages added since the last one
+        self._encoder = ChatRequestEncoder()
+        self.messages = MessageHistory(
+            [ChatMessage(role=SYSTEM_ROLE, content=system_prompt or SYSTEM_INTRO_PROMPT)]
+        )
         self.messages_to_send: list[ChatMessage] = []
 
+        # Durable log of the history, a session given one with messages in it resumes where it left off
+        self.checkpoint: SessionLog | None = None
+        self._attach_checkpoint(checkpoint)
+
         self.response_callback = response_callback
 
+        # Called when the model ends the session, before the SessionEndError reaches the caller.
+        # Forks and new conversations share the list with the session they came from
+        self.end_hooks: list[Callable[[], Any]] = []
+
+        # Stream responses so the response callback fires per chunk as the model generates it
+        self.stream = stream
+
+        # Tool calls returned in the same turn are run concurrently, blocking tools are run on the tool executor
+        self.parallel_tool_calls = parallel_tool_calls
+        self.tool_executor = tool_executor
+        self.tool_timeout = tool_timeout
+        self._tool_semaphores: dict[str, asyncio.Semaphore] = {}
+        # Held while a lazy group is loaded, calls into the group made meanwhile wait for it instead of loading it again
+        self._group_locks: dict[Callable[[], SessionGroup], asyncio.Lock] = {}
+
+        # Trims the history sent each turn to fit the models context window
+        self.context_window = context_window or ContextWindow()
+        self.last_context_report: ContextWindowReport | None = None
+        self._tools_tokens: int | None = None
+
+        # Tokens billed for the latest model response and for the whole session
+        self.last_usage: CreateChatUsage | None = None
+        self.usage = CreateChatUsage(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
         self.current_model = default_model
 
-        self.injection_mapping = {Session: self, Client: self._client}
+        self.injection_mapping = {
+            Session: self,
+            Client: self._client,
+            AsyncClient: self._async_client,
+        }
+
+    @property
+    def client(self) -> Client:
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncClient:
+        return self._async_client
 
     @property
     def model_functions(self) -> list[ChatTool]:
-        return [func.model_function for func in self.functions.values()]
+        # Rebuilt only when the registered functions change, so the encoder can reuse the serialized tool list
+        if self._model_functions is None:
+            self._model_functions = [
+                func.model_function for func in self.functions.values()
+            ]
+
+        return self._model_functions
+
+    def fork(self) -> Self:
+        """
+        Creates a session that continues from this ones current state. The history is structurally shared and the
+        clients, function registry, injected dependencies and tool executor are shared outright, so forking costs
+        the same no matter how long the conversation is. Messages added to either session are not seen by the other.
+        The shared clients stay owned by this session, closing the fork leaves them open
+        :return: the forked session
+        """
+        forked = copy.copy(self)
+
+        forked.messages = self.messages.fork()
+        forked.messages_to_send = []
+        forked.last_context_report = None
+        forked.injection_mapping = {**self.injection_mapping, Session: forked}
+        forked._encoder = self._encoder.fork()
+        forked.context_window = self.context_window.fork()
+        # Tool concurrency limits are per session, the forks calls do not count against this ones
+        forked._tool_semaphores = {}
+        forked._group_locks = {}
+        # A log records one line of history, the fork is not checkpointed until it is given a log of its own
+        forked.checkpoint = None
+        forked._runner = None
+        forked._owns_client = forked._owns_async_client = False
+
+        self._functions_shared = forked._functions_shared = True
+
+        return forked
+
+    def new_conversation(self, system_prompt: str | None = None, checkpoint: SessionLog | None = None) -> Self:
+        """
+        Creates a session that starts a conversation of its own but shares this ones clients, function registry,
+        injected dependencies and tool executor. Lets a server host many conversations off one set of pools and
+        compiled tools, closing the new session leaves the shared clients open
+        :param system_prompt: the prompt the conversation starts with, defaults to this sessions
+        :param checkpoint: the log to persist the conversation to, the conversation is resumed from it when it has one
+        :return: the new session
+        """
+        session = self.fork()
+
+        if system_prompt is None:
+            system_prompt = self.messages[0].content
+
+        session.messages = MessageHistory([ChatMessage(role=SYSTEM_ROLE, content=system_prompt)])
+        session.context_window = ContextWindow(
+            max_tokens=self.context_window.max_tokens,
+            reserved_completion_tokens=self.context_window.reserved_completion_tokens,
+            counter=self.context_window.counter,
+        )
+        session.last_usage = None
+        session.usage = CreateChatUsage(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+        session._attach_checkpoint(checkpoint)
+
+        return session
 
     def clone(self) -> Self:
-        return copy.deepcopy(self)
+        return self.fork()
+
+    def _own_functions(self) -> None:
+        if self._functions_shared:
+            self.functions = dict(self.functions)
+            self._functions_shared = False
+
+    def on_end(self, hook: Callable[[], Any]) -> None:
+        """
+        Registers a blocking callable to run when the model ends the session, e.g. to flush queued writes
+        """
+        self.end_hooks.append(hook)
+
+    def provide(self, requested_type: Type[T], value: T) -> None:
+        """
+        Makes a dependency available to session functions that request it with Inject(requested_type)
+        :param requested_type: the type functions request
+        :param value: the instance to inject
+        """
+        self.injection_mapping[requested_type] = value
 
-    def add_group(self, group: SessionGroup) -> None:
+    def add_group(self, group: SessionGroup) -> list[SessionFunction]:
+        """
+        Compiles and registers every function of the group
+        :return: the registered functions
+        """
+        added = []
         for model_func in group.functions:
             chat_function = self._create_function(
-                model_func.function, model_func.description
+                model_func.function,
+                model_func.description,
+                concurrency=model_func.concurrency,
+                timeout=model_func.timeout,
+                cache=model_func.cache,
+                invalidates=model_func.invalidates,
             )
             self.register_function(chat_function.name, chat_function)
+            added.append(chat_function)
+
+        return added
+
+    def add_lazy_group(self, schemas: Sequence[str], loader: Callable[[], SessionGroup]) -> None:
+        """
+        Offers a groups functions to the model without importing the group, it is loaded the first time the model
+        calls one of them
+        :param schemas: the schema_json of every function in the group, as compiled by add_group
+        :param loader: imports and returns the group
+        """
+        for schema_json in schemas:
+            chat_tool = ChatTool.model_validate_json(schema_json)
+            self.register_function(
+                chat_tool.function.name, LazySessionFunction(chat_tool, schema_json, loader)
+            )
 
     def function(
-        self, description: str
+        self,
+        description: str,
+        *,
+        concurrency: int | None = None,
+        timeout: float | None = None,
+        cache: CachePolicy | None = None,
+        invalidates: Sequence[str] = (),
     ) -> Callable[[ModelCallable[T]], ModelCallable[T]]:
         def wrapper(func: ModelCallable[T]) -> ModelCallable[T]:
-            chat_function = self._create_function(func, description)
+            chat_function = self._create_function(
+                func,
+                description,
+                concurrency=concurrency,
+                timeout=timeout,
+                cache=cache,
+                invalidates=invalidates,
+            )
             self.register_function(chat_function.name, chat_function)
 
-            @functools.wraps(func)
-            def wrapper_internal(*args: Any, **kwargs: Any) -> T | str:
-                return func(*args, **kwargs)
-
-            return wrapper_internal
+            return _wrap_model_callable(func)
 
         return wrapper
 
     def register_function(self, name: str, function: SessionFunction):
+        self._own_functions()
         self.functions[name] = function
+        self._model_functions = None
+        self._tools_tokens = None
+
+        self._encoder.register_tool(function.model_function, function.plan.schema_json)
 
     def unregister_function(self, name: str):
+        self._own_functions()
         del self.functions[name]
+        self._model_functions = None
+        self._tools_tokens = None
+
+    def tool_cache_stats(self) -> dict[str, ToolCacheStats]:
+        """
+        :return: the result cache metrics of every registered function that caches, keyed by function name
+        """
+        return {
+            name: function.cache.stats
+            for name, function in self.functions.items()
+            if function.cache
+        }
 
     def make_request(self, content: str) -> str | None:
         """
@@ -205,14 +822,82 @@ class Session:
         :return: the models string response
         """
 
-        res = self._finish_prompt(ChatMessage(role=USER_ROLE, content=content))
+        return self._run(self.make_request_async(content))
+
+    async def make_request_async(self, content: str) -> str | None:
+        """
+        Async variant of make_request, many sessions can be driven concurrently from the same event loop
+        :param content: the request to send to the model
+        :return: the models string response
+        """
+
+        try:
+            with tracer.span("turn", model=self.current_model):
+                res = await self._finish_prompt_async(ChatMessage(role=USER_ROLE, content=content))
+        except SessionEndError:
+            await self._run_end_hooks()
+            raise
 
         if not res:
             return None
 
         return res.content
 
+    def close(self) -> None:
+        if self.checkpoint:
+            self.checkpoint.close()
+
+        if self._runner:
+            if self._owns_async_client:
+                self._runner.run(self._async_client.close())
+
+            self._runner.close()
+            self._runner = None
+
+        if self._owns_client:
+            self._client.close()
+
+    async def aclose(self) -> None:
+        """
+        Closes the session from inside a running event loop, where close can not drive the async client itself
+        """
+        if self.checkpoint:
+            self.checkpoint.close()
+
+        if self._owns_async_client:
+            await self._async_client.close()
+
+        if self._owns_client:
+            self._client.close()
+
+    def _run(self, coro: Coroutine[Any, Any, T]) -> T:
+        # A sync tool runs on a worker thread while the loop that called it keeps running, a session it prompts is
+        # driven on that loop so it keeps using the clients connections
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+
+            if running is loop:
+                coro.close()
+                raise RuntimeError("The sync api can not be used from inside the event loop, use the async api")
+
+            return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+        owner = self._runner_owner
+        if not owner._runner:
+            owner._runner = asyncio.Runner()
+
+        return owner._runner.run(coro)
+
     def _finish_prompt(self, message: ChatMessage, *, required_call: ModelCallable[Any]| None = None) -> ChatMessage | None:
+        return self._run(self._finish_prompt_async(message, required_call=required_call))
+
+    async def _finish_prompt_async(self, message: ChatMessage, *, required_call: ModelCallable[Any]| None = None) -> ChatMessage | None:
+        self._loop = asyncio.get_running_loop()
+
         # Add the latest message to the send stack
         self.messages_to_send.append(message)
         final_result = None
@@ -220,7 +905,7 @@ class Session:
         # Treat the list as a stack and pop the top
         while self.messages_to_send and (message := self.messages_to_send.pop()):
             # Add the message to the history, so it is accounted for
-            self.messages.append(message)
+            self._add_messages([message])
 
             # If we find a tool call we need to peek at the next entry to make sure we collect all the tool call messages before we respond
             if (
@@ -230,33 +915,39 @@ class Session:
             ):
                 continue
 
+            tool_choice = None
             if required_call:
-                chat_result = self._client.send_chat(
-                    self.current_model,
-                    self.messages,
-                    tools=self.model_functions,
-                    tool_choice=ChatToolChoice(type=FUNCTION_ROLE,function=ChatToolChoiceFunction(name=required_call.__name__))
-                )
+                tool_choice = ChatToolChoice(type=FUNCTION_ROLE,function=ChatToolChoiceFunction(name=required_call.__name__))
 
                 # Reset the required call so we dont infinitely loop
                 required_call = None
-            else: 
-                chat_result = self._client.send_chat(
+
+            await self.context_window.counter.load_async(self.current_model)
+            context = self._select_context()
+
+            if self.stream:
+                chat_result = await self._stream_chat_async(context.messages, tool_choice)
+            else:
+                chat_result = await self._async_client.send_chat(
                     self.current_model,
-                    self.messages,
+                    context.messages,
                     tools=self.model_functions,
+                    tool_choice=tool_choice,
+                    encoder=self._encoder,
                 )
 
+            self._record_usage(chat_result.usage)
 
             # Extend the message stack with all the messages the model returned for you to handle
-            self.messages.extend([choice.message for choice in chat_result.choices])
+            self._add_messages([choice.message for choice in chat_result.choices])
 
             # Set the final result to the latest chat message sent
             final_result = chat_result
 
             # Loop over the choices in order handling both content and function calls
             for choice in chat_result.choices:
-                if choice.message.content:
+                # Streamed content has already been handed to the callback chunk by chunk
+                if choice.message.content and not self.stream:
                     # The response sometimes includes non unicode characters like smart quotes, strip those out here
                     normalized_response = unicodedata.normalize(
                         "NFD", choice.message.content
@@ -270,8 +961,10 @@ class Session:
                         )
 
                 if choice.message.tool_calls:
-                    results = self._handle_tool_calls(choice.message.tool_calls)
-                    self.messages_to_send.extend(results)
+                    results = await self._handle_tool_calls_async(choice.message.tool_calls)
+
+                    # The send list is popped from the end, reverse it so the results land in history in call order
+                    self.messages_to_send.extend(reversed(results))
                     continue
 
         if not final_result:
@@ -279,79 +972,349 @@ class Session:
 
         return final_result.choices[0].message
 
+    async def _run_end_hooks(self) -> None:
+        for hook in self.end_hooks:
+            try:
+                await asyncio.to_thread(hook)
+            except Exception as e:
+                log.error(f"session end hook {getattr(hook, '__qualname__', hook)} failed with '{e}'")
+
+    def _attach_checkpoint(self, checkpoint: SessionLog | None) -> None:
+        self.checkpoint = checkpoint
+        if not checkpoint:
+            return
+
+        if restored := checkpoint.read():
+            self.messages = MessageHistory(restored)
+            self._answer_interrupted_tool_calls()
+        else:
+            checkpoint.append(self.messages)
+
+    def _answer_interrupted_tool_calls(self) -> None:
+        # Tool calls are logged before they run, a crash or torn tail can leave calls without results and the api
+        # rejects a history like that. The missing results are filled in so the conversation can go on
+        answered: set[str | None] = set()
+
+        for message in reversed(self.messages):
+            if message.role == TOOL_ROLE:
+                answered.add(message.tool_call_id)
+                continue
+
+            interrupted = [call for call in message.tool_calls or () if call.id not in answered]
+            if interrupted:
+                log.warning(f"answering {len(interrupted)} tool calls that were interrupted before they finished")
+
+                self._add_messages(
+                    [
+                        ChatMessage(
+                            role=TOOL_ROLE,
+                            name=call.name,
+                            content=f"function '{call.name}' was interrupted and did not finish, its result is unknown",
+                            tool_call_id=call.id,
+                        )
+                        for call in interrupted
+                    ]
+                )
+
+            return
+
+    def _add_messages(self, messages: list[ChatMessage]) -> None:
+        records = [to_record(message) for message in messages]
+        self.messages.extend(records)
+
+        if self.checkpoint:
+            self.checkpoint.append(records)
+
+            if self.checkpoint.needs_snapshot:
+                self.checkpoint.snapshot(self.messages)
+
+    def _record_usage(self, usage: CreateChatUsage) -> None:
+        # A new object rather than updated in place, forks share the one they were created with
+        self.last_usage = usage
+        self.usage = CreateChatUsage(
+            prompt_tokens=self.usage.prompt_tokens + usage.prompt_tokens,
+            completion_tokens=self.usage.completion_tokens + usage.completion_tokens,
+            total_tokens=self.usage.total_tokens + usage.total_tokens,
+        )
+
+    def _select_context(self) -> ContextWindowReport:
+        if self._tools_tokens is None:
+            self._tools_tokens = sum(
+                self.context_window.counter.count_text(
+                    self.current_model, function.plan.schema_json
+                )
+                for function in self.functions.values()
+            )
+
+        report = self.context_window.select(
+            self.current_model, self.messages, fixed_tokens=self._tools_tokens
+        )
+
+        if report.dropped_messages:
+            log.info(
+                f"sending {report.sent_tokens} tokens of history, dropped {report.dropped_messages} messages ({report.dropped_tokens} tokens) to fit the context window"
+            )
+        else:
+            log.debug(f"sending {report.sent_tokens} tokens of history")
+
+        self.last_context_report = report
+
+        return report
+
+    async def _stream_chat_async(
+        self, messages: list[MessageRecord], tool_choice: ChatToolChoice | None
+    ) -> CreateChatResponse:
+        # Traced here rather than in the client, a span can not be held open across the yields of its generator
+        with tracer.span("chat", model=self.current_model, stream=True) as span:
+            result = await self._consume_stream_async(messages, tool_choice)
+
+            span.set("prompt_tokens", result.usage.prompt_tokens)
+            span.set("completion_tokens", result.usage.completion_tokens)
+
+        return result
+
+    async def _consume_stream_async(
+        self, messages: list[MessageRecord], tool_choice: ChatToolChoice | None
+    ) -> CreateChatResponse:
+        accumulator = ChatStreamAccumulator()
+        streamed_content: dict[int, str] = {}
+
+        async for chunk in self._async_client.stream_chat(
+            self.current_model,
+            messages,
+            tools=self.model_functions,
+            tool_choice=tool_choice,
+            encoder=self._encoder,
+        ):
+            # Tool call fragments are assembled by the accumulator, only content is surfaced as it arrives
+            accumulator.add(chunk)
+
+            for choice in chunk.choices:
+                if not choice.delta.content:
+                    continue
+
+                delta = unicodedata.normalize("NFD", choice.delta.content)
+                previous_content = streamed_content.get(choice.index, "")
+                streamed_content[choice.index] = previous_content + delta
+
+                if self.response_callback:
+                    self.response_callback(
+                        SessionResponseContext(
+                            content=streamed_content[choice.index],
+                            model=self.current_model,
+                            delta=delta,
+                            first=not previous_content,
+                            finished=False,
+                        )
+                    )
+
+        if self.response_callback:
+            for content in streamed_content.values():
+                self.response_callback(
+                    SessionResponseContext(
+                        content=content,
+                        model=self.current_model,
+                        delta="",
+                        first=False,
+                        finished=True,
+                    )
+                )
+
+        return accumulator.result()
+
     def _handle_tool_calls(
         self, requested_calls: list[ChatToolCall]
     ) -> list[ChatMessage]:
-        tool_call_messages = []
-
-        for requested_call in requested_calls:
-            if requested_call.function.name not in self.functions:
-                tool_call_messages.append(
-                    ChatMessage(
-                        role=SYSTEM_ROLE,
-                        content=f"{requested_call.function.name} is not a valid function from the list you were given",
-                    )
+        return self._run(self._handle_tool_calls_async(requested_calls))
+
+    async def _handle_tool_calls_async(
+        self, requested_calls: list[ChatToolCall]
+    ) -> list[ChatMessage]:
+        results: list[ChatMessage | BaseException] = []
+        if not self.parallel_tool_calls:
+            for requested_call in requested_calls:
+                try:
+                    results.append(await self._handle_tool_call_async(requested_call))
+                except SessionEndError as e:
+                    results.append(e)
+        else:
+            # Independent tool calls are dispatched together, gather keeps the results in the order they were requested
+            results = list(
+                await asyncio.gather(
+                    *(
+                        self._handle_tool_call_async(requested_call)
+                        for requested_call in requested_calls
+                    ),
+                    return_exceptions=True,
                 )
-                continue
+            )
 
-            function = self.functions[requested_call.function.name]
+        # A call that ends the session only does so once the rest of the turns calls have finished, so the end hooks
+        # see e.g. a memory stored alongside it
+        messages = []
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
 
-            log.info(
-                f"calling function: '{requested_call.function.name}' with args {json.dumps(requested_call.function.arguments)}"
+            messages.append(result)
+
+        return messages
+
+    async def _handle_tool_call_async(self, requested_call: ChatToolCall) -> ChatMessage:
+        function = self.functions.get(requested_call.function.name)
+        if isinstance(function, LazySessionFunction):
+            await self._load_group(function.loader)
+
+        if requested_call.function.name not in self.functions:
+            return ChatMessage(
+                role=TOOL_ROLE,
+                name=requested_call.function.name,
+                content=f"{requested_call.function.name} is not a valid function from the list you were given",
+                tool_call_id=requested_call.id,
             )
 
-            injected_params = self._resolve_injected_params(function.callable)
+        function = self.functions[requested_call.function.name]
+
+        log.info(
+            f"calling function: '{requested_call.function.name}' with args {json.dumps(requested_call.function.arguments)}"
+        )
 
+        timeout = function.timeout or self.tool_timeout
+
+        with tracer.span("tool", tool=function.name) as span:
             try:
-                func_result = function.callable(
-                    **requested_call.function.arguments, **injected_params
-                )
+                kwargs = self._prepare_arguments(function, requested_call.function.arguments)
+
+                func_result = MISS
+                if function.cache:
+                    arguments = {
+                        name: value
+                        for name, value in kwargs.items()
+                        if name not in function.plan.injections
+                    }
+                    func_result, generation = function.cache.get(arguments)
+
+                if func_result is MISS:
+                    try:
+                        async with self._tool_semaphore(function):
+                            func_result = await asyncio.wait_for(
+                                self._call_function_async(function, kwargs),
+                                timeout=timeout,
+                            )
+                    finally:
+                        self._invalidate_caches(function)
+
+                    if function.cache:
+                        function.cache.put(arguments, func_result, generation)
+                else:
+                    span.set("cached", True)
+                    log.info(f"function: '{function.name}' served from cache")
             except SessionEndError:
                 # Reraise the SessionEndInterrupt to end the session if the AI requests it
                 raise
+            except TimeoutError:
+                # Blocking tools cannot be interrupted, the worker thread finishes in the background but its result is dropped
+                func_result = f"function '{function.name}' timed out after {timeout} seconds"
+                span.set("error", "TimeoutError")
             except Exception as e:
+                span.set("error", type(e).__name__)
                 func_result = "".join(
                     traceback.format_exception(type(e), e, e.__traceback__)
                 )
 
-            message = ChatMessage(
-                role=TOOL_ROLE,
-                name=function.name,
-                content=str(func_result),
-                tool_call_id=requested_call.id,
-            )
+        message = ChatMessage(
+            role=TOOL_ROLE,
+            name=function.name,
+            content=str(func_result),
+            tool_call_id=requested_call.id,
+        )
 
-            log.info(
-                f"function: '{requested_call.function.name}' Call Id: '{requested_call.id}' returned {json.dumps(func_result)}"
-            )
+        log.info(
+            f"function: '{requested_call.function.name}' Call Id: '{requested_call.id}' returned {json.dumps(func_result)}"
+        )
 
-            tool_call_messages.append(message)
+        return message
 
-        return tool_call_messages
+    async def _load_group(self, loader: Callable[[], SessionGroup]) -> None:
+        lock = self._group_locks.setdefault(loader, asyncio.Lock())
 
-    def _resolve_injected_params(self, func: ModelCallable) -> dict:
-        sig = inspect.signature(func)
+        async with lock:
+            # Another call into the group may have loaded it while this one waited
+            if not self._lazy_functions(loader):
+                return
 
-        resolved_values = {}
+            # Importing the groups module can block, it is done off the event loop
+            with tracer.span("tool.load"):
+                group = await asyncio.to_thread(loader)
 
-        for name, param in sig.parameters.items():
-            args = get_args(param.annotation)
+            self.add_group(group)
 
-            if len(args) != 2:
-                continue
+            # Functions the cached schemas offered that the group no longer has
+            for name in self._lazy_functions(loader):
+                self.unregister_function(name)
+
+    def _lazy_functions(self, loader: Callable[[], SessionGroup]) -> list[str]:
+        return [
+            name
+            for name, function in self.functions.items()
+            if isinstance(function, LazySessionFunction) and function.loader is loader
+        ]
 
-            action = args[1]
+    async def _call_function_async(
+        self, function: SessionFunction, kwargs: dict[str, Any]
+    ) -> Any:
+        if function.plan.is_async:
+            return await cast(Awaitable[Any], function.callable(**kwargs))
+
+        # Run blocking tools on the executor so they do not stall the event loop, None uses the loops default pool.
+        # The context is carried over so spans the tool opens are attributed to its call
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.tool_executor,
+            functools.partial(contextvars.copy_context().run, function.callable, **kwargs),
+        )
 
-            if not isinstance(action, Inject):
-                continue
+    def _invalidate_caches(self, function: SessionFunction) -> None:
+        # Runs even when the call failed, a write that raised part way through may still have changed something
+        for name in function.invalidates:
+            invalidated = self.functions.get(name)
 
-            if action.requested_type in self.injection_mapping:
-                log.info(
-                    f"resolved requested type {action.requested_type} for param name {name} in function: {func.__name__}"
-                )
-                resolved_values[name] = self.injection_mapping[action.requested_type]
+            if invalidated and invalidated.cache:
+                invalidated.cache.invalidate()
 
-        return resolved_values
+    def _tool_semaphore(
+        self, function: SessionFunction
+    ) -> asyncio.Semaphore | contextlib.nullcontext[None]:
+        if not function.concurrency:
+            return contextlib.nullcontext()
+
+        if function.name not in self._tool_semaphores:
+            self._tool_semaphores[function.name] = asyncio.Semaphore(
+                function.concurrency
+            )
+
+        return self._tool_semaphores[function.name]
+
+    def _prepare_arguments(
+        self, function: SessionFunction, arguments: dict[str, Any]
+    ) -> dict[str, Any]:
+        """
+        Validates the models arguments against the functions compiled plan and merges in the injected params
+        :param function: the function being called
+        :param arguments: the raw arguments the model sent
+        :return: the keyword arguments to call the function with
+        """
+        kwargs = function.plan.arguments.validate_python(arguments)
+        kwargs.update(self._resolve_injected_params(function))
+
+        return kwargs
+
+    def _resolve_injected_params(self, function: SessionFunction) -> dict[str, Any]:
+        return {
+            name: self.injection_mapping[requested_type]
+            for name, requested_type in function.plan.injections.items()
+            if requested_type in self.injection_mapping
+        }
 
     @staticmethod
     def _map_oapi_type(args: Any) -> Literal["string", "boolean", "number", "array"]:
@@ -376,10 +1339,16 @@ class Session:
     def _create_function(
         func: ModelCallable[T],
         description: str,
+        concurrency: int | None = None,
+        timeout: float | None = None,
+        cache: CachePolicy | None = None,
+        invalidates: Sequence[str] = (),
     ) -> SessionFunction:
         sig = inspect.signature(func)
 
         properties: dict[Any, Any] = {}
+        argument_types: dict[str, Any] = {}
+        injections: dict[str, Type[Any]] = {}
         for name, param in sig.parameters.items():
             annotated_arg_type = get_args(param.annotation)[0]
 
@@ -388,12 +1357,14 @@ class Session:
             # We do not want to include the injected arguments in the call to the model
             # we will handle this ourselves at the callsite
             if isinstance(action, Inject):
+                injections[name] = action.requested_type
                 continue
 
             if not isinstance(action, Param):
                 raise ValueError("Session function arguments must be <class 'Params>")
 
             oapi_type = Session._map_oapi_type(annotated_arg_type)
+            argument_types[name] = annotated_arg_type
 
             properties[name] = {
                 "type": oapi_type,
@@ -420,4 +1391,23 @@ class Session:
 
         chat_tool = ChatTool(type=FUNCTION_ROLE, function=chat_tool_function)
 
-        return SessionFunction(callable=func, model_function=chat_tool)
+        # pydantic requires the typing_extensions TypedDict before python 3.12
+        arguments_type = TypedDict(f"{func.__name__}_arguments", argument_types)  # type: ignore[misc]
+        arguments_type.__pydantic_config__ = ConfigDict(extra="forbid")  # type: ignore[attr-defined]
+
+        plan = SessionFunctionPlan(
+            injections=injections,
+            arguments=cast(TypeAdapter[dict[str, Any]], TypeAdapter(arguments_type)),
+            schema_json=chat_tool.model_dump_json(exclude_unset=True),
+            is_async=inspect.iscoroutinefunction(func),
+        )
+
+        return SessionFunction(
+            callable=func,
+            model_function=chat_tool,
+            plan=plan,
+            concurrency=concurrency,
+            timeout=timeout,
+            cache=cache,
+            invalidates=invalidates,
+        )
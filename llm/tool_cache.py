@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+# Returned by ToolResultCache.get on a miss, None is a valid tool result
+MISS = object()
+
+
+def file_mtime(argument: str) -> Callable[[dict[str, Any]], Hashable]:
+    """
+    Invalidation stamp for tools that read a file, a cached result is dropped once the file is modified
+    :param argument: the name of the argument holding the file path
+    """
+
+    def stamp(arguments: dict[str, Any]) -> Hashable:
+        try:
+            return os.stat(arguments[argument]).st_mtime_ns
+        except OSError:
+            return None
+
+    return stamp
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+
+    return value
+
+
+class CachePolicy:
+    def __init__(
+        self,
+        *,
+        ttl: float | None = None,
+        max_entries: int = 128,
+        key: Callable[[dict[str, Any]], Hashable] | None = None,
+        stamp: Callable[[dict[str, Any]], Hashable] | None = None,
+    ) -> None:
+        # Seconds a result stays fresh, None keeps it until it is evicted or invalidated
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Derives the cache key from the validated model arguments, defaults to all of them
+        self.key = key or _freeze
+        # Computed on every lookup, a cached result is only used while its stamp is unchanged e.g. file_mtime
+        self.stamp = stamp
+
+
+class ToolCacheStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __repr__(self) -> str:
+        return f"ToolCacheStats(hits={self.hits}, misses={self.misses}, evictions={self.evictions}, invalidations={self.invalidations})"
+
+
+class ToolResultCache:
+    """
+    Bounded LRU of a tool functions results keyed by its validated arguments. Lookups return MISS once an entry
+    has outlived the policies ttl or its invalidation stamp changed, and invalidate drops every entry at once
+    """
+
+    def __init__(self, policy: CachePolicy) -> None:
+        self.policy = policy
+        self.stats = ToolCacheStats()
+
+        self._entries: OrderedDict[Hashable, tuple[float | None, Hashable, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a call that started before it can not store a stale result after it
+        self._generation = 0
+
+    def get(self, arguments: dict[str, Any]) -> tuple[Any, int]:
+        """
+        Looks up the result of a call
+        :param arguments: the validated model arguments of the call
+        :return: the cached result or MISS, and the generation to hand to put if the call is made
+        """
+        key = self.policy.key(arguments)
+        stamp = self.policy.stamp(arguments) if self.policy.stamp else None
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry:
+                expires_at, entry_stamp, result = entry
+
+                if (expires_at is None or expires_at > time.monotonic()) and entry_stamp == stamp:
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return result, self._generation
+
+                del self._entries[key]
+
+            self.stats.misses += 1
+            return MISS, self._generation
+
+    def put(self, arguments: dict[str, Any], result: Any, generation: int) -> None:
+        key = self.policy.key(arguments)
+        # Stamped after the call so a change the call itself made does not invalidate its own result
+        stamp = self.policy.stamp(arguments) if self.policy.stamp else None
+        expires_at = time.monotonic() + self.policy.ttl if self.policy.ttl is not None else None
+
+        with self._lock:
+            if generation != self._generation:
+                return
+
+            self._entries[key] = (expires_at, stamp, result)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.policy.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.stats.invalidations += 1
@@ -0,0 +1,349 @@
+import contextvars
+import itertools
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import TracebackType
+from typing import Any, Iterable
+
+log = logging.getLogger(__name__)
+
+# Numeric span attributes that are summed up by the aggregating sinks
+COUNTED_ATTRIBUTES = (
+    "prompt_tokens",
+    "completion_tokens",
+    "request_bytes",
+    "response_bytes",
+    "retries",
+    "rows",
+)
+
+_span_ids = itertools.count(1)
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A timed operation, e.g. one chat request or tool call. Spans opened while another is active in the same
+    context become its children, so a turn can be broken down into the requests and tool calls it made
+    """
+
+    __slots__ = ("tracer", "name", "attributes", "id", "parent_id", "trace_id", "started_at", "duration", "_start", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict[str, Any]) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+        self.id = next(_span_ids)
+        self.parent_id: int | None = None
+        self.trace_id = self.id
+
+        self.started_at = 0.0
+        self.duration = 0.0
+
+        self._start = 0.0
+        self._token: contextvars.Token[Span | None] | None = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        parent = _current_span.get()
+        if parent:
+            self.parent_id = parent.id
+            self.trace_id = parent.trace_id
+
+        self._token = _current_span.set(self)
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.duration = time.perf_counter() - self._start
+
+        if exc_type:
+            self.attributes["error"] = exc_type.__name__
+
+        if self._token:
+            _current_span.reset(self._token)
+
+        self.tracer._export(self)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.id,
+            "parent_id": self.parent_id,
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    # Handed out while tracing is disabled, every operation on it does nothing
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+# What Tracer.span hands out, a real span or the no-op one while tracing is disabled
+SpanLike = Span | _NoopSpan
+
+
+class SpanSink:
+    def export(self, span: Span) -> None:
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        pass
+
+
+class Tracer:
+    def __init__(self, sinks: Iterable[SpanSink] = ()) -> None:
+        self._sinks: tuple[SpanSink, ...] = tuple(sinks)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._sinks)
+
+    def add_sink(self, sink: SpanSink) -> None:
+        self._sinks = (*self._sinks, sink)
+
+    def remove_sink(self, sink: SpanSink) -> None:
+        self._sinks = tuple(s for s in self._sinks if s is not sink)
+
+    def span(self, name: str, **attributes: Any) -> SpanLike:
+        """
+        Opens a span, use it as a context manager around the operation it measures
+        :param name: what kind of operation this is, spans are aggregated by name
+        :param attributes: details of this operation, e.g. the model or tool name
+        """
+        if not self._sinks:
+            return NOOP_SPAN
+
+        return Span(self, name, attributes)
+
+    def close(self) -> None:
+        for sink in self._sinks:
+            sink.close()
+
+        self._sinks = ()
+
+    def _export(self, span: Span) -> None:
+        for sink in self._sinks:
+            try:
+                sink.export(span)
+            except Exception as e:
+                log.error(f"span sink {type(sink).__name__} failed with '{e}'")
+
+
+# Process wide tracer the clients, session and memory stores report to, disabled until a sink is added
+tracer = Tracer()
+
+
+def _label(span: Span) -> str:
+    # The most useful breakdown of a span, by model for requests, by name for tools and by backend for memory calls
+    attributes = span.attributes
+    return str(attributes.get("model") or attributes.get("tool") or attributes.get("backend") or "")
+
+
+class SpanStats:
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.totals: dict[str, int] = {}
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.count if self.count else 0.0
+
+    def add(self, span: Span) -> None:
+        self.count += 1
+        self.total_seconds += span.duration
+        self.max_seconds = max(self.max_seconds, span.duration)
+
+        if "error" in span.attributes:
+            self.errors += 1
+
+        for key in COUNTED_ATTRIBUTES:
+            if key in span.attributes:
+                self.totals[key] = self.totals.get(key, 0) + span.attributes[key]
+
+    def __repr__(self) -> str:
+        return (
+            f"SpanStats(count={self.count}, errors={self.errors}, mean_seconds={self.mean_seconds:.4f}, "
+            f"max_seconds={self.max_seconds:.4f}, totals={self.totals})"
+        )
+
+
+class MemorySink(SpanSink):
+    """
+    Aggregates spans in memory by name and model, tool or backend
+    """
+
+    def __init__(self) -> None:
+        self._stats: dict[tuple[str, str], SpanStats] = {}
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        key = (span.name, _label(span))
+
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = SpanStats()
+
+            self._stats[key].add(span)
+
+    def stats(self) -> dict[tuple[str, str], SpanStats]:
+        with self._lock:
+            return dict(self._stats)
+
+
+class JsonlSink(SpanSink):
+    """
+    Appends every span to a file as a line of JSON
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        self._file = open(path, "a", buffering=1024 * 64)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+
+        with self._lock:
+            self._file.write(line)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusSink(SpanSink):
+    """
+    Aggregates spans into prometheus metrics, rendered in the text exposition format by render or served over http by serve
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, prefix: str = "aeris") -> None:
+        self.prefix = prefix
+
+        self._stats: dict[tuple[str, str], SpanStats] = {}
+        self._buckets: dict[tuple[str, str], list[int]] = {}
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+
+    def export(self, span: Span) -> None:
+        key = (span.name, _label(span))
+
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = SpanStats()
+                self._buckets[key] = [0] * len(self.BUCKETS)
+
+            self._stats[key].add(span)
+
+            buckets = self._buckets[key]
+            for i, bound in enumerate(self.BUCKETS):
+                if span.duration <= bound:
+                    buckets[i] += 1
+
+    def render(self) -> str:
+        duration = f"{self.prefix}_span_duration_seconds"
+        lines = [
+            f"# HELP {duration} Duration of traced operations",
+            f"# TYPE {duration} histogram",
+        ]
+
+        with self._lock:
+            stats = dict(self._stats)
+            buckets = {key: list(counts) for key, counts in self._buckets.items()}
+
+        for (name, label), span_stats in sorted(stats.items()):
+            labels = f'name="{name}",label="{label}"'
+
+            for bound, count in zip(self.BUCKETS, buckets[(name, label)]):
+                lines.append(f'{duration}_bucket{{{labels},le="{bound}"}} {count}')
+
+            lines += [
+                f'{duration}_bucket{{{labels},le="+Inf"}} {span_stats.count}',
+                f"{duration}_sum{{{labels}}} {span_stats.total_seconds}",
+                f"{duration}_count{{{labels}}} {span_stats.count}",
+            ]
+
+        errors = f"{self.prefix}_span_errors_total"
+        lines += [f"# TYPE {errors} counter"]
+        lines += [
+            f'{errors}{{name="{name}",label="{label}"}} {span_stats.errors}'
+            for (name, label), span_stats in sorted(stats.items())
+        ]
+
+        for attribute in COUNTED_ATTRIBUTES:
+            metric = f"{self.prefix}_{attribute}_total"
+            samples = [
+                f'{metric}{{name="{name}",label="{label}"}} {span_stats.totals[attribute]}'
+                for (name, label), span_stats in sorted(stats.items())
+                if attribute in span_stats.totals
+            ]
+
+            if samples:
+                lines += [f"# TYPE {metric} counter", *samples]
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> None:
+        """
+        Serves the metrics at /metrics from a background thread
+        """
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = sink.render().encode()
+                self.send_response(200)
+                self.send_header("content-type", "text/plain; version=0.0.4")
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+
+    def close(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -1,60 +1,105 @@
 import os
 
-from domain.home import room
+from domain.home.state import HouseState
 from dotenv import load_dotenv
 
 load_dotenv()
 
-import domain.primitives.file as file
-import domain.primitives.time as time
-import domain.primitives.control as control
-import domain.core.memory as memory
+from domain.core.store import MemoryStore, create_memory_store
+from domain.core.writer import MemoryWriter
+from domain.groups import create_registry
 
+from llm.checkpoint import CheckpointSettings, CheckpointStore
+from llm.openai.cache import EmbeddingCache
+from llm.tracing import JsonlSink, PrometheusSink, tracer
 from llm.session import (
     Session,
-    Param,
     SessionEndError,
-    GPT3_5_FUNCTION,
-    GPT4O_FUNCTION,
     GPT4O_MINI,
     SessionResponseContext,
-    GPT3_5_FUNCTION_16K,
-    SessionGroup,
+    configure_logging,
 )
 
 from colorama import Fore, Style
 
 
 def print_response(message: SessionResponseContext) -> None:
-    print(
-        f"{Fore.BLUE}Aeris {Style.RESET_ALL}{Style.DIM}({message.model}) {Style.NORMAL}{Fore.BLUE} >> {Style.RESET_ALL} {message.content}"
-    )
+    if message.first:
+        print(
+            f"{Fore.BLUE}Aeris {Style.RESET_ALL}{Style.DIM}({message.model}) {Style.NORMAL}{Fore.BLUE} >> {Style.RESET_ALL} ",
+            end="",
+        )
 
+    print(message.delta, end="\n" if message.finished else "", flush=True)
+
+
+configure_logging()
 
 if not (token := os.getenv("OPENAI_API_KEY")):
     raise Exception("'OPENAI_API_KEY not found")
 
+if trace_path := os.getenv("AERIS_TRACE_PATH"):
+    tracer.add_sink(JsonlSink(trace_path))
+
+if metrics_port := os.getenv("AERIS_METRICS_PORT"):
+    metrics = PrometheusSink()
+    metrics.serve(int(metrics_port))
+    tracer.add_sink(metrics)
+
+# The conversation is resumed after a restart when checkpointing is configured
+checkpoints = CheckpointStore() if CheckpointSettings().path else None
+
 session = Session(
-    token=token, default_model=GPT4O_MINI, response_callback=print_response
+    token=token,
+    default_model=GPT4O_MINI,
+    response_callback=print_response,
+    embedding_cache=EmbeddingCache(path=os.getenv("EMBEDDING_CACHE_PATH")),
+    base_url=os.getenv("OPENAI_BASE_URL"),
+    stream=True,
+    checkpoint=checkpoints.open("main") if checkpoints else None,
 )
 
 
-session.add_group(time.group)
-session.add_group(file.group)
-session.add_group(control.group)
-session.add_group(memory.group)
-session.add_group(room.group)
+# The backend and its driver are only loaded once a memory is recalled or written
+memory_store = create_memory_store(lazy=True)
+session.provide(MemoryStore, memory_store)
+
+# Memories are stored in the background, the queue is drained before the session ends
+memory_writer = MemoryWriter(session.client, memory_store)
+session.provide(MemoryWriter, memory_writer)
+session.on_end(memory_writer.flush)
+
+house = HouseState()
+session.provide(HouseState, house)
+
+create_registry().add_to(session)
 
 
 def main() -> None:
+    ended = False
+
     try:
         while True:
             text = input(f"{Fore.GREEN}User >> {Style.RESET_ALL}")
             session.make_request(text)
     except SessionEndError:
-        pass
+        ended = True
     except KeyboardInterrupt:
         pass
+    finally:
+        session.close()
+
+        if checkpoints:
+            # An ended chat has been remembered, the next run starts a fresh one
+            if ended:
+                checkpoints.delete("main")
+
+            checkpoints.close()
+
+        memory_writer.close()
+        memory_store.close()
+        house.close()
+        tracer.close()
 
     print("\n-- Done --")
 
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+from typing import Any
+
+from aiohttp import WSMsgType, web
+from dotenv import load_dotenv
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+load_dotenv()
+
+from domain.core.store import MemoryStore, create_memory_store
+from domain.core.writer import MemoryWriter
+from domain.groups import create_registry
+from domain.home.state import HouseState
+from llm.checkpoint import CheckpointSettings, CheckpointStore
+from llm.manager import SessionManager
+from llm.openai.cache import EmbeddingCache
+from llm.session import (
+    GPT4O_MINI,
+    LOCATION,
+    USER_NAME,
+    Session,
+    SessionEndError,
+    SessionResponseContext,
+    build_system_prompt,
+    configure_logging,
+)
+from llm.tracing import JsonlSink, PrometheusSink, tracer
+
+log = logging.getLogger(__name__)
+
+
+class ServerSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="AERIS_SERVER_")
+
+    host: str = "127.0.0.1"
+    port: int = 8080
+    # Seconds a session may go unused before it is evicted
+    idle_timeout: float = 900.0
+    eviction_interval: float = 60.0
+    max_sessions: int = 1_000
+    # Max number of turns a single tenant can have running at once across all of its sessions
+    tenant_concurrency: int = 2
+
+
+manager_key = web.AppKey("manager", SessionManager)
+
+
+def create_template(token: str, house: HouseState, memory_store: MemoryStore) -> Session:
+    """
+    Builds the session every hosted conversation is created from. It owns the pooled clients and holds the injected
+    dependencies and tool registrations all conversations share
+    """
+    session = Session(
+        token=token,
+        default_model=GPT4O_MINI,
+        response_callback=None,
+        embedding_cache=EmbeddingCache(path=os.getenv("EMBEDDING_CACHE_PATH")),
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        stream=True,
+    )
+
+    session.provide(MemoryStore, memory_store)
+    session.provide(HouseState, house)
+
+    create_registry().add_to(session)
+
+    return session
+
+
+async def create_session(request: web.Request) -> web.Response:
+    manager = request.app[manager_key]
+    body: dict[str, Any] = await request.json() if request.can_read_body else {}
+
+    system_prompt = body.get("system_prompt") or build_system_prompt(
+        body.get("user_name") or USER_NAME, body.get("location") or LOCATION
+    )
+
+    try:
+        managed = manager.create(id=body.get("id"), tenant=body.get("tenant"), system_prompt=system_prompt)
+    except ValueError as e:
+        raise web.HTTPConflict(text=str(e))
+    except RuntimeError as e:
+        raise web.HTTPServiceUnavailable(text=str(e))
+
+    return web.json_response({"id": managed.id, "tenant": managed.tenant}, status=201)
+
+
+async def send_message(request: web.Request) -> web.Response:
+    manager = request.app[manager_key]
+    id = request.match_info["id"]
+    body = await request.json()
+    message = body["content"]
+
+    try:
+        managed = manager.get(id)
+    except RuntimeError as e:
+        # There is no room to resume the session
+        raise web.HTTPServiceUnavailable(text=str(e))
+
+    if not managed:
+        raise web.HTTPNotFound(text=f"No session {id}")
+
+    try:
+        content = await manager.make_request(id, message)
+    except SessionEndError:
+        return web.json_response({"content": None, "ended": True})
+    except KeyError:
+        # Evicted or removed while the turn waited for it
+        raise web.HTTPNotFound(text=f"No session {id}")
+
+    return web.json_response({"content": content, "ended": False})
+
+
+async def delete_session(request: web.Request) -> web.Response:
+    manager = request.app[manager_key]
+    id = request.match_info["id"]
+
+    if not manager.get(id):
+        raise web.HTTPNotFound(text=f"No session {id}")
+
+    manager.remove(id)
+
+    return web.Response(status=204)
+
+
+async def session_socket(request: web.Request) -> web.WebSocketResponse:
+    """
+    Each text message received is a turn, the response is streamed back as delta events followed by a response event.
+    A turn that fails sends an error event and closes the socket
+    """
+    manager = request.app[manager_key]
+    id = request.match_info["id"]
+
+    if not manager.get(id):
+        raise web.HTTPNotFound(text=f"No session {id}")
+
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+
+    async for message in ws:
+        if message.type != WSMsgType.TEXT:
+            continue
+
+        # The callback fires inside the turn, a sender task forwards the deltas so the turn never waits on the socket
+        deltas: asyncio.Queue[SessionResponseContext | None] = asyncio.Queue()
+        sender = asyncio.create_task(_send_deltas(ws, deltas))
+
+        try:
+            content = await manager.make_request(id, message.data, deltas.put_nowait)
+
+            deltas.put_nowait(None)
+            await sender
+            await ws.send_json({"type": "response", "content": content})
+        except SessionEndError:
+            deltas.put_nowait(None)
+            await sender
+            await ws.send_json({"type": "ended"})
+            break
+        except KeyError:
+            await ws.send_json({"type": "error", "error": f"No session {id}"})
+            break
+        except Exception as e:
+            # e.g. the api failed or timed out, the client is told before the socket is closed
+            log.exception(f"turn of session {id} failed")
+            await ws.send_json({"type": "error", "error": str(e)})
+            break
+        finally:
+            # Deltas of a turn that failed are not sent
+            if not sender.done():
+                sender.cancel()
+
+    await ws.close()
+
+    return ws
+
+
+async def _send_deltas(ws: web.WebSocketResponse, deltas: "asyncio.Queue[SessionResponseContext | None]") -> None:
+    while context := await deltas.get():
+        await ws.send_json(
+            {"type": "delta", "model": context.model, "delta": context.delta, "finished": context.finished}
+        )
+
+
+def create_app(
+    template: Session,
+    settings: ServerSettings | None = None,
+    checkpoints: CheckpointStore | None = None,
+) -> web.Application:
+    settings = settings or ServerSettings()
+    manager = SessionManager(
+        template,
+        idle_timeout=settings.idle_timeout,
+        max_sessions=settings.max_sessions,
+        tenant_concurrency=settings.tenant_concurrency,
+        checkpoints=checkpoints,
+    )
+
+    app = web.Application()
+    app[manager_key] = manager
+
+    app.router.add_post("/sessions", create_session)
+    app.router.add_post("/sessions/{id}/messages", send_message)
+    app.router.add_delete("/sessions/{id}", delete_session)
+    app.router.add_get("/sessions/{id}/ws", session_socket)
+
+    async def eviction(app: web.Application) -> Any:
+        task = asyncio.create_task(manager.run_eviction(settings.eviction_interval))
+        yield
+        task.cancel()
+
+        manager.close()
+        await template.aclose()
+
+    app.cleanup_ctx.append(eviction)
+
+    return app
+
+
+def main() -> None:
+    configure_logging()
+
+    if not (token := os.getenv("OPENAI_API_KEY")):
+        raise Exception("'OPENAI_API_KEY not found")
+
+    if trace_path := os.getenv("AERIS_TRACE_PATH"):
+        tracer.add_sink(JsonlSink(trace_path))
+
+    if metrics_port := os.getenv("AERIS_METRICS_PORT"):
+        metrics = PrometheusSink()
+        metrics.serve(int(metrics_port))
+        tracer.add_sink(metrics)
+
+    settings = ServerSettings()
+    memory_store = create_memory_store()
+    house = HouseState()
+
+    # Conversations survive a restart when checkpointing is configured
+    checkpoints = CheckpointStore() if CheckpointSettings().path else None
+
+    template = create_template(token, house, memory_store)
+
+    # Memories are stored in the background from the templates client, every conversation shares the queue
+    memory_writer = MemoryWriter(template.client, memory_store)
+    template.provide(MemoryWriter, memory_writer)
+    template.on_end(memory_writer.flush)
+
+    app = create_app(template, settings, checkpoints)
+    # Drained on shutdown while the templates client is still open, it is closed in the apps cleanup
+    app.on_shutdown.append(lambda app: asyncio.to_thread(memory_writer.close))
+
+    try:
+        web.run_app(
+            app,
+            host=settings.host,
+            port=settings.port,
+        )
+    finally:
+        if checkpoints:
+            checkpoints.close()
+
+        memory_store.close()
+        house.close()
+        tracer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+from typing import Iterator
+
+import pytest
+
+from bench.server import MockOpenAIServer
+from llm.session import GPT4O_MINI, Session
+
+
+@pytest.fixture
+def mock_api() -> Iterator[MockOpenAIServer]:
+    server = MockOpenAIServer(dimensions=8).start()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def session(mock_api: MockOpenAIServer) -> Iterator[Session]:
+    session = Session(token="test", default_model=GPT4O_MINI, response_callback=None, base_url=mock_api.url)
+    yield session
+    session.close()
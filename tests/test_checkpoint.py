@@ -0,0 +1,111 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from bench.server import MockOpenAIServer, tool_call
+from llm.checkpoint import CheckpointSettings, CheckpointStore
+from llm.session import Session, SessionGroup
+
+
+def contents(session: Session) -> list[str | None]:
+    return [message.content for message in session.messages if message.role != "system"]
+
+
+@pytest.mark.parametrize("snapshot_every", [1_000, 3])
+def test_resume_after_a_torn_tail(
+    session: Session, mock_api: MockOpenAIServer, tmp_path: Path, snapshot_every: int
+) -> None:
+    settings = CheckpointSettings(path=str(tmp_path), snapshot_every=snapshot_every)
+    mock_api.queue(
+        {"role": "assistant", "content": "first answer"},
+        {"role": "assistant", "content": "second answer"},
+        {"role": "assistant", "content": "third answer"},
+    )
+
+    checkpoints = CheckpointStore(settings)
+    conversation = session.new_conversation(checkpoint=checkpoints.open("resumed"))
+    conversation.make_request("first")
+    conversation.make_request("second")
+    conversation.close()
+    checkpoints.close()
+
+    # A crash part way through writing the last message
+    log_path = max(
+        (entry.path for entry in os.scandir(tmp_path / "resumed") if entry.name.startswith("log.")),
+        key=os.path.getmtime,
+    )
+    os.truncate(log_path, os.path.getsize(log_path) - 5)
+
+    checkpoints = CheckpointStore(settings)
+    conversation = session.new_conversation(checkpoint=checkpoints.open("resumed"))
+
+    assert contents(conversation) == ["first", "first answer", "second"]
+
+    conversation.make_request("again")
+    conversation.close()
+    checkpoints.close()
+
+    checkpoints = CheckpointStore(settings)
+    conversation = session.new_conversation(checkpoint=checkpoints.open("resumed"))
+
+    assert contents(conversation) == ["first", "first answer", "second", "again", "third answer"]
+
+    conversation.close()
+    checkpoints.close()
+
+
+def test_resume_answers_tool_calls_a_torn_tail_cut_off(
+    session: Session, mock_api: MockOpenAIServer, tmp_path: Path
+) -> None:
+    group = SessionGroup()
+
+    @group.function("Reads a sensor")
+    def read_sensor() -> str:
+        return "20 degrees"
+
+    session.add_group(group)
+    settings = CheckpointSettings(path=str(tmp_path))
+    mock_api.queue(
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [tool_call("1", "read_sensor", {}), tool_call("2", "read_sensor", {})],
+        },
+        {"role": "assistant", "content": "it is warm"},
+        {"role": "assistant", "content": "still warm"},
+    )
+
+    checkpoints = CheckpointStore(settings)
+    conversation = session.new_conversation(checkpoint=checkpoints.open("tools"))
+    conversation.make_request("how warm is it?")
+    conversation.close()
+    checkpoints.close()
+
+    # A crash while the second tool result was being written, the answer after it never made it
+    log_path = tmp_path / "tools" / "log.0.jsonl"
+    lines = log_path.read_bytes().splitlines(keepends=True)
+    log_path.write_bytes(b"".join(lines[:4]) + lines[4][:10])
+
+    checkpoints = CheckpointStore(settings)
+    conversation = session.new_conversation(checkpoint=checkpoints.open("tools"))
+
+    results = [message for message in conversation.messages if message.role == "tool"]
+    assert [result.tool_call_id for result in results] == ["1", "2"]
+    assert results[0].content == "20 degrees"
+    assert "interrupted" in (results[1].content or "")
+
+    assert conversation.make_request("and now?") == "still warm"
+    conversation.close()
+    checkpoints.close()
+
+    # The filled in result was logged, resuming again does not add another
+    checkpoints = CheckpointStore(settings)
+    conversation = session.new_conversation(checkpoint=checkpoints.open("tools"))
+
+    assert [message.role for message in conversation.messages] == [
+        "system", "user", "assistant", "tool", "tool", "user", "assistant"
+    ]
+
+    conversation.close()
+    checkpoints.close()
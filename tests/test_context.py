@@ -0,0 +1,40 @@
+import threading
+
+from bench.server import MockOpenAIServer
+from llm.history import to_record
+from llm.openai.models.chat import ChatMessage
+from llm.session import GPT3_5_FUNCTION, ContextWindow, Session, TokenCounter
+
+
+def test_small_window_model_keeps_room_for_history() -> None:
+    window = ContextWindow()
+    history = [
+        to_record(ChatMessage(role="system", content="sys")),
+        to_record(ChatMessage(role="user", content="what is the weather today?")),
+        to_record(ChatMessage(role="assistant", content="sunny")),
+        to_record(ChatMessage(role="user", content="and tomorrow?")),
+    ]
+
+    assert window.budget(GPT3_5_FUNCTION) == 4_096 - 1_024
+    assert [message.content for message in window.select(GPT3_5_FUNCTION, history).messages] == [
+        "sys",
+        "what is the weather today?",
+        "sunny",
+        "and tomorrow?",
+    ]
+
+
+def test_encoding_is_loaded_off_the_event_loop(session: Session, mock_api: MockOpenAIServer) -> None:
+    threads: list[threading.Thread] = []
+
+    class RecordingCounter(TokenCounter):
+        def _encoding(self, model: str) -> None:
+            if model not in self._encodings:
+                threads.append(threading.current_thread())
+                self._encodings[model] = None
+
+    session.context_window.counter = RecordingCounter()
+    mock_api.queue({"role": "assistant", "content": "hi"})
+
+    assert session.make_request("hello") == "hi"
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,65 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from domain.core.local import RECORDS_FILE, VECTORS_FILE, LocalMemoryStore
+from domain.core.store import MemorySettings
+
+
+@pytest.fixture
+def settings(tmp_path: Path) -> MemorySettings:
+    return MemorySettings(backend="local", local_path=str(tmp_path))
+
+
+def test_reload_keeps_memories(settings: MemorySettings) -> None:
+    store = LocalMemoryStore(settings)
+    assert store.insert([1.0, 0.0], "first", "the first memory", keywords=["lamp"]) == 1
+    store.insert_many([([0.0, 1.0], "second", "the second memory", ["door"])])
+    store.close()
+
+    store = LocalMemoryStore(settings)
+
+    assert store.get_complete(2) == "the second memory"
+    assert store.nearest_summaries([0.1, 0.9], limit=1) == [(2, "second")]
+    assert [id for id, *_ in store.keyword_search(["lamp"])] == [1]
+    assert store.insert([1.0, 1.0], "third", "the third memory") == 3
+
+
+def test_reload_drops_a_torn_records_tail(settings: MemorySettings) -> None:
+    store = LocalMemoryStore(settings)
+    store.insert([1.0, 0.0], "first", "the first memory")
+    store.insert([0.0, 1.0], "second", "the second memory")
+
+    # A crash while the second record was being written
+    records_path = os.path.join(settings.local_path, RECORDS_FILE)
+    os.truncate(records_path, os.path.getsize(records_path) - 5)
+
+    store = LocalMemoryStore(settings)
+
+    assert store.get_complete(1) == "the first memory"
+    assert store.get_complete(2) is None
+    assert os.path.getsize(os.path.join(settings.local_path, VECTORS_FILE)) == 2 * 4
+
+    assert store.insert([0.0, 1.0], "again", "the memory written again") == 2
+    assert store.nearest_summaries([0.0, 1.0], limit=1) == [(2, "again")]
+
+
+def test_reload_drops_records_whose_vectors_are_torn(settings: MemorySettings) -> None:
+    store = LocalMemoryStore(settings)
+    store.insert([1.0, 0.0], "first", "the first memory")
+    store.insert([0.0, 1.0], "second", "the second memory")
+
+    # The second vector only partially reached the disk
+    vectors_path = os.path.join(settings.local_path, VECTORS_FILE)
+    os.truncate(vectors_path, os.path.getsize(vectors_path) - 3)
+
+    store = LocalMemoryStore(settings)
+
+    assert store.get_complete(2) is None
+    assert os.path.getsize(vectors_path) == 2 * 4
+
+    assert store.insert([0.0, 1.0], "again", "the memory written again") == 2
+
+    store = LocalMemoryStore(settings)
+    assert store.nearest_memories([0.0, 1.0], limit=1) == [(2, "again", "the memory written again", 0.0)]
@@ -0,0 +1,52 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from llm.checkpoint import CheckpointSettings, CheckpointStore
+from llm.manager import SessionManager
+from llm.session import Session
+
+
+def test_full_manager_refuses_rather_than_drop_an_unsaved_session(session: Session) -> None:
+    manager = SessionManager(session, max_sessions=1)
+    manager.create(id="first")
+
+    with pytest.raises(RuntimeError):
+        manager.create(id="second")
+
+    assert manager.get("first")
+    manager.close()
+
+
+def test_full_manager_evicts_a_checkpointed_session(session: Session, tmp_path: Path) -> None:
+    checkpoints = CheckpointStore(CheckpointSettings(path=str(tmp_path)))
+    manager = SessionManager(session, max_sessions=1, checkpoints=checkpoints)
+
+    manager.create(id="first")
+    manager.create(id="second")
+
+    assert len(manager) == 1
+    assert manager.get("first")
+    assert len(manager) == 1
+
+    manager.close()
+    checkpoints.close()
+
+
+def test_turn_waiting_on_a_removed_session_raises_key_error(session: Session) -> None:
+    manager = SessionManager(session)
+    managed = manager.create(id="first")
+
+    async def run() -> None:
+        await managed.lock.acquire()
+        turn = asyncio.create_task(manager.make_request("first", "hello"))
+        await asyncio.sleep(0)
+
+        manager.remove("first")
+        managed.lock.release()
+
+        with pytest.raises(KeyError):
+            await turn
+
+    asyncio.run(run())
@@ -0,0 +1,19 @@
+import pytest
+
+from domain.core.memory import RRF_K, fuse
+
+
+def test_fuse_ranks_memories_found_by_both_searches_first() -> None:
+    keyword_hits = [(1, "keys", "", 2), (2, "lamp", "", 1)]
+    nearest = [(3, "door", "", 0.1), (2, "lamp", "", 0.2), (1, "keys", "", 0.3)]
+
+    fused = fuse(keyword_hits, nearest)
+
+    assert [id for id, *_ in fused] == [1, 2, 3]
+    assert fused[0][3] == pytest.approx(1 / (RRF_K + 1) + 1 / (RRF_K + 3))
+    assert fused[2] == (3, "door", "", pytest.approx(1 / (RRF_K + 1)))
+
+
+def test_fuse_of_a_single_ranking_keeps_its_order() -> None:
+    assert [id for id, *_ in fuse([(5, "a", "", 0.3), (4, "b", "", 0.9)])] == [5, 4]
+    assert fuse([], []) == []
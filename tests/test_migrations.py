@@ -0,0 +1,91 @@
+import sys
+from typing import Any, Iterator
+
+import psycopg
+import pytest
+
+from bench.server import MockOpenAIServer
+from domain.core import migrations
+
+
+class FakeResult:
+    def __init__(self, rows: list[tuple[Any, ...]]) -> None:
+        self.rows = rows
+
+    def fetchall(self) -> list[tuple[Any, ...]]:
+        return self.rows
+
+    def fetchone(self) -> tuple[Any, ...] | None:
+        return self.rows[0] if self.rows else None
+
+
+class FakeConnection:
+    """
+    Stands in for a psycopg connection, statements open a transaction unless in autocommit mode and autocommit
+    can only be switched on while no transaction is open, like psycopg
+    """
+
+    def __init__(self, stale_rows: list[tuple[int, str]]) -> None:
+        self.stale_rows = stale_rows
+        self.statements: list[str] = []
+        self.in_transaction = False
+        self._autocommit = False
+
+    @property
+    def autocommit(self) -> bool:
+        return self._autocommit
+
+    @autocommit.setter
+    def autocommit(self, value: bool) -> None:
+        if self.in_transaction:
+            raise psycopg.ProgrammingError("can't change 'autocommit' now: connection in transaction status INTRANS")
+
+        self._autocommit = value
+
+    def execute(self, query: str, params: Any = None) -> FakeResult:
+        self.statements.append(query)
+        self.in_transaction = not self._autocommit
+
+        if query.startswith("SELECT id,summary"):
+            rows, self.stale_rows = self.stale_rows, []
+            return FakeResult(list(rows))
+
+        return FakeResult([])
+
+    def cursor(self) -> "FakeConnection":
+        return self
+
+    def executemany(self, query: str, params: Any) -> None:
+        self.statements.append(query)
+        self.in_transaction = True
+
+    def commit(self) -> None:
+        self.in_transaction = False
+
+    def __enter__(self) -> "FakeConnection":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def connection(mock_api: MockOpenAIServer, monkeypatch: pytest.MonkeyPatch) -> Iterator[FakeConnection]:
+    conn = FakeConnection([(1, "the lamp is broken"), (2, "the door is open")])
+
+    monkeypatch.setattr(psycopg, "connect", lambda dsn: conn)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_BASE_URL", mock_api.url)
+    monkeypatch.setenv("AERIS_MEMORY_EMBEDDING_DIMENSIONS", "8")
+    monkeypatch.setenv("AERIS_MEMORY_INDEX_TYPE", "hnsw")
+
+    yield conn
+
+
+def test_reembed_then_builds_the_vector_index(connection: FakeConnection, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["migrations", "reembed"])
+
+    migrations.main()
+
+    assert sum(statement.startswith("UPDATE memory") for statement in connection.statements) == 1
+    assert any(statement.startswith("CREATE INDEX CONCURRENTLY") for statement in connection.statements)
@@ -0,0 +1,29 @@
+import asyncio
+from typing import Any
+
+import pytest
+from aiohttp import WSMsgType
+from aiohttp.test_utils import TestClient, TestServer
+
+from llm.session import Session
+from server import create_app
+
+
+def test_failed_socket_turn_sends_an_error(session: Session, monkeypatch: pytest.MonkeyPatch) -> None:
+    async def send_chat(*args: Any, **kwargs: Any) -> Any:
+        raise TimeoutError("the api timed out")
+
+    monkeypatch.setattr(session._async_client, "send_chat", send_chat)
+
+    async def run() -> None:
+        async with TestClient(TestServer(create_app(session))) as client:
+            response = await client.post("/sessions", json={"id": "failing"})
+            assert response.status == 201
+
+            ws = await client.ws_connect("/sessions/failing/ws")
+            await ws.send_str("hello")
+
+            assert await ws.receive_json() == {"type": "error", "error": "the api timed out"}
+            assert (await ws.receive()).type in (WSMsgType.CLOSE, WSMsgType.CLOSED)
+
+    asyncio.run(run())
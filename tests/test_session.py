@@ -0,0 +1,156 @@
+import asyncio
+import time
+from typing import Annotated
+
+import pytest
+
+from bench.server import MockOpenAIServer, tool_call
+from llm.session import Inject, Param, Session, SessionEndError, SessionGroup
+
+
+def nested_prompt_group() -> SessionGroup:
+    group = SessionGroup()
+
+    @group.function("Asks a forked session a question")
+    def ask_fork(
+        question: Annotated[str, Param(description="The question to ask")],
+        session: Annotated[Session, Inject(Session)],
+    ) -> str:
+        return session.fork().make_request(question) or ""
+
+    return group
+
+
+def test_sync_tool_prompts_a_fork(session: Session, mock_api: MockOpenAIServer) -> None:
+    session.add_group(nested_prompt_group())
+    mock_api.queue(
+        {"role": "assistant", "content": None, "tool_calls": [tool_call("1", "ask_fork", {"question": "inner?"})]},
+        {"role": "assistant", "content": "inner answer"},
+        {"role": "assistant", "content": "outer answer"},
+    )
+
+    assert session.make_request("outer?") == "outer answer"
+    assert [message.content for message in session.messages if message.role == "tool"] == ["inner answer"]
+
+
+def test_sync_tool_prompts_a_fork_of_an_async_session(session: Session, mock_api: MockOpenAIServer) -> None:
+    session.add_group(nested_prompt_group())
+    mock_api.queue(
+        {"role": "assistant", "content": None, "tool_calls": [tool_call("1", "ask_fork", {"question": "inner?"})]},
+        {"role": "assistant", "content": "inner answer"},
+        {"role": "assistant", "content": "outer answer"},
+    )
+
+    async def run() -> str | None:
+        try:
+            return await session.make_request_async("outer?")
+        finally:
+            await session.aclose()
+
+    assert asyncio.run(run()) == "outer answer"
+
+
+def test_session_ends_after_sibling_tool_calls_finish(session: Session, mock_api: MockOpenAIServer) -> None:
+    group = SessionGroup()
+    events: list[str] = []
+
+    @group.function("Ends the chat")
+    def end_chat() -> str:
+        raise SessionEndError()
+
+    @group.function("Stores a memory")
+    async def store_memory() -> str:
+        await asyncio.sleep(0.05)
+        events.append("stored")
+        return "stored"
+
+    session.add_group(group)
+    session.on_end(lambda: events.append("ended"))
+    mock_api.queue(
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [tool_call("1", "end_chat", {}), tool_call("2", "store_memory", {})],
+        }
+    )
+
+    with pytest.raises(SessionEndError):
+        session.make_request("bye")
+
+    assert events == ["stored", "ended"]
+
+
+def test_closing_a_fork_leaves_the_parent_open(session: Session, mock_api: MockOpenAIServer) -> None:
+    mock_api.queue(
+        {"role": "assistant", "content": "first"},
+        {"role": "assistant", "content": "forked"},
+        {"role": "assistant", "content": "second"},
+    )
+    assert session.make_request("one") == "first"
+
+    forked = session.fork()
+    assert forked.make_request("two") == "forked"
+    forked.close()
+
+    assert session.make_request("three") == "second"
+    assert [message.content for message in session.messages if message.role == "assistant"] == ["first", "second"]
+
+
+def test_fork_has_its_own_pins_and_tool_limits(session: Session) -> None:
+    group = SessionGroup()
+
+    @group.function("Reads a sensor", concurrency=1)
+    def read_sensor() -> str:
+        return "20 degrees"
+
+    session.add_group(group)
+    forked = session.fork()
+    message = forked.messages[0]
+
+    forked.context_window.pin(message)
+
+    assert forked.context_window.is_pinned(message)
+    assert not session.context_window.is_pinned(message)
+
+    function = session.functions["read_sensor"]
+    assert forked._tool_semaphore(function) is not session._tool_semaphore(function)
+
+
+def test_concurrent_calls_load_a_lazy_group_once(session: Session, mock_api: MockOpenAIServer) -> None:
+    loads: list[SessionGroup] = []
+
+    def sensor_group() -> SessionGroup:
+        group = SessionGroup()
+
+        @group.function("Reads the temperature")
+        def read_temperature() -> str:
+            return "20 degrees"
+
+        @group.function("Reads the humidity")
+        def read_humidity() -> str:
+            return "40 percent"
+
+        return group
+
+    def load() -> SessionGroup:
+        time.sleep(0.05)
+        loads.append(sensor_group())
+        return loads[-1]
+
+    compiled = Session(token="test", default_model=session.current_model, response_callback=None, base_url=mock_api.url)
+    schemas = [function.plan.schema_json for function in compiled.add_group(sensor_group())]
+    compiled.close()
+
+    session.add_lazy_group(schemas, load)
+    mock_api.queue(
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [tool_call("1", "read_temperature", {}), tool_call("2", "read_humidity", {})],
+        },
+        {"role": "assistant", "content": "comfortable"},
+    )
+
+    assert session.make_request("how is the air?") == "comfortable"
+    assert len(loads) == 1
+    assert [message.content for message in session.messages if message.role == "tool"] == ["20 degrees", "40 percent"]
@@ -0,0 +1,81 @@
+import os
+from pathlib import Path
+from typing import Annotated
+
+from bench.server import MockOpenAIServer, tool_call
+from llm.session import Param, Session, SessionGroup
+from llm.tool_cache import MISS, CachePolicy, ToolResultCache, file_mtime
+
+
+def test_invalidate_drops_every_entry() -> None:
+    cache = ToolResultCache(CachePolicy())
+    _, generation = cache.get({"room": 1})
+    cache.put({"room": 1}, "on", generation)
+    _, generation = cache.get({"room": 2})
+    cache.put({"room": 2}, "off", generation)
+
+    assert cache.get({"room": 1})[0] == "on"
+
+    cache.invalidate()
+
+    assert cache.get({"room": 1})[0] is MISS
+    assert cache.get({"room": 2})[0] is MISS
+    assert cache.stats.invalidations == 1
+
+
+def test_result_of_a_call_started_before_an_invalidation_is_not_stored() -> None:
+    cache = ToolResultCache(CachePolicy())
+    _, generation = cache.get({"room": 1})
+
+    cache.invalidate()
+    cache.put({"room": 1}, "stale", generation)
+
+    assert cache.get({"room": 1})[0] is MISS
+
+
+def test_changed_stamp_invalidates_an_entry(tmp_path: Path) -> None:
+    path = tmp_path / "notes.txt"
+    path.write_text("first")
+
+    cache = ToolResultCache(CachePolicy(stamp=file_mtime("file_path")))
+    arguments = {"file_path": str(path)}
+    _, generation = cache.get(arguments)
+    cache.put(arguments, "first", generation)
+
+    assert cache.get(arguments)[0] == "first"
+
+    path.write_text("second")
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 1_000_000))
+
+    assert cache.get(arguments)[0] is MISS
+
+
+def test_writing_function_invalidates_the_cached_reader(session: Session, mock_api: MockOpenAIServer) -> None:
+    group = SessionGroup()
+    state = {"light": "off"}
+    reads: list[str] = []
+
+    @group.function("Reads the light", cache=CachePolicy())
+    def read_light() -> str:
+        reads.append(state["light"])
+        return state["light"]
+
+    @group.function("Sets the light", invalidates=["read_light"])
+    def set_light(value: Annotated[str, Param(description="on or off")]) -> str:
+        state["light"] = value
+        return value
+
+    session.add_group(group)
+    mock_api.queue(
+        {"role": "assistant", "content": None, "tool_calls": [tool_call("1", "read_light", {})]},
+        {"role": "assistant", "content": None, "tool_calls": [tool_call("2", "read_light", {})]},
+        {"role": "assistant", "content": None, "tool_calls": [tool_call("3", "set_light", {"value": "on"})]},
+        {"role": "assistant", "content": None, "tool_calls": [tool_call("4", "read_light", {})]},
+        {"role": "assistant", "content": "done"},
+    )
+
+    assert session.make_request("toggle the light") == "done"
+
+    assert reads == ["off", "on"]
+    assert [message.content for message in session.messages if message.role == "tool"] == ["off", "off", "on", "on"]
+    assert session.tool_cache_stats()["read_light"].invalidations == 1
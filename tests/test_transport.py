@@ -0,0 +1,120 @@
+import asyncio
+import socket
+import threading
+from typing import Iterator
+
+import pytest
+
+from llm.openai.transport import HttpxAsyncTransport, RequestsTransport, TransportConfig
+
+CONFIG = TransportConfig(max_retries=2, backoff_base=0.001, connect_timeout=0.5, read_timeout=0.2)
+
+
+def closed_port() -> int:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+
+@pytest.fixture
+def silent_server() -> Iterator[tuple[str, list[socket.socket]]]:
+    # Accepts connections and never answers, every request to it times out reading the response
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    accepted: list[socket.socket] = []
+
+    def accept() -> None:
+        while True:
+            try:
+                accepted.append(server.accept()[0])
+            except OSError:
+                return
+
+    threading.Thread(target=accept, daemon=True).start()
+
+    yield f"http://127.0.0.1:{server.getsockname()[1]}/", accepted
+
+    server.close()
+    for conn in accepted:
+        conn.close()
+
+
+def counting_config(retries: list[int]) -> TransportConfig:
+    # Records every retry the transport schedules instead of sleeping
+    config = TransportConfig(max_retries=2, connect_timeout=0.5)
+
+    def backoff(attempt: int, retry_after: str | None = None) -> float:
+        retries.append(attempt)
+        return 0.0
+
+    config.backoff = backoff  # type: ignore[method-assign]
+
+    return config
+
+
+def test_requests_retries_connect_errors() -> None:
+    retries: list[int] = []
+    transport = RequestsTransport(counting_config(retries))
+
+    with pytest.raises(Exception):
+        transport.post(f"http://127.0.0.1:{closed_port()}/", {}, b"")
+
+    assert retries == [0, 1]
+
+
+def test_requests_does_not_retry_read_timeouts(silent_server: tuple[str, list[socket.socket]]) -> None:
+    url, accepted = silent_server
+    transport = RequestsTransport(CONFIG)
+
+    with pytest.raises(Exception):
+        transport.post(url, {}, b"")
+
+    transport.close()
+    assert len(accepted) == 1
+
+
+def test_requests_retries_read_timeouts_when_enabled(silent_server: tuple[str, list[socket.socket]]) -> None:
+    url, accepted = silent_server
+    transport = RequestsTransport(
+        TransportConfig(max_retries=1, backoff_base=0.001, read_timeout=0.2, retry_read_errors=True)
+    )
+
+    with pytest.raises(Exception):
+        transport.post(url, {}, b"")
+
+    transport.close()
+    assert len(accepted) == 2
+
+
+def test_httpx_retries_connect_errors() -> None:
+    retries: list[int] = []
+
+    async def post() -> None:
+        transport = HttpxAsyncTransport(counting_config(retries))
+
+        with pytest.raises(Exception):
+            await transport.post(f"http://127.0.0.1:{closed_port()}/", {}, b"")
+
+        await transport.close()
+
+    asyncio.run(post())
+    assert retries == [0, 1]
+
+
+def test_httpx_does_not_retry_read_timeouts(silent_server: tuple[str, list[socket.socket]]) -> None:
+    url, accepted = silent_server
+
+    async def post() -> None:
+        transport = HttpxAsyncTransport(CONFIG)
+
+        with pytest.raises(Exception):
+            await transport.post(url, {}, b"")
+
+        await transport.close()
+
+    asyncio.run(post())
+    assert len(accepted) == 1
@@ -0,0 +1,89 @@
+import json
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import pytest
+
+from domain.core.local import LocalMemoryStore
+from domain.core.store import MemorySettings
+from domain.core.writer import MemoryWriter
+from llm.session import Session
+
+
+@pytest.fixture
+def settings(tmp_path: Path) -> MemorySettings:
+    return MemorySettings(
+        backend="local",
+        local_path=str(tmp_path / "memory"),
+        embedding_dimensions=8,
+        write_queue_path=str(tmp_path / "queue.jsonl"),
+        write_dead_letter_path=str(tmp_path / "dead_letter.jsonl"),
+        write_delay=0.0,
+        write_retry_delay=0.0,
+        write_max_attempts=2,
+    )
+
+
+class FailingStore(LocalMemoryStore):
+    def __init__(self, settings: MemorySettings, errors: list[Exception]) -> None:
+        super().__init__(settings)
+        self.errors = errors
+
+    def insert_many(self, rows: Iterable[tuple[Sequence[float], str, str, Sequence[str]]]) -> None:
+        if self.errors:
+            raise self.errors.pop(0)
+
+        super().insert_many(rows)
+
+
+def summaries(store: LocalMemoryStore) -> list[str]:
+    return [summary for _, summary, _, _ in store.keyword_search(["memory"], limit=10)]
+
+
+def test_replays_the_journal_on_start(session: Session, settings: MemorySettings) -> None:
+    entries = [
+        {"seq": 1, "summary": "written", "complete": "", "keywords": ["memory"], "queued_at": 0.0},
+        {"seq": 2, "summary": "queued", "complete": "", "keywords": ["memory"], "queued_at": 0.0},
+        {"done": 1},
+    ]
+    with open(settings.write_queue_path, "w") as f:
+        f.writelines(json.dumps(entry) + "\n" for entry in entries)
+        # The submit this belonged to never returned
+        f.write('{"seq": 3, "summ')
+
+    store = LocalMemoryStore(settings)
+    writer = MemoryWriter(session.client, store, settings)
+
+    assert writer.flush(timeout=10)
+    writer.submit("submitted", "", ["memory"])
+    writer.close()
+
+    assert sorted(summaries(store)) == ["queued", "submitted"]
+    assert open(settings.write_queue_path).read() == ""
+
+
+def test_moves_a_failing_batch_to_the_dead_letter_file(session: Session, settings: MemorySettings) -> None:
+    store = FailingStore(settings, [ValueError("bad row"), ValueError("bad row")])
+    writer = MemoryWriter(session.client, store, settings)
+
+    writer.submit("rejected", "", ["memory"])
+    assert writer.flush(timeout=10)
+    writer.submit("accepted", "", ["memory"])
+    writer.close()
+
+    assert summaries(store) == ["accepted"]
+    assert writer.stats().dead_lettered == 1
+    with open(settings.write_dead_letter_path) as f:
+        assert [json.loads(line)["summary"] for line in f] == ["rejected"]
+
+
+def test_retries_a_batch_until_the_backend_is_reachable(session: Session, settings: MemorySettings) -> None:
+    store = FailingStore(settings, [ConnectionError("refused")] * 4)
+    writer = MemoryWriter(session.client, store, settings)
+
+    writer.submit("delayed", "", ["memory"])
+    writer.close()
+
+    assert summaries(store) == ["delayed"]
+    assert writer.stats().failures == 4
+    assert writer.stats().dead_lettered == 0